@@ -0,0 +1,37 @@
+# startup benchmark : time needed to declare (and queue for refresh) many remote items
+# usage : python bench-declare.py [count]
+
+import sys
+import time
+import logging
+
+from digimat.saia import SAIANode
+
+count=100000
+if len(sys.argv)>1:
+    count=int(sys.argv[1])
+
+logging.basicConfig(level=logging.WARNING)
+logger=logging.getLogger('bench')
+logger.setLevel(logging.WARNING)
+
+# background task not started, nothing is sent on the network
+node=SAIANode(lid=253, port=15099, logger=logger, autostart=False)
+server=node.servers.declare('127.0.1.1')
+
+half=count//2
+
+t0=time.time()
+for index in range(half):
+    server.registers.declare(index)
+t1=time.time()
+server.flags.declareRange(0, count-half)
+t2=time.time()
+
+print('%d registers declared one by one in %.03fs (%.01fus/item)' % (half, t1-t0, (t1-t0)*1e6/max(1, half)))
+print('%d flags declared with declareRange() in %.03fs (%.01fus/item)' % (count-half, t2-t1, (t2-t1)*1e6/max(1, count-half)))
+print('total %d items in %.03fs' % (count, t2-t0))
+print(server.memory)
+print(server.memory.scheduler)
+
+node.stop()
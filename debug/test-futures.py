@@ -0,0 +1,67 @@
+"""
+readAsync()/writeAsync() issued while a request carrying the same item is in flight
+(loopback simulator farm, slow stations). Exit code 1 on failure.
+"""
+import sys
+import time
+import logging
+
+from digimat.saia import SAIANode
+from digimat.saia.simulator import SAIASimulatorFarm
+
+
+logging.basicConfig(level=logging.ERROR)
+logger=logging.getLogger('test')
+logger.setLevel(logging.ERROR)
+
+farm=SAIASimulatorFarm(4, port=15180, latency=0.2)
+farm.start()
+node=SAIANode(lid=253, port=15181, logger=logger, autostart=False)
+node.start()
+
+servers=farm.declareServers(node)
+servers[1].memory.setCompactStorage()
+servers[2].setWindow(4)
+servers[3].setWindow(4)
+servers[3].memory.setCompactStorage()
+for server in servers:
+    server.registers.declareRange(0, 8)
+time.sleep(2.0)
+
+failures=0
+for (server, station) in zip(servers, farm.stations()):
+    # second write pushed while the first one is in flight
+    f1=server.registers[5].writeAsync(1001)
+    time.sleep(0.05)
+    f2=server.registers[5].writeAsync(1002)
+    # the in flight write request carries registers 4..7
+    f3=server.registers[6].writeAsync(2001)
+    time.sleep(0.05)
+    f4=server.registers[6].writeAsync(2002)
+    try:
+        result=(f1.result(5), f2.result(5), f3.result(5), f4.result(5))
+        values=(station.registers[5].value, station.registers[6].value)
+        print(server.host, 'write', result, values)
+        assert values==(1002, 2002)
+    except:
+        failures+=1
+        print(server.host, 'write FAILED', f1, f2, f3, f4, station.registers[5].value, station.registers[6].value)
+
+    # read issued while a read of the item is in flight
+    station.registers[2].value=77
+    server.registers[2].refresh()
+    time.sleep(0.05)
+    f5=server.registers[2].readAsync()
+    try:
+        value=f5.result(5)
+        print(server.host, 'read', value)
+        assert value==77
+    except:
+        failures+=1
+        print(server.host, 'read FAILED', f5)
+
+node.stop()
+farm.stop()
+
+print('%d failures' % failures)
+sys.exit(1 if failures else 0)
@@ -1,4 +1,12 @@
 from __future__ import print_function  # Python 2/3 compatibility
+import sys
+
+
+if len(sys.argv)>1 and sys.argv[1]=='bench':
+    # python -m digimat.saia bench [options]
+    from digimat.saia.benchmark import main
+    sys.exit(main(sys.argv[2:]))
+
 from digimat.saia import SAIANode
 
 
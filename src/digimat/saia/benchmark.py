@@ -0,0 +1,357 @@
+"""
+Reproducible micro and end-to-end benchmarks (python -m digimat.saia bench)
+
+Every benchmark returns a dict of measures, each measure being
+{'count': operations, 'seconds': elapsed, 'rate': operations/s, 'us': microseconds/operation}.
+The whole report is JSON serializable, so that results can be stored and compared
+between releases (or between gateways).
+"""
+from __future__ import division
+
+import sys
+import time
+import json
+import random
+import logging
+import platform
+
+from .codec import decodeFrame
+from .codec import encodeRequest
+from .codec import encodeRequestInto
+from .codec import encodeReply
+from .codec import FRAME_MAXSIZE
+from .codec import FRAME_TYPE_RESPONSE
+from .crc import SAIACRC
+from .crc import SAIASBusCRC
+from .bitpack import packBooleans
+from .bitpack import unpackBooleans
+from .formaters import SAIAValueFormater
+from .formaters import SAIAValueFormaterFloat32
+from .formaters import SAIAValueFormaterSwappedFloat32
+from .formaters import SAIAValueFormaterInteger10
+from .formaters import SAIAValueFormaterFFP
+
+
+class SAIABenchmark(object):
+    """
+    Benchmark suite. Run all benchmarks with run(), or a selection of them with run(['crc', 'codec'])
+
+    >>> bench=SAIABenchmark(quick=True)
+    >>> report=bench.run()
+    >>> print(bench.toJSON())
+    """
+
+    BENCHMARKS = ('import', 'codec', 'crc', 'bitpack', 'formaters', 'declare', 'queue', 'polls')
+
+    def __init__(self, quick=False, port=15090, address='127.0.1.1', engine=None, logger=None):
+        if logger is None:
+            logger=logging.getLogger('SAIABENCH')
+            logger.addHandler(logging.NullHandler())
+            logger.propagate=False
+        self._logger=logger
+        # quick mode divides the iterations count by 10
+        self._scale=0.1 if quick else 1.0
+        self._port=int(port)
+        self._address=address
+        self._engine=engine
+        self._report=None
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def iterations(self, count):
+        return max(1, int(count*self._scale))
+
+    def measure(self, function, count):
+        """
+        Call function() count times and return the measure dict
+        """
+        timer=time.perf_counter
+        t0=timer()
+        for n in range(count):
+            function()
+        return self.result(count, timer()-t0)
+
+    def result(self, count, seconds):
+        seconds=max(seconds, 1e-9)
+        return {'count': count,
+            'seconds': round(seconds, 6),
+            'rate': round(count/seconds, 1),
+            'us': round(seconds*1e6/count, 3)}
+
+    def benchCodec(self):
+        count=self.iterations(200000)
+        payload=bytes(bytearray(range(128)))
+        reply=bytes(encodeReply(1, FRAME_TYPE_RESPONSE, payload))
+        buffer=bytearray(FRAME_MAXSIZE)
+
+        results={}
+        results['encodeRequest']=self.measure(lambda: encodeRequest(1, 10, 6, payload[:8]), count)
+        results['encodeRequestInto']=self.measure(lambda: encodeRequestInto(buffer, 0, 1, 10, 6, payload[:8]), count)
+        results['encodeReply']=self.measure(lambda: encodeReply(1, FRAME_TYPE_RESPONSE, payload), count)
+        results['decodeFrame']=self.measure(lambda: decodeFrame(reply), count)
+        return results
+
+    def benchCRC(self):
+        results={}
+        data=bytes(bytearray(n & 0xFF for n in range(FRAME_MAXSIZE)))
+        results['crc']=self.measure(lambda: SAIASBusCRC(data), self.iterations(100000))
+        results['crc']['engine']=SAIACRC.name
+        for name, us in SAIACRC.benchmark(size=FRAME_MAXSIZE, count=self.iterations(20000)).items():
+            results['crc.%s' % name]={'us': round(us, 3)}
+        return results
+
+    def benchBitpack(self):
+        count=self.iterations(50000)
+        random.seed(0)
+        values=[random.random()>0.5 for n in range(128)]
+        data=packBooleans(values)
+        valuesLarge=[random.random()>0.5 for n in range(4096)]
+        dataLarge=packBooleans(valuesLarge)
+
+        results={}
+        results['pack128']=self.measure(lambda: packBooleans(values), count)
+        results['unpack128']=self.measure(lambda: unpackBooleans(data, 128), count)
+        results['pack4096']=self.measure(lambda: packBooleans(valuesLarge), count//10)
+        results['unpack4096']=self.measure(lambda: unpackBooleans(dataLarge, 4096), count//10)
+        return results
+
+    def benchFormaters(self):
+        count=self.iterations(200000)
+        results={}
+        for formater in (SAIAValueFormater(), SAIAValueFormaterFloat32(), SAIAValueFormaterSwappedFloat32(),
+                SAIAValueFormaterInteger10(), SAIAValueFormaterFFP()):
+            value=formater.encode(21.5)
+            results[formater.__class__.__name__]=self.measure(lambda: formater.decode(value), count)
+        return results
+
+    def createNode(self, port):
+        # imported here as the node module is much heavier than the codec ones
+        from .node import SAIANode
+        return SAIANode(lid=253, port=port, logger=self.logger, autostart=False, scanner=False, engine=self._engine)
+
+    def benchDeclare(self):
+        count=self.iterations(50000)
+        results={}
+        for compact in (False, True):
+            node=self.createNode(self._port+1)
+            try:
+                server=node.servers.declare(self._address)
+                if compact:
+                    server.memory.setCompactStorage()
+                t0=time.perf_counter()
+                server.registers.declareRange(0, count)
+                results['compact' if compact else 'objects']=self.result(count, time.perf_counter()-t0)
+            finally:
+                node.stop()
+        return results
+
+    def benchQueue(self):
+        """
+        Pull queue churn : queue (twice, the second batch being de-duplicated) and drain declared items
+        """
+        count=self.iterations(2000)
+        node=self.createNode(self._port+1)
+        try:
+            server=node.servers.declare(self._address)
+            items=server.registers.declareRange(0, 1000)
+            queue=server.memory._queuePendingPull
+            queue.clear()
+
+            def churn():
+                queue.putItems(items)
+                queue.putItems(items)
+                queue.drain()
+
+            def single():
+                for item in items:
+                    queue.put(item)
+                while queue.get() is not None:
+                    pass
+
+            results={}
+            results['batch']=self.measure(churn, count//10)
+            results['batch']['items']=len(items)
+            results['single']=self.measure(single, count//20)
+            results['single']['items']=len(items)
+            return results
+        finally:
+            node.stop()
+
+    def benchPolls(self, duration=None):
+        """
+        End to end polls (request, reply, item update) against a loopback simulated station
+        """
+        from .simulator import SAIASimulatorFarm
+
+        if duration is None:
+            duration=max(0.5, 3.0*self._scale)
+
+        def setup(station):
+            for n in range(128):
+                station.registers[n].value=n
+
+        results={}
+        farm=SAIASimulatorFarm(1, address=self._address, port=self._port, setup=setup)
+        node=self.createNode(self._port+1)
+        try:
+            farm.start()
+            node.start()
+            server=farm.declareServers(node)[0]
+            items=server.registers.declareRange(0, 128)
+            item=items[0]
+            if item.read(3.0) is None:
+                self.logger.error('station %s is not responding' % server)
+                return results
+
+            # sequential round trips (one register per request)
+            count=0
+            t0=time.perf_counter()
+            while time.perf_counter()-t0<duration:
+                item.clearUpdated()
+                item.refresh(urgent=True)
+                if not item.waitUpdated(1.0):
+                    break
+                count+=1
+            results['roundtrip']=self.result(count, time.perf_counter()-t0)
+
+            # 128 registers refreshed together (multiple items per request)
+            count=0
+            t0=time.perf_counter()
+            while time.perf_counter()-t0<duration:
+                for item in items:
+                    item.clearUpdated()
+                server.registers.signalPullItems(items, urgent=True)
+                if not all(item.waitUpdated(1.0) for item in items):
+                    break
+                count+=len(items)
+            results['items']=self.result(count, time.perf_counter()-t0)
+            results['farm']=farm.stats()
+        finally:
+            node.stop()
+            farm.stop()
+        return results
+
+    def benchImport(self, module='digimat.saia'):
+        """
+        Import time of the package, measured in fresh interpreters (best of n runs, minus the
+        interpreter startup time), with the heaviest imported modules (python -X importtime)
+        """
+        import subprocess
+
+        def run(code, importtime=False):
+            command=[sys.executable]
+            if importtime:
+                command+=['-X', 'importtime']
+            t0=time.perf_counter()
+            process=subprocess.run(command+['-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return (time.perf_counter()-t0, process)
+
+        count=max(3, self.iterations(10))
+        baseline=min(run('pass')[0] for n in range(count))
+        elapsed=min(run('import %s' % module)[0] for n in range(count))
+
+        results={}
+        results[module]=self.result(1, max(0.0, elapsed-baseline))
+        results[module]['interpreter']=round(baseline, 6)
+
+        # -X importtime lines : "import time: self [us] | cumulative | imported package"
+        (t, process)=run('import %s' % module, True)
+        modules=[]
+        for line in process.stderr.decode('utf-8', 'replace').splitlines():
+            try:
+                fields=line.split('|')
+                modules.append((int(fields[0].split(':')[1]), fields[2].strip()))
+            except:
+                pass
+        modules.sort(reverse=True)
+        results['heaviest']=dict((name, us) for (us, name) in modules[:10])
+        return results
+
+    def getVersion(self):
+        try:
+            from importlib.metadata import version
+            return version('digimat.saia')
+        except:
+            pass
+
+    def run(self, names=None):
+        """
+        Run the given benchmarks (all if None) and return the report dict
+        """
+        names=names or self.BENCHMARKS
+        functions={'import': self.benchImport,
+            'codec': self.benchCodec,
+            'crc': self.benchCRC,
+            'bitpack': self.benchBitpack,
+            'formaters': self.benchFormaters,
+            'declare': self.benchDeclare,
+            'queue': self.benchQueue,
+            'polls': self.benchPolls}
+
+        report={'version': self.getVersion(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'crc': SAIACRC.name,
+            'quick': self._scale<1.0,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': {}}
+
+        for name in names:
+            try:
+                self.logger.info('running benchmark [%s]' % name)
+                report['results'][name]=functions[name]()
+            except KeyError:
+                self.logger.error('unknown benchmark [%s]' % name)
+                report['results'][name]={'error': 'unknown benchmark'}
+            except:
+                self.logger.exception('benchmark [%s]' % name)
+                report['results'][name]={'error': str(sys.exc_info()[1])}
+
+        self._report=report
+        return report
+
+    @property
+    def report(self):
+        return self._report
+
+    def toJSON(self, indent=2):
+        return json.dumps(self._report, indent=indent, sort_keys=True)
+
+    def __repr__(self):
+        return '<%s(%s)>' % (self.__class__.__name__, ','.join(self.BENCHMARKS))
+
+
+def main(argv=None):
+    """
+    Command line entry point (python -m digimat.saia bench [options])
+    """
+    import argparse
+
+    parser=argparse.ArgumentParser(prog='python -m digimat.saia bench',
+        description='digimat.saia benchmarks (JSON report)')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+        help='benchmarks to run, among %s (default all)' % ', '.join(SAIABenchmark.BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='10x less iterations')
+    parser.add_argument('--output', '-o', help='write the JSON report to this file (default stdout)')
+    parser.add_argument('--port', type=int, default=15090, help='udp port used by the polls benchmark')
+    parser.add_argument('--address', default='127.0.1.1', help='loopback address of the simulated station')
+    parser.add_argument('--engine', choices=('jobs', 'asyncio'), help='node engine used by the polls benchmark')
+    args=parser.parse_args(argv)
+
+    bench=SAIABenchmark(quick=args.quick, port=args.port, address=args.address, engine=args.engine)
+    bench.run(args.benchmarks)
+    data=bench.toJSON()
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data+'\n')
+    else:
+        sys.stdout.write(data+'\n')
+    return 0
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,49 @@
+"""
+Boolean items (flags, inputs, outputs) bit-packing codec
+
+S-Bus packs booleans LSB first : bit 0 of the first byte is the first item.
+Thus, a packed buffer is simply the little endian representation of the integer
+whose bit n is the value of item n. Packing converts the values to a bit string
+in C (bytes(), translate(), int(..., 2), int.to_bytes()), unpacking extends the
+values with a per-byte lookup table : there is no per-bit (or per-value) Python loop.
+"""
+from __future__ import division
+
+
+# byte -> tuple of 8 booleans (LSB first)
+_UNPACK_TABLE=tuple(tuple(bool(byte >> bit & 1) for bit in range(8)) for byte in range(256))
+
+# 0/1 bytes -> '0'/'1' digits
+_PACK_DIGITS=bytes.maketrans(b'\x00\x01', b'01')
+
+
+def unpackBooleans(data, count=None):
+    """
+    Return the list of booleans (LSB first) packed in data (bytes, bytearray or memoryview).
+    If given, count limits the number of returned values
+    """
+    table=_UNPACK_TABLE
+    values=[]
+    for byte in bytes(data):
+        values.extend(table[byte])
+    if count is not None:
+        del values[count:]
+    return values
+
+
+def packBooleans(values):
+    """
+    Return the values (iterable of booleans) packed LSB first in a bytes buffer,
+    padded with False values up to a multiple of 8
+    """
+    # one 0/1 byte per value
+    bits=bytes(map(bool, values))
+    size=(len(bits)+7)//8
+    if not size:
+        return b''
+    # bit string, first value being the least significant bit
+    return int(bits[::-1].translate(_PACK_DIGITS), 2).to_bytes(size, 'little')
+
+
+if __name__ == "__main__":
+    pass
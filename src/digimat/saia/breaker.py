@@ -0,0 +1,255 @@
+"""
+Per server circuit breaker
+
+closed     normal operation. Consecutive failed requests (retries exhausted) are counted,
+           any response (or ack/nak) from the server resets the count
+open       after threshold consecutive failures, or on a request timeout when the server
+           didn't respond for tripDelay seconds : items pulls/pushes, transfers and status
+           refresh are suspended, pending asynchronous reads/writes are failed
+halfopen   when the backoff delay is elapsed, a single READ_PCD_STATUS_OWN probe (no retry)
+           is sent. Any response closes the breaker, a failure re-opens it with a doubled
+           backoff delay (bounded, with jitter)
+
+Time to trip : the retransmission timeout is doubled on every timeout (1s, 2s, 4s, ...) and
+kept until the next response, thus threshold consecutive failed requests of a dead server
+take a minute or more. The tripDelay (default 10s) bounds this to tripDelay plus the
+current retransmission timeout, i.e. 10s to 20s with the default settings.
+
+State changes are logged, traced and notified to the listeners (node dispatcher thread).
+"""
+from __future__ import division
+
+import time
+import random
+
+from .request import SAIARequestReadPcdStatusOwn
+from .futures import SAIARequestError
+from .tracing import SAIATRACER
+
+
+class SAIACircuitBreaker(object):
+
+    STATE_CLOSED = 0
+    STATE_OPEN = 1
+    STATE_HALFOPEN = 2
+
+    STATES = {STATE_CLOSED: 'closed', STATE_OPEN: 'open', STATE_HALFOPEN: 'halfopen'}
+
+    # consecutive failed requests opening the breaker
+    THRESHOLD = 3
+    # delay without any response opening the breaker on the next request timeout (s)
+    TRIP_DELAY = 10.0
+    # backoff delay bounds (s)
+    DELAY_MIN = 5.0
+    DELAY_MAX = 120.0
+    # probe response timeout (s)
+    PROBE_TIMEOUT = 3.0
+
+    def __init__(self, server):
+        assert server.__class__.__name__=='SAIAServer'
+        self._server=server
+        self._enabled=True
+        self._state=self.STATE_CLOSED
+        self._failures=0
+        self._backoff=0
+        self._timeoutProbe=0
+        self._stampState=time.time()
+        self._stampOpen=0
+        self._stampResponse=time.time()
+        self._opens=0
+        self._probes=0
+        self._listeners=[]
+        self._threshold=self.THRESHOLD
+        self._tripDelay=self.TRIP_DELAY
+        self._delayMin=self.DELAY_MIN
+        self._delayMax=self.DELAY_MAX
+
+    @property
+    def server(self):
+        return self._server
+
+    @property
+    def logger(self):
+        return self._server.logger
+
+    def setup(self, threshold=None, delayMin=None, delayMax=None, tripDelay=None):
+        """
+        tripDelay=0 disables the time based trip (threshold failed requests only)
+        """
+        if threshold is not None:
+            self._threshold=max(1, int(threshold))
+        if tripDelay is not None:
+            self._tripDelay=max(0.0, float(tripDelay))
+        if delayMin is not None:
+            self._delayMin=float(delayMin)
+        if delayMax is not None:
+            self._delayMax=max(self._delayMin, float(delayMax))
+
+    def enable(self, state=True):
+        self._enabled=bool(state)
+        if not self._enabled:
+            self.close()
+
+    def disable(self):
+        self.enable(False)
+
+    def isEnabled(self):
+        return self._enabled
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def stateName(self):
+        return self.STATES[self._state]
+
+    def isClosed(self):
+        if self._state==self.STATE_CLOSED:
+            return True
+        return False
+
+    def isOpen(self):
+        """
+        True if the server is suspended (open or halfopen)
+        """
+        if self._state!=self.STATE_CLOSED:
+            return True
+        return False
+
+    def addListener(self, callback):
+        """
+        callback(server, state, previous) called (node dispatcher thread) on state change
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def removeListener(self, callback):
+        try:
+            self._listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def setState(self, state):
+        previous=self._state
+        if state==previous:
+            return
+        self._state=state
+        self._stampState=time.time()
+        server=self._server
+
+        if state==self.STATE_OPEN and previous==self.STATE_CLOSED:
+            self._opens+=1
+            self.logger.warning('%s:circuit breaker open (%d failures, no response for %.01fs, next probe in %.01fs)' % (server.host,
+                self._failures, self._stampState-self._stampResponse, self._timeoutProbe-self._stampState))
+            # don't let the callers wait for requests that won't be sent
+            server.memory.failFutures(SAIARequestError('%s:circuit breaker open' % server.host))
+        elif state==self.STATE_CLOSED:
+            self.logger.info('%s:circuit breaker closed (%ds)' % (server.host, self._stampState-self._stampOpen))
+
+        if SAIATRACER.enabled:
+            SAIATRACER.instant('breaker', 'server', server.host, {'state': self.STATES[state]})
+
+        listeners=list(self._listeners)+list(server.node.servers._breakerListeners)
+        for callback in listeners:
+            server.node.dispatcher.submit(callback, server, state, previous)
+        server.wakeup()
+
+    def computeBackoff(self):
+        """
+        Exponential backoff with (equal) jitter
+        """
+        delay=min(self._delayMax, self._delayMin*(2**self._backoff))
+        self._backoff=min(self._backoff+1, 16)
+        return delay/2.0+random.uniform(0, delay/2.0)
+
+    def open(self):
+        if self._state==self.STATE_CLOSED:
+            self._stampOpen=time.time()
+        self._timeoutProbe=time.time()+self.computeBackoff()
+        self.setState(self.STATE_OPEN)
+
+    def close(self):
+        self._failures=0
+        self._backoff=0
+        self._timeoutProbe=0
+        self._stampResponse=time.time()
+        self.setState(self.STATE_CLOSED)
+
+    def onSuccess(self):
+        """
+        Any valid response (or ack/nak) received from the server
+        """
+        self._failures=0
+        self._stampResponse=time.time()
+        if self._state!=self.STATE_CLOSED:
+            self.close()
+
+    def onFailure(self):
+        """
+        Request failed (retries exhausted)
+        """
+        self._failures+=1
+        if self._enabled and not self._server.isLocalNodeMode():
+            if self._state==self.STATE_HALFOPEN or (self._state==self.STATE_CLOSED and self._failures>=self._threshold):
+                self.open()
+
+    def onTimeout(self):
+        """
+        Request (transmission) timeout
+        """
+        if self._enabled and self._tripDelay>0 and self._state==self.STATE_CLOSED:
+            if time.time()-self._stampResponse>=self._tripDelay and not self._server.isLocalNodeMode():
+                self.open()
+
+    def probe(self):
+        link=self._server.link
+        request=SAIARequestReadPcdStatusOwn(link, retry=1)
+        request.setTimeout(self.PROBE_TIMEOUT)
+        if link.initiate(request):
+            self._probes+=1
+            return True
+
+    def getNextDeadline(self):
+        if self._state==self.STATE_CLOSED:
+            return None
+        if self._state==self.STATE_OPEN and self._timeoutProbe<=time.time() and not self._server.link.isIdle():
+            # probe delayed until the pending requests are terminated (link deadline)
+            return None
+        return self._timeoutProbe
+
+    def manager(self):
+        """
+        Called by the server manager instead of the transfers/memory managers while open
+        """
+        now=time.time()
+        if now<self._timeoutProbe:
+            return False
+
+        if self._state==self.STATE_OPEN:
+            if self._server.link.isIdle():
+                self.setState(self.STATE_HALFOPEN)
+                # safety net (i.e. probe not terminated)
+                self._timeoutProbe=now+self.PROBE_TIMEOUT*2
+                if self.probe():
+                    return True
+                self.open()
+        elif self._state==self.STATE_HALFOPEN:
+            # probe lost
+            self.open()
+        return False
+
+    def snapshot(self):
+        return {'state': self.stateName,
+            'failures': self._failures,
+            'opens': self._opens,
+            'probes': self._probes,
+            'since': self._stampState}
+
+    def __repr__(self):
+        return '<%s(%s, state=%s, failures=%d, opens=%d, probes=%d)>' % (self.__class__.__name__,
+            self._server.host, self.stateName, self._failures, self._opens, self._probes)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,112 @@
+"""
+EtherSBus frame codec (precompiled headers, zero copy decoding)
+
+Frame format
+------------
+frame length (4), protocol version (1), protocol type (1), sequence (2), frame type (1)
+[request only: station address (1), command (1)]
+[payload]
+crc (2)
+
+Headers are packed/unpacked with precompiled struct.Struct objects. Decoding works
+on a memoryview of the received datagram : the returned payload is a view, not a
+copy. Encoding packs the header, payload and crc in place (pack_into) in a single
+buffer, which can be a caller provided (reusable) bytearray.
+"""
+from __future__ import division
+
+import struct
+
+from .crc import SAIASBusCRC
+
+
+FRAME_HEADER = struct.Struct('>LBBHB')
+FRAME_REQUEST_HEADER = struct.Struct('>LBBHBBB')
+FRAME_CRC = struct.Struct('>H')
+
+FRAME_TYPE_REQUEST = 0
+FRAME_TYPE_RESPONSE = 1
+FRAME_TYPE_ACKNAK = 2
+
+FRAME_OVERHEAD = FRAME_HEADER.size+FRAME_CRC.size
+FRAME_REQUEST_OVERHEAD = FRAME_REQUEST_HEADER.size+FRAME_CRC.size
+FRAME_MAXSIZE = 255
+
+
+def decodeFrame(data):
+    """
+    Decode a received frame. Return (frameType, sequence, payload), payload being a
+    memoryview on data, or None if the frame is invalid (size, crc)
+    """
+    size=len(data)
+    if size>FRAME_OVERHEAD and size<=FRAME_MAXSIZE:
+        view=memoryview(data)
+        (msize, mversion, mtype, msequence, tattribute)=FRAME_HEADER.unpack_from(view)
+        (mcrc,)=FRAME_CRC.unpack_from(view, size-FRAME_CRC.size)
+        if mcrc==SAIASBusCRC(view[:-FRAME_CRC.size]):
+            return (tattribute, msequence, view[FRAME_HEADER.size:-FRAME_CRC.size])
+
+
+def _sealFrame(buffer, offset, size):
+    """
+    Compute and append the crc of the frame (without crc) of the given size at offset
+    """
+    view=memoryview(buffer)
+    crc=SAIASBusCRC(view[offset:offset+size])
+    FRAME_CRC.pack_into(buffer, offset+size, crc)
+    return size+FRAME_CRC.size
+
+
+def encodeRequestInto(buffer, offset, sequence, lid, command, payload=None):
+    """
+    Pack a request frame in buffer (bytearray) at offset. Return the frame size
+    """
+    size=FRAME_REQUEST_HEADER.size
+    if payload:
+        sizePayload=len(payload)
+        buffer[offset+size:offset+size+sizePayload]=payload
+        size+=sizePayload
+    FRAME_REQUEST_HEADER.pack_into(buffer, offset,
+        size+FRAME_CRC.size,
+        0, 0, sequence, FRAME_TYPE_REQUEST,
+        lid, command)
+    return _sealFrame(buffer, offset, size)
+
+
+def encodeRequest(sequence, lid, command, payload=None):
+    """
+    Return a new request frame (bytearray)
+    """
+    size=FRAME_REQUEST_OVERHEAD
+    if payload:
+        size+=len(payload)
+    buffer=bytearray(size)
+    encodeRequestInto(buffer, 0, sequence, lid, command, payload)
+    return buffer
+
+
+def encodeReplyInto(buffer, offset, sequence, replyType, payload):
+    """
+    Pack a reply (response, ack/nak) frame in buffer (bytearray) at offset. Return the frame size
+    """
+    size=FRAME_HEADER.size
+    sizePayload=len(payload)
+    buffer[offset+size:offset+size+sizePayload]=payload
+    size+=sizePayload
+    FRAME_HEADER.pack_into(buffer, offset,
+        size+FRAME_CRC.size,
+        0, 0, sequence, replyType)
+    return _sealFrame(buffer, offset, size)
+
+
+def encodeReply(sequence, replyType, payload):
+    """
+    Return a new reply frame (bytearray)
+    """
+    buffer=bytearray(FRAME_OVERHEAD+len(payload))
+    encodeReplyInto(buffer, 0, sequence, replyType, payload)
+    return buffer
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,419 @@
+"""
+Batched datagram I/O of the node socket
+
+Received datagrams are drained in bursts into a preallocated buffer ring, with a single
+recvmmsg() syscall on Linux (ctypes), or with recvfrom_into() calls in the ring buffers
+elsewhere. The returned datagrams are memoryviews on the ring : they are only valid until
+the next recv() call (the decoded payloads are views too, see codec.py, and are copied
+by the requests which keep them).
+
+Frames sent during a manager pass (collect() ... flush()) are copied into a send ring
+and emitted with a single sendmmsg() syscall when the pass is done. Frames sent outside
+of a pass, or by another thread, are sent immediately (sendto). The requests carried by
+the queued frames are stamped (onSent()) when the ring is flushed, so that the time spent
+in the batch is not counted in their round trip time.
+
+The rings are only used and released under the io lock : close() may be called by any
+thread, while the engine thread is receiving or flushing.
+"""
+from __future__ import division
+
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+
+# sockaddr_in : family (native), port, address
+SOCKADDR_IN = struct.Struct('=HH4s8x')
+SOCKADDR_SIZE = 32
+
+MSG_DONTWAIT = 0x40
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr),
+        ('msg_len', ctypes.c_uint)]
+
+
+def loadLibc():
+    """
+    Return the (recvmmsg, sendmmsg) libc functions, or None if not available
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc=ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        recvmmsg=libc.recvmmsg
+        recvmmsg.argtypes=[ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        recvmmsg.restype=ctypes.c_int
+        sendmmsg=libc.sendmmsg
+        sendmmsg.argtypes=[ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+        sendmmsg.restype=ctypes.c_int
+        return (recvmmsg, sendmmsg)
+    except:
+        pass
+
+
+LIBC = loadLibc()
+
+
+def readSocketCounters(sock, fpath='/proc/net/udp'):
+    """
+    Return the kernel counters of the given udp socket (Linux) : receive/transmit queues
+    (bytes) and datagrams dropped (i.e. receive buffer full), or None if not available
+    """
+    try:
+        inode=str(os.fstat(sock.fileno()).st_ino)
+        with open(fpath, 'r') as f:
+            f.readline()
+            for line in f:
+                fields=line.split()
+                if len(fields)>=13 and fields[9]==inode:
+                    (txQueue, rxQueue)=fields[4].split(':')
+                    return {'txQueue': int(txQueue, 16),
+                        'rxQueue': int(rxQueue, 16),
+                        'drops': int(fields[12])}
+    except:
+        pass
+
+
+def readUdpCounters(fpath='/proc/net/snmp'):
+    """
+    Return the system wide udp counters (Linux), i.e. InErrors, RcvbufErrors, SndbufErrors,
+    or None if not available
+    """
+    try:
+        with open(fpath, 'r') as f:
+            lines=[line.split() for line in f if line.startswith('Udp:')]
+        return dict(zip(lines[0][1:], (int(value) for value in lines[1][1:])))
+    except:
+        pass
+
+
+class SAIADatagramRing(object):
+    """
+    count preallocated buffers of size bytes, with their (ctypes) message headers
+    """
+
+    def __init__(self, count, size):
+        self._count=count
+        self._size=size
+        self._buffer=bytearray(count*size)
+        self._view=memoryview(self._buffer)
+        self._names=bytearray(count*SOCKADDR_SIZE)
+        self._namesView=memoryview(self._names)
+        self._messages=(_mmsghdr*count)()
+        self._iovecs=(_iovec*count)()
+        self._cbuffer=(ctypes.c_char*len(self._buffer)).from_buffer(self._buffer)
+        self._cnames=(ctypes.c_char*len(self._names)).from_buffer(self._names)
+        base=ctypes.addressof(self._cbuffer)
+        names=ctypes.addressof(self._cnames)
+        for n in range(count):
+            self._iovecs[n].iov_base=base+n*size
+            self._iovecs[n].iov_len=size
+            header=self._messages[n].msg_hdr
+            header.msg_name=names+n*SOCKADDR_SIZE
+            header.msg_namelen=SOCKADDR_SIZE
+            header.msg_iov=ctypes.pointer(self._iovecs[n])
+            header.msg_iovlen=1
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def size(self):
+        return self._size
+
+    def slot(self, n, size=None):
+        offset=n*self._size
+        if size is None:
+            size=self._size
+        return self._view[offset:offset+size]
+
+    def release(self):
+        # the ctypes arrays are exporting the buffers
+        self._messages=None
+        self._iovecs=None
+        self._cbuffer=None
+        self._cnames=None
+        try:
+            self._namesView.release()
+            self._view.release()
+        except:
+            pass
+
+
+class SAIADatagramIO(object):
+    """
+    Batched receive/send on the given (non blocking, AF_INET, udp) socket
+    """
+
+    BATCH_SIZE = 32
+    BUFFER_SIZE = 4096
+    SEND_BUFFER_SIZE = 512
+
+    def __init__(self, sock, count=None, logger=None):
+        self._socket=sock
+        self._fd=sock.fileno()
+        self._logger=logger
+        count=count or self.BATCH_SIZE
+        self._mmsg=LIBC is not None and sock.family==socket.AF_INET
+        self._recvRing=SAIADatagramRing(count, self.BUFFER_SIZE)
+        self._sendRing=SAIADatagramRing(count, self.SEND_BUFFER_SIZE)
+        self._sendCount=0
+        self._sendRequests=[]
+        self._lock=threading.Lock()
+        self._closed=False
+        self._addresses={}
+        self._names={}
+        self._owner=None
+        self._syscallsRecv=0
+        self._syscallsSend=0
+        self._datagramsRecv=0
+        self._datagramsSend=0
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def isBatched(self):
+        """
+        True if recvmmsg/sendmmsg are used
+        """
+        return self._mmsg
+
+    def decodeAddress(self, n):
+        data=self._recvRing._names
+        key=bytes(data[n*SOCKADDR_SIZE+2:n*SOCKADDR_SIZE+8])
+        address=self._addresses.get(key)
+        if address is None:
+            (family, port, ip)=SOCKADDR_IN.unpack_from(data, n*SOCKADDR_SIZE)
+            address=(socket.inet_ntoa(ip), socket.ntohs(port))
+            if len(self._addresses)>65536:
+                self._addresses={}
+            self._addresses[key]=address
+        return address
+
+    def encodeAddress(self, address):
+        name=self._names.get(address)
+        if name is None:
+            name=SOCKADDR_IN.pack(socket.AF_INET, socket.htons(address[1]), socket.inet_aton(address[0]))
+            if len(self._names)>65536:
+                self._names={}
+            self._names[address]=name
+        return name
+
+    def recv(self):
+        """
+        Drain the pending datagrams (up to the ring size). Return a list of (data, address),
+        data being a memoryview on the ring, valid until the next call
+        """
+        with self._lock:
+            if self._closed:
+                return []
+            return self.recvRing()
+
+    def recvRing(self):
+        ring=self._recvRing
+        if self._mmsg:
+            count=LIBC[0](self._fd, ring._messages, ring.count, MSG_DONTWAIT, None)
+            self._syscallsRecv+=1
+            if count<0:
+                error=ctypes.get_errno()
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return []
+                raise OSError(error, 'recvmmsg() %s' % errno.errorcode.get(error, error))
+            datagrams=[]
+            for n in range(count):
+                message=ring._messages[n]
+                datagrams.append((ring.slot(n, message.msg_len), self.decodeAddress(n)))
+                message.msg_hdr.msg_namelen=SOCKADDR_SIZE
+            self._datagramsRecv+=count
+            return datagrams
+
+        datagrams=[]
+        for n in range(ring.count):
+            try:
+                (size, address)=self._socket.recvfrom_into(ring.slot(n))
+                self._syscallsRecv+=1
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append((ring.slot(n, size), address))
+        self._datagramsRecv+=len(datagrams)
+        return datagrams
+
+    def sendto(self, data, address):
+        self._syscallsSend+=1
+        self._datagramsSend+=1
+        return self._socket.sendto(data, address)
+
+    def collect(self):
+        """
+        Start collecting the frames sent by the calling thread (until flush())
+        """
+        if self._mmsg:
+            self._owner=threading.get_ident()
+
+    def isCollecting(self):
+        if self._owner is not None and self._owner==threading.get_ident():
+            return True
+        return False
+
+    def send(self, data, address, request=None):
+        """
+        Send (or queue, if collecting) the frame. Return True on success. The given request
+        is stamped (request.onSent()) when the queued frame is effectively sent
+        """
+        size=len(data)
+        if not self.isCollecting() or size>self.SEND_BUFFER_SIZE:
+            return self.sendto(data, address)==size
+
+        with self._lock:
+            if self._closed:
+                return False
+            return self.queue(data, address, request)
+
+    def queue(self, data, address, request):
+        size=len(data)
+        ring=self._sendRing
+        if self._sendCount>=ring.count:
+            self.flushRing()
+        n=self._sendCount
+        ring.slot(n, size)[:]=data
+        ring._iovecs[n].iov_len=size
+        name=self.encodeAddress(address)
+        offset=n*SOCKADDR_SIZE
+        ring._names[offset:offset+len(name)]=name
+        ring._messages[n].msg_hdr.msg_namelen=len(name)
+        self._sendCount+=1
+        if request is not None:
+            self._sendRequests.append(request)
+        return True
+
+    def flushRing(self):
+        try:
+            self.sendRing()
+        finally:
+            # the frames are sent (or lost), stamp their requests
+            requests=self._sendRequests
+            if requests:
+                self._sendRequests=[]
+                stamp=time.time()
+                for request in requests:
+                    request.onSent(stamp)
+
+    def sendRing(self):
+        ring=self._sendRing
+        count=self._sendCount
+        self._sendCount=0
+        offset=0
+        while offset<count:
+            sent=LIBC[1](self._fd, ctypes.byref(ring._messages[offset]), count-offset, 0)
+            self._syscallsSend+=1
+            if sent<=0:
+                error=ctypes.get_errno()
+                if error==errno.EINTR:
+                    continue
+                # fallback to sendto(), one by one (i.e. EAGAIN, full socket buffer)
+                for n in range(offset, count):
+                    try:
+                        self.sendto(ring.slot(n, ring._iovecs[n].iov_len), self.decodeSendAddress(n))
+                    except:
+                        if self.logger:
+                            self.logger.exception('sendto()')
+                self._datagramsSend+=offset
+                return
+            offset+=sent
+        self._datagramsSend+=count
+
+    def decodeSendAddress(self, n):
+        (family, port, ip)=SOCKADDR_IN.unpack_from(self._sendRing._names, n*SOCKADDR_SIZE)
+        return (socket.inet_ntoa(ip), socket.ntohs(port))
+
+    def flush(self):
+        """
+        Send the collected frames (one sendmmsg() syscall) and stop collecting
+        """
+        self._owner=None
+        if self._sendCount>0:
+            with self._lock:
+                if self._closed:
+                    return
+                try:
+                    self.flushRing()
+                except:
+                    self._sendCount=0
+                    if self.logger:
+                        self.logger.exception('flush()')
+
+    def close(self):
+        """
+        Release the rings. Waits for a pending recv()/flush() of another thread (the rings
+        are used by recvmmsg()/sendmmsg())
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed=True
+            self._owner=None
+            self._sendCount=0
+            self._sendRequests=[]
+            self._recvRing.release()
+            self._sendRing.release()
+
+    def isClosed(self):
+        return self._closed
+
+    def getBufferSizes(self):
+        """
+        Return the effective (SO_RCVBUF, SO_SNDBUF) sizes
+        """
+        try:
+            return (self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+                self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF))
+        except:
+            return (None, None)
+
+    def stats(self):
+        (rcvbuf, sndbuf)=self.getBufferSizes()
+        stats={'batched': self._mmsg,
+            'syscallsRecv': self._syscallsRecv,
+            'datagramsRecv': self._datagramsRecv,
+            'syscallsSend': self._syscallsSend,
+            'datagramsSend': self._datagramsSend,
+            'rcvbuf': rcvbuf,
+            'sndbuf': sndbuf}
+        counters=readSocketCounters(self._socket)
+        if counters is not None:
+            stats.update(counters)
+        return stats
+
+    def __repr__(self):
+        return '<%s(batched=%d, recv %d/%d syscalls, send %d/%d syscalls)>' % (self.__class__.__name__,
+            self._mmsg, self._datagramsRecv, self._syscallsRecv, self._datagramsSend, self._syscallsSend)
+
+
+if __name__ == "__main__":
+    pass
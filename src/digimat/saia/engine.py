@@ -0,0 +1,235 @@
+from __future__ import division
+
+import time
+import threading
+import asyncio
+
+
+class SAIADatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine):
+        self._engine=engine
+
+    def datagram_received(self, data, address):
+        self._engine.onDatagram(data, address)
+
+    def error_received(self, exc):
+        self._engine.logger.error('socket:%s' % str(exc))
+
+
+class SAIAAsyncEngine(object):
+    """
+    asyncio based SAIANode background engine (alternative to the digimat.jobs loop)
+
+    The node udp socket is registered on an asyncio loop running in a dedicated thread.
+    The loop only wakes up when a datagram is received, when a wakeup() is signaled
+    (i.e. an item push/pull queued from another thread) or when the earliest
+    link/transfer/item deadline reported by the node is reached. The same
+    SAIAServer/SAIALink/SAIAMemory objects are driven as with the default engine.
+    """
+
+    # safety net, in case a deadline is missed somewhere
+    MAX_IDLE_DELAY = 5.0
+
+    # servers managed between two datagram processing opportunities
+    SERVERS_CHUNK = 16
+
+    def __init__(self, node):
+        assert node.__class__.__name__=='SAIANode'
+        self._node=node
+        self._loop=None
+        self._thread=None
+        self._threadId=None
+        self._transport=None
+        self._socket=None
+        self._reader=None
+        self._eventWakeup=None
+        self._wakeupPending=False
+        self._eventStart=threading.Event()
+        self._eventStop=threading.Event()
+        self._timeoutSocketRetry=0
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def logger(self):
+        return self.node.logger
+
+    def onDatagram(self, data, address):
+        try:
+            self.node.processMessage(data, address)
+        except:
+            self.logger.exception('onDatagram()')
+        self._eventWakeup.set()
+
+    def onReadable(self):
+        # batched receive (recvmmsg)
+        try:
+            self.node.receiveMessages()
+        except:
+            self.logger.exception('onReadable()')
+        self._eventWakeup.set()
+
+    def _wakeup(self):
+        self._wakeupPending=False
+        if self._eventWakeup is not None:
+            self._eventWakeup.set()
+
+    def wakeup(self):
+        """
+        Request a manager pass as soon as possible (thread safe)
+        """
+        try:
+            if threading.get_ident()==self._threadId:
+                self._eventWakeup.set()
+            elif not self._wakeupPending:
+                self._wakeupPending=True
+                self._loop.call_soon_threadsafe(self._wakeup)
+        except:
+            self._wakeupPending=False
+
+    def openTransport(self):
+        s=self.node.open()
+        if s is not None and s is not self._socket:
+            self.closeTransport()
+            self._socket=s
+            if self.node.isBatchedIO():
+                try:
+                    # drain the socket with recvmmsg() instead of one recvfrom() per datagram
+                    self._loop.add_reader(s.fileno(), self.onReadable)
+                    self._reader=s.fileno()
+                    return None
+                except NotImplementedError:
+                    pass
+            return self._loop.create_datagram_endpoint(lambda: SAIADatagramProtocol(self), sock=s)
+
+    def isTransportOpen(self):
+        if self._transport is not None or self._reader is not None:
+            return True
+        return False
+
+    def closeTransport(self):
+        try:
+            if self._transport:
+                self._transport.close()
+            if self._reader is not None:
+                self._loop.remove_reader(self._reader)
+        except:
+            pass
+        self._transport=None
+        self._reader=None
+        self._socket=None
+
+    def computeIdleDelay(self):
+        delay=self.MAX_IDLE_DELAY
+        deadline=self.node.getNextDeadline()
+        if deadline is not None:
+            delay=min(delay, deadline-time.time())
+        return max(0, delay)
+
+    async def managerServers(self):
+        """
+        Manage the ready servers, by chunks, letting the loop process the received
+        datagrams between two chunks (avoiding false response timeouts with many servers)
+        """
+        node=self.node
+        activity=False
+        count=node.servers.countReady()
+        while count>0:
+            # the frames sent by the chunk are emitted at once (sendmmsg)
+            node.beginSendBatch()
+            try:
+                if node.servers.manager(min(count, self.SERVERS_CHUNK)):
+                    activity=True
+            finally:
+                node.endSendBatch()
+            count-=self.SERVERS_CHUNK
+            if count>0:
+                await asyncio.sleep(0)
+        node.server.manager()
+        return activity
+
+    async def main(self):
+        self._eventWakeup=asyncio.Event()
+        self._eventStart.set()
+
+        while not self._eventStop.is_set():
+            self._eventWakeup.clear()
+
+            try:
+                if not self.isTransportOpen() or self._socket is not self.node._socket:
+                    if time.time()>=self._timeoutSocketRetry:
+                        self._timeoutSocketRetry=time.time()+3.0
+                        endpoint=self.openTransport()
+                        if endpoint is not None:
+                            (self._transport, protocol)=await endpoint
+
+                activity=await self.managerServers()
+            except:
+                self.logger.exception('engine:manager()')
+                activity=False
+
+            if activity:
+                # let the loop process pending datagrams before the next pass
+                await asyncio.sleep(0)
+                continue
+
+            try:
+                delay=self.computeIdleDelay()
+                if not self.isTransportOpen():
+                    delay=min(delay, max(0, self._timeoutSocketRetry-time.time()))
+                await asyncio.wait_for(self._eventWakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            except:
+                self.logger.exception('engine:wait()')
+
+        self.closeTransport()
+
+    def run(self):
+        self._threadId=threading.get_ident()
+        self._loop=asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self.logger.debug('engine:asyncio loop started')
+        try:
+            self._loop.run_until_complete(self.main())
+        except:
+            self.logger.exception('engine:run()')
+        finally:
+            self._loop.close()
+            self._eventStop.set()
+            self._eventStart.set()
+        self.logger.debug('engine:asyncio loop halted')
+
+    def start(self):
+        if self._thread is None:
+            self._eventStop.clear()
+            self._eventStart.clear()
+            self._thread=threading.Thread(target=self.run, name='SAIAAsyncEngine')
+            self._thread.daemon=True
+            self._thread.start()
+            self._eventStart.wait()
+
+    def stop(self):
+        if self._thread is not None:
+            self._eventStop.set()
+            self.wakeup()
+            if threading.get_ident()!=self._threadId:
+                self._thread.join()
+            self._thread=None
+
+    def isRunning(self):
+        if self._thread is not None and not self._eventStop.is_set():
+            return True
+        return False
+
+    def sleep(self, delay=1.0):
+        self._eventStop.wait(delay)
+
+    def __repr__(self):
+        return '<%s(running=%d)>' % (self.__class__.__name__, self.isRunning())
+
+
+if __name__ == "__main__":
+    pass
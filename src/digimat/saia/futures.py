@@ -0,0 +1,88 @@
+"""
+Futures helpers of the asynchronous items API (item.readAsync(), item.writeAsync())
+
+Pending futures are registered by index in the items collections and are taken over by
+the request carrying the item (read request start, write request setup), then completed
+by this request : item value (read) or True (write acknowledged) on success, SAIARequestError
+if the request failed (retries exhausted) or could not be initiated.
+"""
+from __future__ import division
+
+import threading
+from concurrent.futures import Future
+
+
+class SAIARequestError(IOError):
+    pass
+
+
+def resolveFuture(future, result):
+    try:
+        if not future.done():
+            future.set_result(result)
+    except:
+        # cancelled meanwhile
+        pass
+
+
+def failFuture(future, exception):
+    try:
+        if not future.done():
+            future.set_exception(exception)
+    except:
+        pass
+
+
+def completedFuture(result=None, exception=None):
+    future=Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+def gatherFutures(futures):
+    """
+    Return a Future completed with the list of the results of the given futures
+    (or with the first exception) when they are all done
+    """
+    result=Future()
+    futures=list(futures)
+    if not futures:
+        result.set_result([])
+        return result
+
+    state={'count': len(futures)}
+
+    def done(future):
+        if future.cancelled():
+            failFuture(result, SAIARequestError('cancelled'))
+            return
+        exception=future.exception()
+        if exception is not None:
+            failFuture(result, exception)
+            return
+        # callbacks may be invoked by several threads
+        with lock:
+            state['count']-=1
+            if state['count']>0:
+                return
+        resolveFuture(result, [f.result() for f in futures])
+
+    lock=threading.Lock()
+    for future in futures:
+        future.add_done_callback(done)
+    return result
+
+
+def asyncioFuture(future):
+    """
+    Return an asyncio future (current event loop) wrapping the given Future
+    """
+    import asyncio
+    return asyncio.wrap_future(future)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,7 +1,6 @@
 from __future__ import print_function  # Python 2/3 compatibility
 
 import time
-from prettytable import PrettyTable
 
 from threading import RLock
 from threading import Event
@@ -12,6 +11,18 @@ from .formaters import SAIAValueFormaterInteger10
 from .formaters import SAIAValueFormaterFFP
 from .formaters import SAIAValueFormater
 
+from .planner import SAIAReadPlanner
+from .store import SAIAItemStore
+from .store import compactItemType
+from .tracing import SAIATRACER
+from .subscription import SAIASubscription
+from .futures import Future
+from .futures import SAIARequestError
+from .futures import completedFuture
+from .futures import gatherFutures
+from .futures import asyncioFuture
+from .futures import failFuture
+
 
 class SAIAItemGroup(object):
     def __init__(self, items=None):
@@ -103,6 +114,42 @@ class SAIAItemGroup(object):
                     return False
             return True
 
+    def readAsync(self, urgent=True, aio=False):
+        """
+        Non blocking read of every item of the group. Return a Future (an asyncio future if aio
+        is True) whose result is the list of the items values
+        """
+        future=gatherFutures([item.readAsync(urgent) for item in self.all()])
+        if aio:
+            return asyncioFuture(future)
+        return future
+
+    def writeAsync(self, values, aio=False):
+        """
+        Non blocking write of the given values (list, or the same value for every item).
+        Return a Future (an asyncio future if aio is True) completed when every write is acknowledged
+        """
+        items=self.all()
+        try:
+            values=list(values)
+        except TypeError:
+            values=[values]*len(items)
+        future=gatherFutures([item.writeAsync(value) for item, value in zip(items, values)])
+        if aio:
+            return asyncioFuture(future)
+        return future
+
+    def subscribe(self, callback=None, queue=None, deadband=0, deadbandPercent=0, formater=None,
+            initial=False, executor=None):
+        """
+        Subscribe to the value changes of the group items (see SAIASubscription).
+        Return the subscription (subscription.unsubscribe())
+        """
+        subscription=SAIASubscription(callback, queue, deadband, deadbandPercent, formater, initial, executor)
+        for item in self.all():
+            subscription.attach(item.parent, item.index)
+        return subscription
+
     def dump(self):
         if self._items:
             for item in self.all():
@@ -110,6 +157,7 @@ class SAIAItemGroup(object):
 
     def table(self, key=None):
         if self._items:
+            from prettytable import PrettyTable
             t=PrettyTable()
             t.field_names = ['#', 'server', 'index', 'tag', 'value', 'age']
             t.align['#']='l'
@@ -136,15 +184,27 @@ class SAIAItemGroup(object):
 
 
 class SAIAItem(object):
+
+    # max items count per read request
+    READ_MAXCOUNT = 1
+    # size (bytes) of one item value in a read response
+    VALUE_SIZE = 4
+
     def __init__(self, parent, index, value=0, delayRefresh=None, readOnly=False):
         self._parent=parent
         self._index=index
         self._value=self.validateValue(value)
         self._pushValue=None
+        # incremented by each signalPush() (see SAIARequestWriteItems)
+        self._pushGeneration=0
         self._stamp=0
         self._inhibitTimeout=0
         self._readOnly=readOnly
         self._delayRefresh=delayRefresh
+        # deadline in the memory scheduler (None if not scheduled)
+        self._deadline=None
+        # memory pending queues membership bits (see SAIAItemQueue)
+        self._queued=0
         self._eventPush=Event()
         self._eventPull=Event()
         self._eventValue=Event()
@@ -152,7 +212,8 @@ class SAIAItem(object):
         self._eventChanged=Event()
         self._eventUpdated=Event()
         self.onInit()
-        self.logger.debug('%s->creating %s' % (self.server.host, self))
+        # lazy formatting, this is called for each declared item
+        self.logger.debug('%s->creating %s', self.server.host, self)
 
     @property
     def parent(self):
@@ -207,6 +268,7 @@ class SAIAItem(object):
 
     def setRefreshDelay(self, delay):
         self._delayRefresh=delay
+        self.schedule()
 
     def getRefreshDelay(self):
         try:
@@ -231,11 +293,13 @@ class SAIAItem(object):
         if self.parent.isLocalNodeMode():
             self.setValue(value)
         else:
-            if not self._eventPush.isSet():
-                self._eventPush.set()
-                self._parent.signalPush(self)
             with self._parent._lock:
                 self._pushValue=value
+                self._pushGeneration+=1
+                if self._eventPush.isSet():
+                    return
+                self._eventPush.set()
+            self._parent.signalPush(self)
 
     def isPendingPushRequest(self):
         if self._eventPush.isSet():
@@ -247,11 +311,21 @@ class SAIAItem(object):
 
     def signalPull(self, urgent=False):
         if not self.parent.isLocalNodeMode():
-            if not self._eventPull.isSet():
-                self._eventPull.set()
-                self._eventValue.clear()
+            if self.preparePull():
                 self._parent.signalPull(self, urgent)
 
+    def preparePull(self):
+        """
+        Mark the item as pending pull. Return False if it was already pending
+        """
+        if not self._eventPull.isSet():
+            self._eventPull.set()
+            self._eventValue.clear()
+            if SAIATRACER.enabled:
+                SAIATRACER.begin((id(self._parent), self._index))
+            return True
+        return False
+
     def clearPull(self):
         self._eventPull.clear()
 
@@ -264,17 +338,32 @@ class SAIAItem(object):
         # we must be able to setValue from a readItemResponse
         if value is not None and (force or not self.isReadOnly()):
             value=self.validateValue(value)
+            if value is None:
+                return
+            notify=False
             with self._parent._lock:
+                previous=self._value
                 # only if we have already received a value
                 if self._stamp>0 or self.server.isLocalNodeMode():
-                    if not self._value and value:
+                    if not previous and value:
                         self._eventRaised.set()
-                    if value!=self._value:
+                    if value!=previous:
                         self._eventChanged.set()
+                        notify=True
+                else:
+                    # initial value
+                    previous=None
+                    notify=True
                 self._stamp=time.time()
                 self._value=value
             self._eventValue.set()
             self._eventUpdated.set()
+            self.schedule()
+            if notify and self._parent._subscriptions:
+                self._parent.notifyChange(self, value, previous)
+            if SAIATRACER.enabled:
+                SAIATRACER.end((id(self._parent), self._index), 'pull', 'item', self.server.host,
+                    {'item': self.__class__.__name__.replace('Compact', ''), 'index': self._index})
 
     def getValue(self):
         with self._parent._lock:
@@ -288,6 +377,8 @@ class SAIAItem(object):
     def value(self, value):
         if not self.isReadOnly():
             value=self.validateValue(value)
+            if value is None:
+                return
             with self._parent._lock:
                 if self._value!=value:
                     self.signalPush(value)
@@ -304,6 +395,58 @@ class SAIAItem(object):
             self._eventChanged.clear()
         return changed
 
+    def readAsync(self, urgent=True, aio=False):
+        """
+        Non blocking read. Return a Future (an asyncio future if aio is True) completed with
+        the value received by the next read request covering the item. Concurrent reads of
+        the same item share the same future (and request)
+        """
+        if self.parent.isLocalNodeMode():
+            future=completedFuture(self.value)
+        elif self.server.breaker.isOpen():
+            future=completedFuture(exception=SAIARequestError('%s:circuit breaker open' % self.server.host))
+        else:
+            (future, created)=self._parent.createReadFuture(self._index)
+            if created:
+                self.signalPull(urgent)
+        if aio:
+            return asyncioFuture(future)
+        return future
+
+    def writeAsync(self, value, aio=False):
+        """
+        Non blocking write. Return a Future (an asyncio future if aio is True) completed (True)
+        when the write request carrying the value is acknowledged
+        """
+        if not self.isReadOnly():
+            value=self.validateValue(value)
+        if self.isReadOnly():
+            future=completedFuture(exception=SAIARequestError('%s is read only' % self))
+        elif value is None:
+            future=completedFuture(exception=SAIARequestError('%s:invalid value' % self))
+        elif self.parent.isLocalNodeMode():
+            self.signalPush(value)
+            future=completedFuture(True)
+        elif self.server.breaker.isOpen():
+            future=completedFuture(exception=SAIARequestError('%s:circuit breaker open' % self.server.host))
+        else:
+            with self._parent._lock:
+                future=self._parent.createWriteFuture(self._index)
+                self.signalPush(value)
+        if aio:
+            return asyncioFuture(future)
+        return future
+
+    def subscribe(self, callback=None, queue=None, deadband=0, deadbandPercent=0, formater=None,
+            initial=False, executor=None):
+        """
+        Subscribe to the item value changes (see SAIASubscription).
+        Return the subscription (subscription.unsubscribe())
+        """
+        subscription=SAIASubscription(callback, queue, deadband, deadbandPercent, formater, initial, executor)
+        subscription.attach(self.parent, self.index)
+        return subscription
+
     def isUpdated(self, reset=True):
         if self._eventUpdated.isSet():
             if reset:
@@ -345,12 +488,45 @@ class SAIAItem(object):
                 return True
         return False
 
-    def pull(self):
+    def isStale(self):
+        """
+        True if the value was restored from a snapshot (warm start) and not yet refreshed
+        """
+        stamp=self._stamp
+        if stamp>0 and stamp<self.memory._stampWarmStart:
+            return True
+        return False
+
+    def pull(self, maxcount=None):
         return False
 
     def push(self):
         return False
 
+    def getNextDeadline(self):
+        """
+        Return the time at which the item manager has to be called again
+        (None if the item doesn't need to be managed)
+        """
+        if self.parent.isLocalNodeMode():
+            return None
+        delay=self.getRefreshDelay()
+        deadline=self._stamp+delay
+        now=time.time()
+        if deadline<=now:
+            # refresh already due (pending or lost pull request) : check again later
+            deadline=now+min(delay, 10.0)
+        return deadline
+
+    def schedule(self):
+        """
+        (re)arm the item in the memory scheduler
+        """
+        try:
+            self.memory.scheduler.schedule(self, self.getNextDeadline())
+        except:
+            pass
+
     def manager(self):
         age=self.age()
         if age>=self.getRefreshDelay():
@@ -412,6 +588,10 @@ class SAIAItem(object):
 
 
 class SAIABooleanItem(SAIAItem):
+
+    READ_MAXCOUNT = 96
+    VALUE_SIZE = 1.0/8
+
     def validateValue(self, value):
         try:
             return bool(value)
@@ -454,6 +634,10 @@ class SAIABooleanItem(SAIAItem):
 
 
 class SAIAAnalogItem(SAIAItem):
+
+    READ_MAXCOUNT = 32
+    VALUE_SIZE = 4
+
     def onInit(self):
         super(SAIAAnalogItem, self).onInit()
         self._formater=None
@@ -589,9 +773,16 @@ class SAIAItems(object):
         self._readOnly=readOnly
         self._items=[]
         self._indexItem={}
+        # compact mode column storage (see setCompactStorage)
+        self._store=None
         self._timeoutSort=0
-        self._currentItem=0
         self._delayRefresh=60
+        self._planner=SAIAReadPlanner(self)
+        # change subscriptions by index (None for the whole collection)
+        self._subscriptions={}
+        # readAsync()/writeAsync() pending futures by index
+        self._futuresRead={}
+        self._futuresWrite={}
 
     @property
     def memory(self):
@@ -616,14 +807,55 @@ class SAIAItems(object):
             return True
         return False
 
+    def setCompactStorage(self, state=True):
+        """
+        Store the items state in arrays (SAIAItemStore) instead of one SAIAItem
+        object per item, items being then views created on demand. Much lower memory
+        footprint for large collections. Must be called before any item declaration.
+        """
+        with self._lock:
+            if self._items or (self._store is not None and self._store.count()>0):
+                self.logger.error('%s unable to change storage mode (items already declared)' % self)
+                return False
+            if state:
+                self._store=SAIAItemStore(boolean=issubclass(self._itemType, SAIABooleanItem))
+            else:
+                self._store=None
+            return True
+
+    def isCompactStorage(self):
+        if self._store is not None:
+            return True
+        return False
+
+    @property
+    def store(self):
+        return self._store
+
+    def createItemView(self, index):
+        cls=compactItemType(self._itemType)
+        view=cls.__new__(cls)
+        view._parent=self
+        view._index=index
+        return view
+
     def setRefreshDelay(self, delay):
         self._delayRefresh=delay
+        with self._lock:
+            for item in self.all():
+                item.schedule()
 
     def getRefreshDelay(self):
         return self._delayRefresh
 
+    @property
+    def planner(self):
+        return self._planner
+
     def count(self):
         with self._lock:
+            if self._store is not None:
+                return self._store.count()
             return len(self._items)
 
     def resolveIndex(self, index):
@@ -654,6 +886,9 @@ class SAIAItems(object):
         return False
 
     def all(self):
+        if self._store is not None:
+            with self._lock:
+                return [self.createItemView(index) for index in self._store.indexes()]
         return self._items
 
     def alive(self, maxAge=None):
@@ -673,6 +908,11 @@ class SAIAItems(object):
     def item(self, index):
         try:
             with self._lock:
+                if self._store is not None:
+                    index=self.validateIndex(index)
+                    if self._store.isDeclared(index):
+                        return self.createItemView(index)
+                    return None
                 return self._indexItem[self.validateIndex(index)]
         except:
             pass
@@ -695,36 +935,48 @@ class SAIAItems(object):
         if self.memory.isOnTheFlyItemCreationEnabled():
             return self.declare(index)
 
-    def declare(self, index, value=0):
+    def _declare(self, index, value=0, pull=True):
         index=self.validateIndex(index)
         if index is not None:
             item=self.item(index)
             if item:
                 return item
 
-            item=self._itemType(self, index, value)
-            # item.setReadOnly(self._readOnly)
             with self._lock:
-                self._items.append(item)
-                self._indexItem[index]=item
-                self._timeoutSort=time.time()+10.0
-                item.signalPull()
+                if self._store is not None:
+                    item=self.createItemView(index)
+                    if not self._store.declare(index, item.validateValue(value)):
+                        return item
+                else:
+                    item=self._itemType(self, index, value)
+                    # item.setReadOnly(self._readOnly)
+                    self._items.append(item)
+                    self._indexItem[index]=item
+                    self._timeoutSort=time.time()+10.0
+                if pull:
+                    item.signalPull()
+                item.schedule()
                 return item
 
+    def declare(self, index, value=0):
+        return self._declare(index, value)
+
     def declareFromList(self, indexes, value=0):
         items=[]
         for index in indexes:
-            item=self.declare(index, value)
+            item=self._declare(index, value, pull=False)
             if item:
                 items.append(item)
+        self.signalPullItems(items)
         return items
 
     def declareRange(self, index, count, value=0):
         with self._lock:
             items=[]
             for n in range(count):
-                item=self.declare(index+n, value)
+                item=self._declare(index+n, value, pull=False)
                 items.append(item)
+            self.signalPullItems([item for item in items if item])
             return items
 
     def declareFromTo(self, indexFrom, indexTo, value=0):
@@ -743,52 +995,170 @@ class SAIAItems(object):
             pass
         return items
 
+    def subscribe(self, callback=None, queue=None, deadband=0, deadbandPercent=0, formater=None,
+            initial=False, executor=None, indexes=None):
+        """
+        Subscribe to the value changes of the given items indexes (default to every item
+        of the collection, including the ones declared later). See SAIASubscription.
+        Return the subscription (subscription.unsubscribe())
+        """
+        subscription=SAIASubscription(callback, queue, deadband, deadbandPercent, formater, initial, executor)
+        if indexes is None:
+            subscription.attach(self)
+        else:
+            for index in indexes:
+                subscription.attach(self, index)
+        return subscription
+
+    def addSubscription(self, subscription, index=None):
+        if index is not None:
+            index=self.validateIndex(index)
+            if index is None:
+                return False
+        with self._lock:
+            # copy on write (notifyChange is lock free)
+            subscriptions=dict(self._subscriptions)
+            subscriptions[index]=subscriptions.get(index, ())+(subscription,)
+            self._subscriptions=subscriptions
+        return True
+
+    def removeSubscription(self, subscription, index=None):
+        with self._lock:
+            subscriptions=dict(self._subscriptions)
+            registered=tuple(s for s in subscriptions.get(index, ()) if s is not subscription)
+            if registered:
+                subscriptions[index]=registered
+            else:
+                subscriptions.pop(index, None)
+            self._subscriptions=subscriptions
+
+    def subscriptions(self):
+        result=[]
+        for registered in self._subscriptions.values():
+            for subscription in registered:
+                if subscription not in result:
+                    result.append(subscription)
+        return result
+
+    def notifyChange(self, item, value, previous):
+        subscriptions=self._subscriptions
+        for key in (item._index, None):
+            try:
+                registered=subscriptions[key]
+            except KeyError:
+                continue
+            for subscription in registered:
+                try:
+                    subscription.notify(item, value, previous)
+                except:
+                    self.logger.exception('%s subscription notify' % self)
+
+    def createReadFuture(self, index):
+        """
+        Return (future, created), the pending read future of the given index being shared
+        """
+        with self._lock:
+            future=self._futuresRead.get(index)
+            if future is not None and not future.done():
+                return (future, False)
+            future=Future()
+            self._futuresRead[index]=future
+            return (future, True)
+
+    def popReadFutures(self, index, count):
+        """
+        Take over the pending read futures of the count items from index (list of (index, future))
+        """
+        if not self._futuresRead:
+            return None
+        futures=[]
+        with self._lock:
+            for n in range(index, index+count):
+                future=self._futuresRead.pop(n, None)
+                if future is not None:
+                    futures.append((n, future))
+        return futures
+
+    def createWriteFuture(self, index):
+        future=Future()
+        with self._lock:
+            self._futuresWrite.setdefault(index, []).append(future)
+        return future
+
+    def popWriteFutures(self, index, count):
+        """
+        Take over the pending write futures of the count items from index
+        """
+        if not self._futuresWrite:
+            return None
+        futures=[]
+        with self._lock:
+            for n in range(index, index+count):
+                futures.extend(self._futuresWrite.pop(n, ()))
+        return futures
+
+    def failFutures(self, exception):
+        with self._lock:
+            futures=list(self._futuresRead.values())
+            for pending in self._futuresWrite.values():
+                futures.extend(pending)
+            self._futuresRead={}
+            self._futuresWrite={}
+        for future in futures:
+            failFuture(future, exception)
+
     def signalPush(self, item):
         self.memory._queuePendingPush.put(item)
+        self.server.wakeup()
 
     def signalPull(self, item, urgent=False):
         if urgent:
             self.memory._queuePendingPriorityPull.put(item)
         else:
             self.memory._queuePendingPull.put(item)
+        self.server.wakeup()
+
+    def signalPullItems(self, items, urgent=False):
+        """
+        Batch version of item.signalPull() (one queue lock, one wakeup)
+        """
+        if self.isLocalNodeMode():
+            return
+        items=[item for item in items if item.preparePull()]
+        if items:
+            if urgent:
+                self.memory._queuePendingPriorityPull.putItems(items)
+            else:
+                self.memory._queuePendingPull.putItems(items)
+            self.server.wakeup()
 
     def refresh(self):
         with self._lock:
-            for item in self._items:
-                item.refresh()
+            self.signalPullItems(self.all())
 
-    def manager(self):
-        count=min(64, len(self._items))
-        while count>0:
-            count-=1
-            try:
-                with self._lock:
-                    item=self._items[self._currentItem]
-                    self._currentItem+=1
+    def getNextDeadline(self):
+        if self._timeoutSort>0:
+            return self._timeoutSort
 
-                try:
-                    item.manager()
-                except:
-                    self.logger.exception('manager()')
-            except:
-                self._currentItem=0
-                if self._timeoutSort>0:
-                    with self._lock:
-                        if time.time()>self._timeoutSort:
-                            # sortimg indexes is useful for request index optimisers
-                            self.logger.info('%s re-sorting items indexes' % self)
-                            self._items.sort(key=lambda i: i.index)
-                            self._timeoutSort=0
-                break
+    def manager(self):
+        # items refresh is driven by the memory scheduler
+        if self._timeoutSort>0:
+            with self._lock:
+                if time.time()>self._timeoutSort:
+                    # keep items sorted by index (dump, table)
+                    self.logger.info('%s re-sorting items indexes' % self)
+                    self._items.sort(key=lambda i: i.index)
+                    self._timeoutSort=0
 
     def dump(self):
         with self._lock:
-            for item in self._items:
+            for item in self.all():
                 print(item)
 
     def table(self, key=None):
         with self._lock:
             if self.count()>0:
+                from prettytable import PrettyTable
                 t=PrettyTable()
                 t.field_names = ['server', 'index', 'tag', 'value', 'age']
                 t.align['server']='l'
@@ -801,7 +1171,7 @@ class SAIAItems(object):
                 if not deviceName:
                     deviceName=self.server.host
 
-                for item in self._items:
+                for item in self.all():
                     if key and not item.match(key):
                         continue
                     age='%.01fs' % item.age()
@@ -811,16 +1181,16 @@ class SAIAItems(object):
 
     def clear(self):
         with self._lock:
-            for item in self._items:
+            for item in self.all():
                 item.clear()
 
     def __repr__(self):
-        return '<%s(%d items, max=%d, readOnly=%d, current=%d, refresh=%.01fs)>' % (self.__class__.__name__,
+        return '<%s(%d items, max=%d, readOnly=%d, refresh=%.01fs, compact=%d)>' % (self.__class__.__name__,
                     self.count(),
                     self._maxsize,
                     bool(self._readOnly),
-                    self._currentItem,
-                    self._delayRefresh)
+                    self._delayRefresh,
+                    self.isCompactStorage())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+"""
+Non-blocking logging pipeline
+
+The records are pushed by the caller (i.e. the node I/O thread) in a bounded queue
+and emitted by the (possibly slow or blocking) target handlers from a QueueListener
+thread. When the queue is full, records are dropped (and counted) instead of blocking.
+At stop (and exit), the pending records are flushed before the listener thread is joined.
+Repetitive messages (same logger, level and message, thus per server as the host is
+part of the messages) are rate limited : after burst occurrences in period seconds,
+the next ones are suppressed and their count is reported with the next emitted one.
+"""
+from __future__ import division
+
+import time
+import queue
+import atexit
+import threading
+import logging
+import logging.handlers
+
+
+class SAIALogRateLimiter(logging.Filter):
+    """
+    Per message rate limit filter (burst messages per period seconds)
+    """
+
+    MAXKEYS = 4096
+
+    def __init__(self, burst=5, period=60.0):
+        super(SAIALogRateLimiter, self).__init__()
+        self._burst=burst
+        self._period=period
+        self._lock=threading.Lock()
+        self._windows={}
+        self._suppressed=0
+
+    @property
+    def suppressed(self):
+        return self._suppressed
+
+    def filter(self, record):
+        if self._burst<=0:
+            return True
+        try:
+            key=(record.name, record.levelno, record.getMessage())
+        except:
+            return True
+
+        now=time.time()
+        with self._lock:
+            window=self._windows.get(key)
+            if window is None or now>=window[0]:
+                if len(self._windows)>=self.MAXKEYS:
+                    self._windows={}
+                suppressed=window[2] if window is not None else 0
+                self._windows[key]=[now+self._period, 1, 0]
+                if suppressed:
+                    record.msg='%s (%d similar messages suppressed)' % (record.getMessage(), suppressed)
+                    record.args=None
+                return True
+
+            window[1]+=1
+            if window[1]<=self._burst:
+                return True
+            window[2]+=1
+            self._suppressed+=1
+            return False
+
+
+class SAIALogQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler with a bounded queue, never blocking the caller (records are dropped when full)
+    """
+
+    def __init__(self, maxsize=1024):
+        super(SAIALogQueueHandler, self).__init__(queue.Queue(maxsize))
+        self._dropped=0
+        # enqueue() is called by every logging thread
+        self._lockDropped=threading.Lock()
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.onDropped()
+
+    def onDropped(self):
+        with self._lockDropped:
+            self._dropped+=1
+
+    def dropOldest(self):
+        """
+        Make room in the queue, dropping its oldest record
+        """
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            return
+        self.onDropped()
+
+    def stats(self):
+        stats={'queued': self.queue.qsize(), 'dropped': self._dropped, 'suppressed': 0}
+        for f in self.filters:
+            try:
+                stats['suppressed']+=f.suppressed
+            except AttributeError:
+                pass
+        return stats
+
+    def __repr__(self):
+        stats=self.stats()
+        return '<%s(queued=%d, dropped=%d, suppressed=%d)>' % (self.__class__.__name__,
+            stats['queued'], stats['dropped'], stats['suppressed'])
+
+
+class SAIALogQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener of a SAIALogQueueHandler, whose stop() doesn't fail on a full queue
+    """
+
+    # delay given to the listener thread to make room for the sentinel (s)
+    TIMEOUT = 5.0
+
+    def __init__(self, handler, handlers):
+        super(SAIALogQueueListener, self).__init__(handler.queue, *handlers, respect_handler_level=True)
+        self._handler=handler
+
+    def enqueue_sentinel(self):
+        # the default put_nowait() raises on a full queue, the thread would then never be
+        # joined : wait for the thread to make room, else drop the oldest records
+        try:
+            self.queue.put(self._sentinel, timeout=self.TIMEOUT)
+        except queue.Full:
+            while True:
+                self._handler.dropOldest()
+                try:
+                    self.queue.put_nowait(self._sentinel)
+                    break
+                except queue.Full:
+                    pass
+
+
+class SAIALogQueue(object):
+    """
+    SAIALogQueueHandler and its QueueListener, forwarding the records to the given handlers
+    """
+
+    def __init__(self, handlers, maxsize=1024, burst=5, period=60.0):
+        self._handler=SAIALogQueueHandler(maxsize)
+        self._limiter=SAIALogRateLimiter(burst, period)
+        self._handler.addFilter(self._limiter)
+        self._listener=SAIALogQueueListener(self._handler, handlers)
+        self._running=False
+        self._atexit=False
+
+    @property
+    def handler(self):
+        return self._handler
+
+    @property
+    def limiter(self):
+        return self._limiter
+
+    def start(self):
+        if not self._running:
+            self._listener.start()
+            self._running=True
+            if not self._atexit:
+                # flush pending records at exit
+                atexit.register(self.stop)
+                self._atexit=True
+
+    def stop(self):
+        if self._running:
+            self._running=False
+            try:
+                self._listener.stop()
+            except:
+                pass
+
+    def isRunning(self):
+        return self._running
+
+    def stats(self):
+        return self._handler.stats()
+
+    def __repr__(self):
+        return '<%s(running=%d, %s)>' % (self.__class__.__name__, self._running, self._handler)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,7 +1,7 @@
 from __future__ import print_function  # Python 2/3 compatibility
 
-# python2-3 compatibility require 'pip install future'
-from queue import Queue
+from threading import Lock
+from collections import deque
 import time
 
 from .items import SAIABooleanItem
@@ -22,30 +22,98 @@ from .request import SAIARequestWriteCounters
 
 from .symbol import SAIASymbol
 
+from .scheduler import SAIAItemScheduler
 
-class SAIAItemQueue(Queue):
-    def _init(self, maxsize):
-        self._queue=[]
 
-    def _qsize(self):
+class SAIAItemQueue(object):
+    """
+    De-duplicating FIFO of pending items
+
+    Membership is recorded on the item itself (one bit per queue in item._queued),
+    so that put() and get() are O(1) whatever the number of queued items.
+    """
+
+    def __init__(self, mask):
+        self._mask=mask
+        self._lock=Lock()
+        self._queue=deque()
+
+    def qsize(self):
         return len(self._queue)
 
-    def _put(self, item):
-        if item not in self._queue:
-            self._queue.insert(0, item)
+    def empty(self):
+        return not self._queue
+
+    def isQueued(self, item):
+        return bool(item._queued & self._mask)
+
+    def put(self, item):
+        """
+        Queue the item (if not already queued). Return True if the item was queued
+        """
+        with self._lock:
+            if item._queued & self._mask:
+                return False
+            item._queued |= self._mask
+            self._queue.append(item)
+            return True
+
+    def putItems(self, items):
+        """
+        Queue each given item not already queued. Return the number of queued items
+        """
+        count=0
+        mask=self._mask
+        with self._lock:
+            for item in items:
+                if not item._queued & mask:
+                    item._queued |= mask
+                    self._queue.append(item)
+                    count+=1
+        return count
+
+    def get(self):
+        """
+        Return the oldest queued item (None if empty)
+        """
+        with self._lock:
+            try:
+                item=self._queue.popleft()
+                item._queued &= ~self._mask
+                return item
+            except IndexError:
+                pass
 
-    def _get(self):
-        item=self._queue.pop()
-        return item
+    def drain(self, maxcount=None):
+        """
+        Remove and return (up to maxcount) queued items, in queue order
+        """
+        with self._lock:
+            queue=self._queue
+            if maxcount is None or maxcount>=len(queue):
+                items=list(queue)
+                queue.clear()
+            else:
+                items=[queue.popleft() for n in range(maxcount)]
+            mask=~self._mask
+            for item in items:
+                item._queued &= mask
+            return items
+
+    def clear(self):
+        self.drain()
+
+    def __repr__(self):
+        return '<%s(%d items)>' % (self.__class__.__name__, self.qsize())
 
 
 class SAIAItemFlag(SAIABooleanItem):
     def onInit(self):
         super(SAIAItemFlag, self).onInit()
 
-    def pull(self):
+    def pull(self, maxcount=None):
         request=SAIARequestReadFlags(self.server.link)
-        request.setup(self, maxcount=96, holes=True)
+        request.setup(self, maxcount=maxcount or self.READ_MAXCOUNT, holes=True)
         return request.initiate()
 
     def push(self):
@@ -66,9 +134,9 @@ class SAIAItemInput(SAIABooleanItem):
         super(SAIAItemInput, self).onInit()
         self.setReadOnly()
 
-    def pull(self):
+    def pull(self, maxcount=None):
         request=SAIARequestReadInputs(self.server.link)
-        request.setup(self, maxcount=96, holes=True)
+        request.setup(self, maxcount=maxcount or self.READ_MAXCOUNT, holes=True)
         return request.initiate()
 
 
@@ -76,9 +144,9 @@ class SAIAItemOutput(SAIABooleanItem):
     def onInit(self):
         super(SAIAItemOutput, self).onInit()
 
-    def pull(self):
+    def pull(self, maxcount=None):
         request=SAIARequestReadOutputs(self.server.link)
-        request.setup(self, maxcount=96, holes=True)
+        request.setup(self, maxcount=maxcount or self.READ_MAXCOUNT, holes=True)
         return request.initiate()
 
     def push(self):
@@ -91,9 +159,9 @@ class SAIAItemRegister(SAIAAnalogItem):
     def onInit(self):
         super(SAIAItemRegister, self).onInit()
 
-    def pull(self):
+    def pull(self, maxcount=None):
         request=SAIARequestReadRegisters(self.server.link)
-        request.setup(self, maxcount=32, holes=True)
+        request.setup(self, maxcount=maxcount or self.READ_MAXCOUNT, holes=True)
         return request.initiate()
 
     def push(self):
@@ -115,9 +183,9 @@ class SAIAItemTimer(SAIAAnalogItem):
         if self.parent.isLocalNodeMode():
             self._stampTimer=0
 
-    def pull(self):
+    def pull(self, maxcount=None):
         request=SAIARequestReadTimers(self.server.link)
-        request.setup(self, maxcount=32, holes=True)
+        request.setup(self, maxcount=maxcount or self.READ_MAXCOUNT, holes=True)
         return request.initiate()
 
     def push(self):
@@ -146,11 +214,22 @@ class SAIAItemTimer(SAIAAnalogItem):
                         self.logger.info('<%s(index=%d)> Timeout!' % (self.__class__.__name__, self.index))
 
             self._stampTimer=time.time()
+            if self.value<=0:
+                # idle timers are not scheduled, restart from the next value
+                self._stampTimer=0
 
     def manager(self):
         super(SAIAItemTimer, self).manager()
         self.decrementTimer()
 
+    def getNextDeadline(self):
+        if self.parent.isLocalNodeMode():
+            # local timers are decremented by the item manager
+            if self._value:
+                return time.time()+self.parent._tickBaseTime
+            return None
+        return super(SAIAItemTimer, self).getNextDeadline()
+
     def isTimeout(self):
         if self.value<=0:
             return True
@@ -161,9 +240,9 @@ class SAIAItemCounter(SAIAAnalogItem):
     def onInit(self):
         super(SAIAItemCounter, self).onInit()
 
-    def pull(self):
+    def pull(self, maxcount=None):
         request=SAIARequestReadCounters(self.server.link)
-        request.setup(self, maxcount=32, holes=True)
+        request.setup(self, maxcount=maxcount or self.READ_MAXCOUNT, holes=True)
         return request.initiate()
 
     def push(self):
@@ -327,16 +406,21 @@ class SAIAMemory(object):
         self._server=server
         self._localNodeMode=localNodeMode
         self._enableOnTheFlyItemCreation=enableOnTheFlyItemCreation
+        self._scheduler=SAIAItemScheduler(self)
         self._inputs=SAIAInputs(self)
         self._outputs=SAIAOutputs(self)
         self._flags=SAIAFlags(self)
         self._registers=SAIARegisters(self)
         self._timers=SAIATimers(self)
         self._counters=SAIACounters(self)
-        self._queuePendingPull=SAIAItemQueue()
-        self._queuePendingPriorityPull=SAIAItemQueue()
-        self._queuePendingPush=SAIAItemQueue()
+        self._queuePendingPull=SAIAItemQueue(0x01)
+        self._queuePendingPriorityPull=SAIAItemQueue(0x02)
+        self._queuePendingPush=SAIAItemQueue(0x04)
+        self._plannedPriorityReads=deque()
+        self._plannedReads=deque()
         self._readOnly=False
+        # items values older than this stamp were restored from a snapshot (warm start)
+        self._stampWarmStart=0
 
     @property
     def server(self):
@@ -346,6 +430,10 @@ class SAIAMemory(object):
     def logger(self):
         return self.server.logger
 
+    @property
+    def scheduler(self):
+        return self._scheduler
+
     @property
     def inputs(self):
         return self._inputs
@@ -384,6 +472,17 @@ class SAIAMemory(object):
             return True
         return False
 
+    def setCompactStorage(self, state=True):
+        """
+        Enable the compact (array based) storage mode for every items collection.
+        Must be called before any item declaration (see SAIAItems.setCompactStorage)
+        """
+        result=True
+        for items in self.items():
+            if not items.setCompactStorage(state):
+                result=False
+        return result
+
     def enableOnTheFlyItemCreation(self, state=True):
         self._enableOnTheFlyItemCreation=state
 
@@ -414,64 +513,138 @@ class SAIAMemory(object):
             except:
                 pass
 
+    def failFutures(self, exception):
+        """
+        Fail every pending readAsync()/writeAsync() future
+        """
+        for items in self.items():
+            items.failFutures(exception)
+
     def getNextPendingPush(self):
-        try:
-            count=32
-            while count>0:
-                item=self._queuePendingPush.get(False)
-                if item.isPendingPushRequest():
-                    item.clearPush()
-                    return item
-                count-=1
-        except:
-            pass
+        count=32
+        while count>0:
+            item=self._queuePendingPush.get()
+            if item is None:
+                break
+            if item.isPendingPushRequest():
+                item.clearPush()
+                return item
+            count-=1
 
     def getNextPendingPull(self):
         count=64
-        try:
+        for queue in (self._queuePendingPriorityPull, self._queuePendingPull):
             while count>0:
-                item=self._queuePendingPriorityPull.get(False)
+                item=queue.get()
+                if item is None:
+                    break
                 if item.isPendingPullRequest():
                     item.clearPull()
                     return item
                 count-=1
-        except:
-            pass
 
-        try:
-            while count>0:
-                item=self._queuePendingPull.get(False)
-                if item.isPendingPullRequest():
-                    item.clearPull()
-                    return item
-                count-=1
-        except:
-            pass
+    def getNextDeadline(self):
+        """
+        Return the time at which the memory manager has to be called again
+        """
+        if self.server.isAlive() and self.server.link.isAvailable():
+            if self.isPendingPlannedPull():
+                return time.time()
+            if not (self._queuePendingPush.empty() and self._queuePendingPull.empty() and self._queuePendingPriorityPull.empty()):
+                return time.time()
+
+        deadlines=[d for d in (items.getNextDeadline() for items in self.items()) if d is not None]
+        deadline=self._scheduler.getNextDeadline()
+        if deadline is not None:
+            deadlines.append(deadline)
+        if deadlines:
+            return min(deadlines)
+
+    def planPendingPull(self, queue, planned):
+        """
+        Drain the given pending pull queue and append to planned the minimal
+        set of block reads covering every due items (see SAIAReadPlanner)
+        """
+        due={}
+        for item in queue.drain():
+            if item.isPendingPullRequest():
+                item.clearPull()
+                due.setdefault(item.parent, []).append(item)
+
+        for items in self.items():
+            try:
+                planned.extend(items.planner.plan(due[items]))
+            except KeyError:
+                pass
+            except:
+                self.logger.exception('planner')
+
+    def getNextPlannedPull(self):
+        """
+        Return the next (item, count) block read to initiate. Urgent pulls are
+        planned (and processed) first, standard pulls are planned by cycles, each
+        cycle taking every item currently due
+        """
+        if not self._queuePendingPriorityPull.empty():
+            self.planPendingPull(self._queuePendingPriorityPull, self._plannedPriorityReads)
+        if self._plannedPriorityReads:
+            return self._plannedPriorityReads.popleft()
+
+        if not self._plannedReads:
+            self.planPendingPull(self._queuePendingPull, self._plannedReads)
+        if self._plannedReads:
+            return self._plannedReads.popleft()
+
+    def isPendingPlannedPull(self):
+        if self._plannedPriorityReads or self._plannedReads:
+            return True
+        return False
+
+    def managerItems(self, maxcount=1024):
+        """
+        Manage (and re-arm) the items whose scheduled deadline is reached
+        """
+        items=self._scheduler.popDueItems(maxcount)
+        for item in items:
+            try:
+                item.manager()
+            except:
+                self.logger.exception('item:manager')
+            item.schedule()
+
+        for collection in self.items():
+            collection.manager()
 
     def manager(self):
         activity=False
         try:
-            for items in self.items():
-                items.manager()
+            self.managerItems()
         except:
             self.logger.exception('items:manager')
 
-        if self.server.isAlive() and self.server.link.isIdle():
-            item=self.getNextPendingPush()
-            if item:
-                if item.push():
-                    activity=True
-                else:
-                    # TODO: requeue ?
-                    self.logger.error('push')
-            else:
-                item=self.getNextPendingPull()
+        if self.server.isAlive():
+            # one request per available link slot (more than one if the link is pipelined)
+            slots=self.server.link.getAvailableSlots()
+            while slots>0:
+                slots-=1
+                item=self.getNextPendingPush()
                 if item:
-                    if item.pull():
+                    if item.push():
                         activity=True
                     else:
                         # TODO: requeue ?
-                        self.logger.error('pull')
+                        self.logger.error('push')
+                else:
+                    block=self.getNextPlannedPull()
+                    if block:
+                        (item, count)=block
+                        if item.pull(count):
+                            activity=True
+                        else:
+                            # TODO: requeue ?
+                            self.logger.error('pull')
+                    else:
+                        break
 
         if activity:
             return True
@@ -493,11 +666,13 @@ class SAIAMemory(object):
         return False
 
     def __repr__(self):
-        return '<%s(%d items, queues %dR:%dR!:%dW)>' % (self.__class__.__name__,
+        return '<%s(%d items, queues %dR:%dR!:%dW, planned %dR:%dR!)>' % (self.__class__.__name__,
             self.count(),
             self._queuePendingPull.qsize(),
             self._queuePendingPriorityPull.qsize(),
-            self._queuePendingPush.qsize())
+            self._queuePendingPush.qsize(),
+            len(self._plannedReads),
+            len(self._plannedPriorityReads))
 
 
 if __name__ == "__main__":
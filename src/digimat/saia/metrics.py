@@ -0,0 +1,437 @@
+from __future__ import division
+
+import os
+import time
+import threading
+
+from .request import SAIARequest
+from .codec import FRAME_OVERHEAD
+from .breaker import SAIACircuitBreaker
+
+
+class SAIAHistogram(object):
+    """
+    Cumulative (Prometheus like) histogram with fixed upper bounds
+    """
+
+    # round trip time buckets (seconds)
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self._bounds=tuple(sorted(buckets))
+        self._counts=[0]*(len(self._bounds)+1)
+        self._count=0
+        self._sum=0.0
+
+    def observe(self, value):
+        n=0
+        for bound in self._bounds:
+            if value<=bound:
+                break
+            n+=1
+        self._counts[n]+=1
+        self._count+=1
+        self._sum+=value
+
+    def count(self):
+        return self._count
+
+    def sum(self):
+        return self._sum
+
+    def buckets(self):
+        """
+        Return the list of (upper bound, cumulative count), the last bound being +Inf
+        """
+        result=[]
+        total=0
+        for bound, count in zip(self._bounds+(float('inf'),), self._counts):
+            total+=count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self):
+        return {'count': self._count,
+            'sum': self._sum,
+            'buckets': [('+Inf' if bound==float('inf') else bound, count) for bound, count in self.buckets()]}
+
+    def __repr__(self):
+        return '<%s(count=%d, sum=%.03f)>' % (self.__class__.__name__, self._count, self._sum)
+
+
+def _commandNames():
+    names={}
+    for name in dir(SAIARequest):
+        if name.startswith('COMMAND_'):
+            names[getattr(SAIARequest, name)]=name[8:].lower()
+    return names
+
+
+class SAIACommandMetrics(object):
+    """
+    Counters of one request command code on one link
+    """
+
+    NAMES = _commandNames()
+
+    def __init__(self, command):
+        self._command=command
+        self.requests=0
+        self.retries=0
+        self.responses=0
+        self.acks=0
+        self.timeouts=0
+        self.failures=0
+        self.bytesOut=0
+        self.bytesIn=0
+        self.naks={}
+        self.rtt=SAIAHistogram()
+
+    @property
+    def command(self):
+        return self._command
+
+    @property
+    def name(self):
+        try:
+            return self.NAMES[self._command]
+        except KeyError:
+            return '0x%02x' % self._command
+
+    def snapshot(self):
+        return {'command': self._command,
+            'requests': self.requests,
+            'retries': self.retries,
+            'responses': self.responses,
+            'acks': self.acks,
+            'timeouts': self.timeouts,
+            'failures': self.failures,
+            'bytesOut': self.bytesOut,
+            'bytesIn': self.bytesIn,
+            'naks': dict(self.naks),
+            'rtt': self.rtt.snapshot()}
+
+
+class SAIALinkMetrics(object):
+    """
+    Per command request metrics of a SAIALink (fed by the link state machines)
+    """
+
+    def __init__(self, link):
+        assert link.__class__.__name__=='SAIALink'
+        self._link=link
+        self._lock=threading.Lock()
+        self._commands={}
+
+    @property
+    def link(self):
+        return self._link
+
+    def command(self, request):
+        try:
+            return self._commands[request._command]
+        except KeyError:
+            with self._lock:
+                metrics=SAIACommandMetrics(request._command)
+                self._commands[request._command]=metrics
+                return metrics
+
+    def onRequestSent(self, request, size):
+        metrics=self.command(request)
+        if request._transmissions>1:
+            metrics.retries+=1
+        else:
+            metrics.requests+=1
+        metrics.bytesOut+=size
+
+    def onRequestTimeout(self, request):
+        self.command(request).timeouts+=1
+
+    def onRequestFailure(self, request):
+        self.command(request).failures+=1
+
+    def onRequestResponse(self, request, size, code=None):
+        """
+        Response (code None) or ack/nak (code 0 is an ack) received for the request
+        """
+        metrics=self.command(request)
+        metrics.bytesIn+=size+FRAME_OVERHEAD
+        metrics.rtt.observe(max(0.0, time.time()-request._stamp))
+        if code is None:
+            metrics.responses+=1
+        elif code==0:
+            metrics.acks+=1
+        else:
+            metrics.naks[code]=metrics.naks.get(code, 0)+1
+
+    def commands(self):
+        with self._lock:
+            return list(self._commands.values())
+
+    def queues(self):
+        """
+        Current depth of the server memory pending queues and of the link
+        """
+        link=self._link
+        memory=link.server.memory
+        return {'pull': memory._queuePendingPull.qsize(),
+            'priorityPull': memory._queuePendingPriorityPull.qsize(),
+            'push': memory._queuePendingPush.qsize(),
+            'requests': link.countPendingRequests()}
+
+    def reset(self):
+        with self._lock:
+            self._commands={}
+
+    def snapshot(self):
+        link=self._link
+        server=link.server
+        return {'host': server.host,
+            'lid': server.lid,
+            'alive': link.isAlive(),
+            'srtt': link.srtt,
+            'rto': link.rto,
+            'queues': self.queues(),
+            'breaker': server.breaker.snapshot(),
+            'commands': dict((metrics.name, metrics.snapshot()) for metrics in self.commands())}
+
+    def __repr__(self):
+        return '<%s(%s, %d commands)>' % (self.__class__.__name__, self._link.server.host, len(self._commands))
+
+
+class SAIAMetrics(object):
+    """
+    Node metrics registry : snapshot of the metrics of every (remote) server link,
+    available as a dict or as Prometheus text exposition (file or local http endpoint)
+    """
+
+    PREFIX = 'saia'
+
+    def __init__(self, node):
+        assert node.__class__.__name__=='SAIANode'
+        self._node=node
+        self._httpd=None
+        self._thread=None
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def logger(self):
+        return self._node.logger
+
+    def links(self):
+        return [server.link.metrics for server in self._node.servers.all()]
+
+    def reset(self):
+        for metrics in self.links():
+            metrics.reset()
+
+    def snapshot(self):
+        """
+        Return the metrics of every server as a dict {host: metrics}
+        """
+        servers={}
+        for metrics in self.links():
+            try:
+                data=metrics.snapshot()
+                servers[data['host']]=data
+            except:
+                self.logger.exception('metrics:snapshot()')
+        snapshot={'stamp': time.time(), 'servers': servers, 'node': self._node.stats()}
+        logqueue=self._node.getLogQueue()
+        if logqueue is not None:
+            snapshot['log']=logqueue.stats()
+        return snapshot
+
+    def _labels(self, **labels):
+        return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for key, value in sorted(labels.items()))
+
+    def prometheus(self):
+        """
+        Return the metrics in Prometheus text exposition format
+        """
+        prefix=self.PREFIX
+        snapshot=self.snapshot()
+
+        counters=(('requests', 'requests_total', 'Requests sent (first transmission)'),
+            ('retries', 'retries_total', 'Requests retransmissions'),
+            ('responses', 'responses_total', 'Responses received'),
+            ('acks', 'acks_total', 'ACK received'),
+            ('timeouts', 'timeouts_total', 'Response timeouts'),
+            ('failures', 'failures_total', 'Requests failed (retries exhausted)'),
+            ('bytesOut', 'bytes_out_total', 'Bytes sent'),
+            ('bytesIn', 'bytes_in_total', 'Bytes received'))
+
+        lines=[]
+
+        def header(name, text, mtype):
+            lines.append('# HELP %s_%s %s' % (prefix, name, text))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, mtype))
+
+        servers=sorted(snapshot['servers'].values(), key=lambda data: data['host'])
+
+        header('link_alive', 'Link state (1=alive)', 'gauge')
+        for data in servers:
+            lines.append('%s_link_alive%s %d' % (prefix, self._labels(host=data['host'], lid=data['lid']), data['alive']))
+
+        header('srtt_seconds', 'Smoothed round trip time', 'gauge')
+        for data in servers:
+            if data['srtt'] is not None:
+                lines.append('%s_srtt_seconds%s %f' % (prefix, self._labels(host=data['host'], lid=data['lid']), data['srtt']))
+
+        header('rto_seconds', 'Retransmission timeout', 'gauge')
+        for data in servers:
+            lines.append('%s_rto_seconds%s %f' % (prefix, self._labels(host=data['host'], lid=data['lid']), data['rto']))
+
+        header('queue_depth', 'Pending items (pull, priorityPull, push) and link requests', 'gauge')
+        for data in servers:
+            for queue, depth in sorted(data['queues'].items()):
+                lines.append('%s_queue_depth%s %d' % (prefix, self._labels(host=data['host'], lid=data['lid'], queue=queue), depth))
+
+        header('breaker_state', 'Circuit breaker state (0=closed, 1=open, 2=halfopen)', 'gauge')
+        states=dict((name, state) for state, name in SAIACircuitBreaker.STATES.items())
+        for data in servers:
+            lines.append('%s_breaker_state%s %d' % (prefix, self._labels(host=data['host'], lid=data['lid']), states[data['breaker']['state']]))
+
+        header('breaker_opens_total', 'Circuit breaker openings', 'counter')
+        for data in servers:
+            lines.append('%s_breaker_opens_total%s %d' % (prefix, self._labels(host=data['host'], lid=data['lid']), data['breaker']['opens']))
+
+        for key, name, text in counters:
+            header(name, text, 'counter')
+            for data in servers:
+                for command, metrics in sorted(data['commands'].items()):
+                    labels=self._labels(host=data['host'], lid=data['lid'], command=command)
+                    lines.append('%s_%s%s %d' % (prefix, name, labels, metrics[key]))
+
+        header('naks_total', 'NAK received (by code)', 'counter')
+        for data in servers:
+            for command, metrics in sorted(data['commands'].items()):
+                for code, count in sorted(metrics['naks'].items()):
+                    labels=self._labels(host=data['host'], lid=data['lid'], command=command, code=code)
+                    lines.append('%s_naks_total%s %d' % (prefix, labels, count))
+
+        header('rtt_seconds', 'Request round trip time', 'histogram')
+        for data in servers:
+            for command, metrics in sorted(data['commands'].items()):
+                rtt=metrics['rtt']
+                for bound, count in rtt['buckets']:
+                    labels=self._labels(host=data['host'], lid=data['lid'], command=command, le=bound)
+                    lines.append('%s_rtt_seconds_bucket%s %d' % (prefix, labels, count))
+                labels=self._labels(host=data['host'], lid=data['lid'], command=command)
+                lines.append('%s_rtt_seconds_sum%s %f' % (prefix, labels, rtt['sum']))
+                lines.append('%s_rtt_seconds_count%s %d' % (prefix, labels, rtt['count']))
+
+        stats=snapshot['node'].get('socket')
+        if stats:
+            header('socket_buffer_bytes', 'Node socket effective buffer size', 'gauge')
+            lines.append('%s_socket_buffer_bytes%s %d' % (prefix, self._labels(buffer='rcvbuf'), stats['rcvbuf'] or 0))
+            lines.append('%s_socket_buffer_bytes%s %d' % (prefix, self._labels(buffer='sndbuf'), stats['sndbuf'] or 0))
+            if 'drops' in stats:
+                header('socket_drops_total', 'Datagrams dropped by the kernel (node socket)', 'counter')
+                lines.append('%s_socket_drops_total %d' % (prefix, stats['drops']))
+                header('socket_rx_queue_bytes', 'Node socket receive queue', 'gauge')
+                lines.append('%s_socket_rx_queue_bytes %d' % (prefix, stats['rxQueue']))
+            header('socket_datagrams_total', 'Datagrams received/sent by the node socket', 'counter')
+            lines.append('%s_socket_datagrams_total%s %d' % (prefix, self._labels(direction='in'), stats['datagramsRecv']))
+            lines.append('%s_socket_datagrams_total%s %d' % (prefix, self._labels(direction='out'), stats['datagramsSend']))
+            header('socket_syscalls_total', 'Node socket receive/send syscalls', 'counter')
+            lines.append('%s_socket_syscalls_total%s %d' % (prefix, self._labels(direction='in'), stats['syscallsRecv']))
+            lines.append('%s_socket_syscalls_total%s %d' % (prefix, self._labels(direction='out'), stats['syscallsSend']))
+
+        udp=snapshot['node'].get('udp')
+        if udp:
+            header('udp_errors_total', 'System wide udp errors (kernel)', 'counter')
+            for key in ('InErrors', 'RcvbufErrors', 'SndbufErrors'):
+                if key in udp:
+                    lines.append('%s_udp_errors_total%s %d' % (prefix, self._labels(counter=key), udp[key]))
+
+        log=snapshot.get('log')
+        if log:
+            header('log_dropped_total', 'Log records dropped (queue full)', 'counter')
+            lines.append('%s_log_dropped_total %d' % (prefix, log['dropped']))
+            header('log_suppressed_total', 'Log records suppressed (rate limit)', 'counter')
+            lines.append('%s_log_suppressed_total %d' % (prefix, log['suppressed']))
+            header('log_queued', 'Log records waiting in queue', 'gauge')
+            lines.append('%s_log_queued %d' % (prefix, log['queued']))
+
+        return '\n'.join(lines)+'\n'
+
+    def writePrometheus(self, fpath):
+        """
+        Write the Prometheus text exposition to the given file (atomic replace,
+        suitable for the node_exporter textfile collector)
+        """
+        try:
+            tmp='%s.tmp' % fpath
+            with open(tmp, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(tmp, fpath)
+            return True
+        except:
+            self.logger.exception('metrics:writePrometheus(%s)' % fpath)
+
+    def serve(self, port=9505, address='127.0.0.1'):
+        """
+        Serve the Prometheus text exposition over http (GET /metrics) on a local socket
+        """
+        if self._httpd is not None:
+            return True
+
+        try:
+            from http.server import BaseHTTPRequestHandler
+            from http.server import HTTPServer
+
+            metrics=self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    data=metrics.prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, *args):
+                    pass
+
+            self._httpd=HTTPServer((address, int(port)), Handler)
+            self._thread=threading.Thread(target=self._httpd.serve_forever, name='SAIAMetrics')
+            self._thread.daemon=True
+            self._thread.start()
+            self.logger.info('metrics available on http://%s:%d/metrics' % (address, self._httpd.server_port))
+            return True
+        except:
+            self.logger.exception('metrics:serve()')
+            self._httpd=None
+
+    @property
+    def port(self):
+        try:
+            return self._httpd.server_port
+        except:
+            pass
+
+    def stop(self):
+        if self._httpd is not None:
+            try:
+                self._httpd.shutdown()
+                self._httpd.server_close()
+            except:
+                pass
+            self._httpd=None
+            self._thread=None
+
+    def __repr__(self):
+        return '<%s(%d links, http=%s)>' % (self.__class__.__name__, len(self.links()), self.port)
+
+
+if __name__ == "__main__":
+    pass
@@ -6,22 +6,19 @@ import socket
 import struct
 import os
 import sys
-import netifaces
 
-import pkg_resources
 
 import logging
 import logging.handlers
-from digimat.jobs import JobManager
-
-from .singleton import Singleton
 
 from .server import SAIAServer
-from .server import SAIASBusCRC
 from .server import SAIAServers
 
 from .request import SAIARequest
-from .request import SAIASBusCRCTableCheck
+from .crc import SAIASBusCRCTableCheck
+from .crc import SAIACRC
+
+from .codec import decodeFrame
 
 from .response import SAIAResponseReadStationNumber
 from .response import SAIAResponseReadProgramVersion
@@ -38,7 +35,14 @@ from .response import SAIAResponseNAK
 
 from .items import SAIAItemGroup
 
-from .ModbusDataLib import bin2boollist
+from .bitpack import unpackBooleans
+from .metrics import SAIAMetrics
+from .subscription import SAIASubscriptionDispatcher
+from .tracing import SAIATRACER
+from .logs import SAIALogQueue
+from .snapshot import SAIASnapshot
+from .datagram import SAIADatagramIO
+from .datagram import readUdpCounters
 
 
 # NOTICE
@@ -219,7 +223,7 @@ class SAIAHandler_WRITE_OUTPUTS(SAIANodeRequestHandler):
             items=self.node.memory.outputs
             (bytecount, address, fiocount)=struct.unpack('>BHB', data[0:4])
             if address>=0 and fiocount<=32:
-                values=bin2boollist(data[4:])
+                values=unpackBooleans(data[4:], fiocount+1)
                 for n in range(fiocount+1):
                     items[address+n].value=values[n]
                 return self.ack()
@@ -233,7 +237,7 @@ class SAIAHandler_WRITE_FLAGS(SAIANodeRequestHandler):
             items=self.node.memory.flags
             (bytecount, address, fiocount)=struct.unpack('>BHB', data[0:4])
             if address>=0 and fiocount<=32:
-                values=bin2boollist(data[4:])
+                values=unpackBooleans(data[4:], fiocount+1)
                 for n in range(fiocount+1):
                     items[address+n].value=values[n]
                 return self.ack()
@@ -344,7 +348,11 @@ class SAIAHandler_CLEAR_ALL(SAIANodeRequestHandler):
     # COMMAND = SAIARequest.COMMAND_RESTART_COLD_FLAG
 
 
-class SAIANodeHandler(Singleton):
+class SAIANodeHandler(object):
+    """
+    Local node command handlers (one instance per node)
+    """
+
     def __init__(self, node):
         self._node=node
         self._handlers={}
@@ -370,27 +378,13 @@ class SAIANodeHandler(Singleton):
     def registerAllHandlers(self):
         def get_all_subclasses(cls):
             """ Generator of all class's subclasses. """
-            try:
-                for subclass in cls.__subclasses__():
+            for subclass in cls.__subclasses__():
+                yield subclass
+                for subclass in get_all_subclasses(subclass):
                     yield subclass
-                    for subclass in get_all_subclasses(subclass):
-                        yield subclass
-            except TypeError:
-                return
-
-        def all_subclasses(classname):
-            for cls in get_all_subclasses(object):
-                if cls.__name__.split('.')[-1] == classname:
-                    break
-            else:
-                raise ValueError('class %s not found' % classname)
-            direct_subclasses = cls.__subclasses__()
-            return direct_subclasses + [g for s in direct_subclasses
-                for g in all_subclasses(s.__name__)]
 
         try:
-            subcls=all_subclasses('SAIANodeRequestHandler')
-            for cls in subcls:
+            for cls in get_all_subclasses(SAIANodeRequestHandler):
                 if cls.COMMAND is not None:
                     self.registerHandler(cls)
         except:
@@ -412,6 +406,9 @@ class SAIANodeHandler(Singleton):
 
 
 class SAIALogger(object):
+    # title -> SAIALogQueue (a logger must be given only one queue)
+    _queues={}
+
     def __init__(self, title="SAIA"):
         self._title=title
 
@@ -425,6 +422,34 @@ class SAIALogger(object):
         logger.addHandler(handler)
         return logger
 
+    def queue(self, level=logging.DEBUG, host='localhost', handlers=None, maxsize=1024, burst=5, period=60.0):
+        """
+        Non blocking logger : records are queued (bounded queue, dropped when full) and emitted
+        by a listener thread to the given handlers (default tcp SocketHandler on host).
+        Repetitive messages are limited to burst occurrences per period seconds
+        """
+        logger=self.create()
+        logger.setLevel(level)
+        logqueue=SAIALogger._queues.get(self._title)
+        if logqueue is None:
+            if not handlers:
+                handlers=[logging.handlers.SocketHandler(host, logging.handlers.DEFAULT_TCP_LOGGING_PORT)]
+            logqueue=SAIALogQueue(handlers, maxsize, burst, period)
+            SAIALogger._queues[self._title]=logqueue
+            logger.addHandler(logqueue.handler)
+        logqueue.start()
+        return logger
+
+    @classmethod
+    def getQueue(cls, logger):
+        """
+        Return the SAIALogQueue of the given logger (None if the logger is not queued)
+        """
+        try:
+            return cls._queues.get(logger.name)
+        except:
+            pass
+
     def null(self):
         logger=self.create()
         logger.setLevel(logging.ERROR)
@@ -434,13 +459,21 @@ class SAIALogger(object):
 
 
 class SAIANode(object):
-    def __init__(self, lid=253, port=SAIAServer.UDP_DEFAULT_PORT, logger=None, autostart=True, scanner=None, broadcastAddress='255.255.255.255', debug=False):
+
+    ENGINE_JOBS = 'jobs'
+    ENGINE_ASYNCIO = 'asyncio'
+
+    def __init__(self, lid=253, port=SAIAServer.UDP_DEFAULT_PORT, logger=None, autostart=True, scanner=None, broadcastAddress='255.255.255.255', debug=False, engine=None, rcvbuf=None, sndbuf=None):
+        self._engine=None
+        self._engineType=engine or SAIANode.ENGINE_JOBS
         self._socket=None
+        self._io=None
         self._lid=int(lid)
         self._debug=debug
 
         if logger is None:
-            logger=SAIALogger().tcp()
+            # never block the node thread on the log socket
+            logger=SAIALogger().queue()
 
         self._logger=logger
         self._localServer=SAIAServer(self, 'localnode', self._lid, localNodeMode=True)
@@ -453,8 +486,16 @@ class SAIANode(object):
 
         self._mapFileStoragePath=None
         self._servers=SAIAServers(self)
+        self._metrics=SAIAMetrics(self)
+        self._snapshot=None
+        self._sharedMemory=None
+        self._workers=None
+        self._dispatcher=SAIASubscriptionDispatcher(self.logger)
 
         self._port=int(port)
+        # socket buffers sizes (None=system default)
+        self._rcvbuf=rcvbuf
+        self._sndbuf=sndbuf
         self._timeoutSocketInhibit=0
         self._interfaces=self.getInterfacesIpAddress()
         if self._interfaces:
@@ -463,8 +504,10 @@ class SAIANode(object):
 
         self._handler=SAIANodeHandler(self)
 
-        if not SAIASBusCRCTableCheck():
+        if not SAIASBusCRCTableCheck() or not SAIACRC.name:
             self.logger.error('SAIA CRC table consistency failure!')
+        else:
+            self.logger.debug('SAIA CRC engine [%s]' % SAIACRC.name)
 
         self.logger.info('*** Thanks for using the digimat.saia module v%s !' % self.version)
         self.logger.debug('*** https://pypi.org/project/digimat.saia/')
@@ -487,8 +530,14 @@ class SAIANode(object):
 
     def getVersion(self):
         try:
-            distribution=pkg_resources.get_distribution('digimat.saia')
-            return distribution.parsed_version
+            # importlib.metadata is much lighter than pkg_resources (Python 3.8+)
+            from importlib.metadata import version
+            return version('digimat.saia')
+        except:
+            pass
+        try:
+            import pkg_resources
+            return pkg_resources.get_distribution('digimat.saia').version
         except:
             pass
 
@@ -508,6 +557,82 @@ class SAIANode(object):
     def servers(self):
         return self._servers
 
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def dispatcher(self):
+        # default executor of the subscriptions callbacks
+        return self._dispatcher
+
+    def enableSnapshot(self, fpath, period=60.0, restore=True):
+        """
+        Warm start : restore the node state (servers, device info, items last values) from
+        the snapshot file if it exists, then save it every period seconds and when the node is stopped.
+        Must be called before the node is started (autostart=False), as the restored servers and
+        items would be raced by the node manager
+        """
+        if self._snapshot is None:
+            if restore and self.isRunning():
+                self.logger.error('snapshot [%s] not enabled, the node must not be started before the restore (autostart=False)' % fpath)
+                return None
+            self._snapshot=SAIASnapshot(self, fpath, period)
+            if restore:
+                self._snapshot.restore()
+            self._snapshot.start()
+        return self._snapshot
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def enableSharedMemoryExport(self, prefix='saia', period=0.5, path=None, capacity=None):
+        """
+        Export the memory (process image) of the local node and of every server to shared memory
+        segments (or mmap'ed files in the path directory), refreshed every period seconds.
+        Other processes can read them with SAIASharedMemoryReader(host, prefix, path)
+        """
+        if self._sharedMemory is None:
+            # imported on demand (optional feature)
+            from .sharedmem import SAIASharedMemoryExporter
+            self._sharedMemory=SAIASharedMemoryExporter(self, prefix, period, path, capacity)
+            self._sharedMemory.start()
+        return self._sharedMemory
+
+    @property
+    def sharedMemory(self):
+        return self._sharedMemory
+
+    def enableWorkers(self, count=None, port=None, setup=None, engine=None, prefix='saia', period=0.5, path=None, capacity=None):
+        """
+        Multi-process mode : start count worker processes (default to the number of cores), each
+        running its own node bound to port+n (port defaults to the node port+1). Servers declared
+        through the returned SAIAWorkerPool are partitioned across the workers, their memory being
+        exported to shared memory (see SAIASharedMemoryExporter). setup(node) is called in every worker
+        """
+        if self._workers is None:
+            # imported on demand (optional feature)
+            from .workers import SAIAWorkerPool
+            self._workers=SAIAWorkerPool(self, count, port, setup, engine, prefix, period, path, capacity)
+            self._workers.start()
+        return self._workers
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def getLogQueue(self):
+        """
+        Return the SAIALogQueue of the node logger (None if the logger is not a SAIALogger queue)
+        """
+        return SAIALogger.getQueue(self.logger)
+
+    @property
+    def tracer(self):
+        # shared by every node of the process
+        return SAIATRACER
+
     @property
     def memory(self):
         return self.server.memory
@@ -548,6 +673,7 @@ class SAIANode(object):
         return self.servers[key]
 
     def getInterfacesIpAddress(self):
+        import netifaces
         ip=[]
         for i in netifaces.interfaces():
             try:
@@ -596,6 +722,9 @@ class SAIANode(object):
 
     def open(self):
         if self._socket:
+            if self._io is None:
+                # socket provided by the caller
+                self._io=SAIADatagramIO(self._socket, logger=self.logger)
             return self._socket
 
         try:
@@ -605,11 +734,13 @@ class SAIANode(object):
                 s=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                self.setSocketBufferSizes(s)
                 self.logger.debug('Socket SO_RCVBUF size is %d bytes', s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
                 s.settimeout(3.0)
                 s.setblocking(False)
                 try:
                     s.bind(('', self._port))
+                    self._io=SAIADatagramIO(s, logger=self.logger)
                     self._socket=s
                     self.logger.info('UDP socket i/o opened (lid=%d).' % self._lid)
                     return self._socket
@@ -619,29 +750,85 @@ class SAIANode(object):
         except:
             self.logger.exception('open()')
 
+    def setSocketBufferSize(self, s, option, size):
+        if option=='rcvbuf':
+            (option, force, sysctl)=(socket.SO_RCVBUF, getattr(socket, 'SO_RCVBUFFORCE', 33), 'net.core.rmem_max')
+        else:
+            (option, force, sysctl)=(socket.SO_SNDBUF, getattr(socket, 'SO_SNDBUFFORCE', 32), 'net.core.wmem_max')
+        s.setsockopt(socket.SOL_SOCKET, option, size)
+        # Linux doubles the requested size (bookkeeping overhead) but bounds it to the sysctl max
+        if s.getsockopt(socket.SOL_SOCKET, option)<size and sys.platform.startswith('linux'):
+            try:
+                # ignoring the sysctl max requires CAP_NET_ADMIN
+                s.setsockopt(socket.SOL_SOCKET, force, size)
+            except:
+                pass
+        effective=s.getsockopt(socket.SOL_SOCKET, option)
+        if effective<size:
+            self.logger.warning('Socket buffer size limited to %d bytes (%d requested), see sysctl %s' % (effective, size, sysctl))
+        return effective
+
+    def setSocketBufferSizes(self, s=None, rcvbuf=None, sndbuf=None):
+        """
+        Set the SO_RCVBUF/SO_SNDBUF sizes (bytes) of the socket (default to the node socket). A larger
+        receive buffer avoids datagrams drops (and thus timeouts) during responses bursts. Sizes given
+        here are kept and applied when the node socket is (re)opened
+        """
+        if rcvbuf is not None:
+            self._rcvbuf=int(rcvbuf)
+        if sndbuf is not None:
+            self._sndbuf=int(sndbuf)
+        s=s or self._socket
+        if s is not None:
+            try:
+                if self._rcvbuf:
+                    self.setSocketBufferSize(s, 'rcvbuf', self._rcvbuf)
+                if self._sndbuf:
+                    self.setSocketBufferSize(s, 'sndbuf', self._sndbuf)
+            except:
+                self.logger.exception('setSocketBufferSizes()')
+
+    def stats(self):
+        """
+        Node socket statistics : batched i/o syscalls, effective buffer sizes and kernel counters
+        (receive queue, dropped datagrams) and the system wide udp counters (Linux)
+        """
+        stats={}
+        if self._io is not None:
+            stats['socket']=self._io.stats()
+        udp=readUdpCounters()
+        if udp is not None:
+            stats['udp']=udp
+        return stats
+
     def close(self):
         try:
             if self._socket:
                 self.logger.info('socket:close()')
+                # waits for a recv/send in progress in the engine thread before releasing the
+                # rings, and before the socket fd can be reused
+                self._io.close()
                 self._socket.close()
         except:
             pass
 
         self._socket=None
+        self._io=None
 
     def data2strhex(self, data):
         return ' '.join(hex(x) for x in data)
 
-    def sendMessageToHost(self, data, host, port=None):
+    def sendMessageToHost(self, data, host, port=None, request=None):
         try:
             s=self.open()
             if s:
                 if port is None:
                     port=self._port
-                size=s.sendto(data, (host, port))
+                # queued (batch) if sent during a manager pass
+                result=self._io.send(data, (host, port), request)
                 if self._debug:
                     self.logger.debug('-->%s:%d %s' % (host, port, self.data2strhex(data)))
-                if size==len(data):
+                if result:
                     return True
                 self.logger.error('sendMessageToHost(%s)' % host)
         except:
@@ -649,16 +836,9 @@ class SAIANode(object):
 
     def decodeMessage(self, data):
         try:
-            size=len(data)
-            if size>=11 and size<=255:
-                sizePayload=size-11
-                if sizePayload>0:
-                    (msize, mversion, mtype, msequence, tattribute,
-                        payload, mcrc)=struct.unpack('>LBBHB %ds H' % sizePayload, data)
-
-                    if mcrc==SAIASBusCRC(data[0:-2]):
-                        return (tattribute, msequence, payload)
-
+            message=decodeFrame(data)
+            if message is not None:
+                return message
             self.logger.error('bad size/crc')
         except:
             self.logger.exception('decodeMessage')
@@ -680,9 +860,47 @@ class SAIANode(object):
             return SAIAResponseNAK(self, mseq)
 
     def dispatchMessage(self):
+        return self.receiveMessages()>0
+
+    def receiveMessages(self):
+        """
+        Drain and process the received datagrams (one batch, see SAIADatagramIO).
+        Return the number of processed datagrams
+        """
+        s=self.open()
+        if not s:
+            return 0
+        try:
+            datagrams=self._io.recv()
+        except:
+            self.logger.exception('receiveMessages()')
+            return 0
+        for (data, address) in datagrams:
+            self.processMessage(data, address)
+        return len(datagrams)
+
+    def beginSendBatch(self):
+        """
+        Frames sent by the calling thread are queued until endSendBatch() (sendmmsg)
+        """
+        if self._io is not None:
+            self._io.collect()
+
+    def endSendBatch(self):
+        if self._io is not None:
+            self._io.flush()
+
+    def isBatchedIO(self):
+        if self._io is not None and self._io.isBatched():
+            return True
+        return False
+
+    @property
+    def io(self):
+        return self._io
+
+    def processMessage(self, data, address):
         try:
-            s=self.open()
-            (data, address)=s.recvfrom(4096)
             if data:
                 host=address[0]
                 port=address[1]
@@ -710,6 +928,8 @@ class SAIANode(object):
                             server.onMessage(mtype, mseq, payload)
                         except:
                             self.logger.exception('onMessage()')
+                        # the server will be managed at the next pass
+                        self.servers.signal(server)
                     else:
                         if not self.isIpAddressLocal(address[0]):
                             self.logger.warning('Message received from an undeclared server %s!' % address[0])
@@ -721,21 +941,48 @@ class SAIANode(object):
         except:
             pass
 
-    def manager(self):
+    def managerServers(self):
         activity=False
 
-        count=32
-        while count>0:
-            count-=1
-            if not self.dispatchMessage():
-                break
-            activity=True
-
         if self.servers.manager():
             activity=True
 
         self.server.manager()
 
+        if activity:
+            return True
+
+    def getNextDeadline(self):
+        """
+        Return the (absolute) time at which the next manager pass is required,
+        or None if nothing is scheduled (used by the asyncio engine)
+        """
+        deadlines=[d for d in (self.server.getNextDeadline(), self.servers.getNextDeadline()) if d is not None]
+        if deadlines:
+            return min(deadlines)
+
+    def wakeup(self):
+        """
+        Signal that some work is pending (item push/pull, transfer, ...)
+        """
+        try:
+            self._engine.wakeup()
+        except:
+            pass
+
+    def manager(self):
+        activity=False
+
+        self.beginSendBatch()
+        try:
+            if self.receiveMessages()>0:
+                activity=True
+
+            if self.managerServers():
+                activity=True
+        finally:
+            self.endSendBatch()
+
         # Small booster, allowing to be more reactive
         # during data burst, and more sleepy when idle
         try:
@@ -755,28 +1002,67 @@ class SAIANode(object):
     def refresh(self):
         self.servers.refresh()
 
+    def isAsyncEngine(self):
+        if self._engineType==SAIANode.ENGINE_ASYNCIO:
+            return True
+        return False
+
     def start(self):
+        if self._snapshot is not None:
+            # restarted node (the periodic save is stopped by stop())
+            self._snapshot.start()
+
+        if self.isAsyncEngine():
+            if not self._engine:
+                # imported on demand (asyncio is not needed by the default engine)
+                from .engine import SAIAAsyncEngine
+                self._engine=SAIAAsyncEngine(self)
+            self._engine.start()
+            return
+
         try:
             if self._jobs:
                 return
         except:
             pass
 
+        # imported on demand (not needed with the asyncio engine)
+        from digimat.jobs import JobManager
         self._jobs=JobManager(self.logger)
         self._jobSAIA=self._jobs.addJobFromFunction(self.manager)
         self._jobSAIA.setDaemon()
         self._jobs.start()
 
     def stop(self):
+        try:
+            if self._engine:
+                self._engine.stop()
+                self._engine=None
+                self.close()
+        except:
+            pass
+
         try:
             self._jobs.stop()
         except:
             pass
         self._jobSAIA=None
         self._jobs=None
+        self._metrics.stop()
+        self._dispatcher.stop()
+        if self._snapshot is not None:
+            self._snapshot.stop()
+        if self._sharedMemory is not None:
+            self._sharedMemory.stop()
+            self._sharedMemory=None
+        if self._workers is not None:
+            self._workers.stop()
+            self._workers=None
 
     def isRunning(self):
         try:
+            if self._engine:
+                return self._engine.isRunning()
             return self._jobSAIA.isRunning()
         except:
             pass
@@ -784,6 +1070,8 @@ class SAIANode(object):
 
     def sleep(self, delay=1.0):
         try:
+            if self._engine:
+                return self._engine.sleep(delay)
             self._jobSAIA.sleep(delay)
         except:
             self.logger.exception('sleep')
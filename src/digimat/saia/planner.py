@@ -0,0 +1,97 @@
+from __future__ import division
+
+
+class SAIAReadPlanner(object):
+    """
+    Compute a minimal set of block reads covering a set of due items
+
+    The items (of the same SAIAItems collection) are sorted by index and split in blocks
+    of at most READ_MAXCOUNT consecutive indexes. Between two due items, a block may
+    include some "holes" (indexes not due or not declared) that will be read for nothing.
+    The cost of a block is the cost of one more request (frame overhead + round trip,
+    expressed in bytes) plus the bytes spent reading the holes. A dynamic programming pass
+    gives the cheapest covering (O(n*READ_MAXCOUNT)).
+    """
+
+    # header+crc bytes of a request and its response
+    FRAME_OVERHEAD = 24
+
+    # cost of one more round trip, expressed in (equivalent) bytes
+    ROUNDTRIP_COST = 128
+
+    def __init__(self, items):
+        self._items=items
+        self._roundtripCost=self.ROUNDTRIP_COST
+
+    @property
+    def items(self):
+        return self._items
+
+    def setRoundtripCost(self, cost):
+        """
+        Cost (in bytes) of one more request round trip. Increasing this cost
+        allows more holes in each block (less but larger requests)
+        """
+        self._roundtripCost=max(0, cost)
+
+    def getMaxCount(self):
+        return self.items._itemType.READ_MAXCOUNT
+
+    def getValueSize(self):
+        return self.items._itemType.VALUE_SIZE
+
+    def getRequestCost(self):
+        return self.FRAME_OVERHEAD+self._roundtripCost
+
+    def plan(self, items):
+        """
+        Return a list of (item, count) blocks covering every given item,
+        item being the first (declared) item of the block
+        """
+        indexes={}
+        for item in items:
+            indexes[item.index]=item
+        if not indexes:
+            return []
+
+        index=sorted(indexes.keys())
+        n=len(index)
+        maxcount=self.getMaxCount()
+        valueSize=self.getValueSize()
+        requestCost=self.getRequestCost()
+
+        # cost[i] : min cost covering index[0..i-1], start[i] : first position of the last block
+        cost=[0]*(n+1)
+        start=[0]*(n+1)
+        for i in range(1, n+1):
+            last=index[i-1]
+            best=None
+            j=i-1
+            while j>=0:
+                size=last-index[j]+1
+                if size>maxcount:
+                    break
+                holes=size-(i-j)
+                c=cost[j]+requestCost+holes*valueSize
+                if best is None or c<best:
+                    best=c
+                    start[i]=j
+                j-=1
+            cost[i]=best
+
+        blocks=[]
+        i=n
+        while i>0:
+            j=start[i]
+            blocks.append((indexes[index[j]], index[i-1]-index[j]+1))
+            i=j
+        blocks.reverse()
+        return blocks
+
+    def __repr__(self):
+        return '<%s(maxcount=%d, requestCost=%d)>' % (self.__class__.__name__,
+            self.getMaxCount(), self.getRequestCost())
+
+
+if __name__ == "__main__":
+    pass
@@ -3,79 +3,15 @@ from __future__ import division
 
 import struct
 import time
-from functools import reduce
-from builtins import bytes
-
-from .ModbusDataLib import bin2boollist
-from .ModbusDataLib import boollist2bin
-
-# This is the precalculated hash table for CCITT V.41.
-SAIASBusCRCTable = [
-    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
-    0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef,
-    0x1231, 0x0210, 0x3273, 0x2252, 0x52b5, 0x4294, 0x72f7, 0x62d6,
-    0x9339, 0x8318, 0xb37b, 0xa35a, 0xd3bd, 0xc39c, 0xf3ff, 0xe3de,
-    0x2462, 0x3443, 0x0420, 0x1401, 0x64e6, 0x74c7, 0x44a4, 0x5485,
-    0xa56a, 0xb54b, 0x8528, 0x9509, 0xe5ee, 0xf5cf, 0xc5ac, 0xd58d,
-    0x3653, 0x2672, 0x1611, 0x0630, 0x76d7, 0x66f6, 0x5695, 0x46b4,
-    0xb75b, 0xa77a, 0x9719, 0x8738, 0xf7df, 0xe7fe, 0xd79d, 0xc7bc,
-    0x48c4, 0x58e5, 0x6886, 0x78a7, 0x0840, 0x1861, 0x2802, 0x3823,
-    0xc9cc, 0xd9ed, 0xe98e, 0xf9af, 0x8948, 0x9969, 0xa90a, 0xb92b,
-    0x5af5, 0x4ad4, 0x7ab7, 0x6a96, 0x1a71, 0x0a50, 0x3a33, 0x2a12,
-    0xdbfd, 0xcbdc, 0xfbbf, 0xeb9e, 0x9b79, 0x8b58, 0xbb3b, 0xab1a,
-    0x6ca6, 0x7c87, 0x4ce4, 0x5cc5, 0x2c22, 0x3c03, 0x0c60, 0x1c41,
-    0xedae, 0xfd8f, 0xcdec, 0xddcd, 0xad2a, 0xbd0b, 0x8d68, 0x9d49,
-    0x7e97, 0x6eb6, 0x5ed5, 0x4ef4, 0x3e13, 0x2e32, 0x1e51, 0x0e70,
-    0xff9f, 0xefbe, 0xdfdd, 0xcffc, 0xbf1b, 0xaf3a, 0x9f59, 0x8f78,
-    0x9188, 0x81a9, 0xb1ca, 0xa1eb, 0xd10c, 0xc12d, 0xf14e, 0xe16f,
-    0x1080, 0x00a1, 0x30c2, 0x20e3, 0x5004, 0x4025, 0x7046, 0x6067,
-    0x83b9, 0x9398, 0xa3fb, 0xb3da, 0xc33d, 0xd31c, 0xe37f, 0xf35e,
-    0x02b1, 0x1290, 0x22f3, 0x32d2, 0x4235, 0x5214, 0x6277, 0x7256,
-    0xb5ea, 0xa5cb, 0x95a8, 0x8589, 0xf56e, 0xe54f, 0xd52c, 0xc50d,
-    0x34e2, 0x24c3, 0x14a0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
-    0xa7db, 0xb7fa, 0x8799, 0x97b8, 0xe75f, 0xf77e, 0xc71d, 0xd73c,
-    0x26d3, 0x36f2, 0x0691, 0x16b0, 0x6657, 0x7676, 0x4615, 0x5634,
-    0xd94c, 0xc96d, 0xf90e, 0xe92f, 0x99c8, 0x89e9, 0xb98a, 0xa9ab,
-    0x5844, 0x4865, 0x7806, 0x6827, 0x18c0, 0x08e1, 0x3882, 0x28a3,
-    0xcb7d, 0xdb5c, 0xeb3f, 0xfb1e, 0x8bf9, 0x9bd8, 0xabbb, 0xbb9a,
-    0x4a75, 0x5a54, 0x6a37, 0x7a16, 0x0af1, 0x1ad0, 0x2ab3, 0x3a92,
-    0xfd2e, 0xed0f, 0xdd6c, 0xcd4d, 0xbdaa, 0xad8b, 0x9de8, 0x8dc9,
-    0x7c26, 0x6c07, 0x5c64, 0x4c45, 0x3ca2, 0x2c83, 0x1ce0, 0x0cc1,
-    0xef1f, 0xff3e, 0xcf5d, 0xdf7c, 0xaf9b, 0xbfba, 0x8fd9, 0x9ff8,
-    0x6e17, 0x7e36, 0x4e55, 0x5e74, 0x2e93, 0x3eb2, 0x0ed1, 0x1ef0
-]
-
-
-def SAIASBusCRC_old(data):
-    """Calculate a CCIT V.41 CRC hash function based on the polynomial
-        X^16 + X^12 + X^5 + 1 for SAIA S-Bus (initializer = 0x0000)
-    Parameters: inpdata (string) = The string to calculate the crc on.
-    Return: (integer) = The calculated CRC.
-    """
-    # This uses the built-in reduce rather than importing it from functools
-    # in order to provide compatiblity with Python 2.5. This may have to be
-    # changed in future for Python 3.x
-    crc=reduce(lambda crc, newchar:
-        SAIASBusCRCTable[((crc >> 8) ^ ord(newchar)) & 0xFF] ^ ((crc << 8) & 0xFFFF),
-           data, 0x0000)
-    return crc
-
-
-def SAIASBusCRC(data):
-    crc=0
-    # using bytes() for Python2/3 compatibility
-    for b in bytes(data):
-        crc=SAIASBusCRCTable[((crc >> 8) ^ b) & 0xFF] ^ ((crc << 8) & 0xFFFF)
-    return crc
-
-
-def SAIASBusCRCTableCheck():
-    """
-    Simple CRC table consistency check
-    """
-    if sum(SAIASBusCRCTable)==8388480:
-        return True
 
+from .bitpack import packBooleans
+from .bitpack import unpackBooleans
+
+from .codec import encodeRequest
+from .tracing import SAIATRACER
+from .futures import SAIARequestError
+from .futures import resolveFuture
+from .futures import failFuture
 
 class SAIARequest(object):
 
@@ -114,11 +50,14 @@ class SAIARequest(object):
 
     COMMAND_READ_PCD_STATUS_OWN = 0x1b
 
-    def __init__(self, link, retry=3, broadcast=False):
+    def __init__(self, link, retry=None, broadcast=False):
         assert link.__class__.__name__=='SAIALink'
         self._link=link
         self._broadcast=broadcast
+        if retry is None:
+            retry=link.getRetry()
         self._retry=retry
+        self._transmissions=0
         self._data=None
         self._dataReply=None
         self._command=0
@@ -128,8 +67,12 @@ class SAIARequest(object):
         self._done=False
         self._result=False
         self._sequence=0
+        self._timeout=0
+        self._delayTimeout=None
+        # tracing timestamps (initiated, transmitted)
+        self._traceStart=0
+        self._traceSent=0
         self.onInit()
-        SAIASBusCRCTableCheck()
 
     def onInit(self):
         pass
@@ -160,6 +103,15 @@ class SAIARequest(object):
     def initiate(self):
         return self.link.initiate(self)
 
+    def setRetry(self, retry):
+        self._retry=retry
+
+    def setTimeout(self, delay):
+        """
+        Override the link response timeout for this request
+        """
+        self._delayTimeout=delay
+
     def safeMakeArray(self, item):
         if type(item) in (list, tuple):
             return item
@@ -187,22 +139,7 @@ class SAIARequest(object):
         # [data]
         # crc
 
-        if payload:
-            sizePayload=len(payload)
-            fsize=13+sizePayload
-            frame=struct.pack('>L BBHB BB %ds' % sizePayload,
-                fsize,
-                0, 0, self._sequence, 0,
-                self.server.lid, self._command,
-                payload)
-        else:
-            fsize=13
-            frame=struct.pack('>L BBHB BB',
-                fsize,
-                0, 0, self._sequence, 0,
-                self.server.lid, self._command)
-
-        return struct.pack('>%ds H' % len(frame), frame, SAIASBusCRC(frame))
+        return encodeRequest(self._sequence, self.server.lid, self._command, payload)
 
     def encode(self):
         """
@@ -263,16 +200,22 @@ class SAIARequest(object):
     def consumeRetry(self):
         if self._retry>0:
             self._retry-=1
+            self._transmissions+=1
             self._stamp=time.time()
             return True
 
+    def onSent(self, stamp):
+        # frame queued in a send batch, effectively sent at stamp
+        self._stamp=stamp
+
     def validateMessage(self, sequence, payload=None):
         if self.isReady():
             if sequence==self._sequence:
                 return True
 
     def processResponse(self, payload):
-        self._dataReply=payload
+        # payload is a view on the received datagram
+        self._dataReply=bytes(payload)
         return True
 
     def onSuccess(self):
@@ -285,9 +228,14 @@ class SAIARequest(object):
         self._start=True
         self._done=False
         self._result=False
+        if SAIATRACER.enabled:
+            self._traceStart=SAIATRACER.now()
 
     def stop(self, success):
         self._done=True
+        if self._traceStart and SAIATRACER.enabled:
+            SAIATRACER.span(self.__class__.__name__, 'request', self.server.host, self._traceStart, None,
+                {'mseq': self._sequence, 'command': self._command, 'transmissions': self._transmissions, 'success': bool(success)})
         try:
             if success:
                 self.onSuccess()
@@ -409,9 +357,27 @@ class SAIARequestReadDBX(SAIARequest):
 class SAIARequestReadItems(SAIARequest):
     def setup(self, item, maxcount=1, holes=False):
         self._item=item
+        self._futures=None
         self._count=self.optimizePullCount(maxcount, holes)
+        if self.link.isPipelined():
+            self.clearCoveredItemsPull()
         self.ready()
 
+    def clearCoveredItemsPull(self):
+        """
+        Items covered by this request don't need their own request anymore
+        (avoid overlapping requests when the link is pipelined)
+        """
+        try:
+            items=self.items()
+            index0=self.item.index
+            for n in range(1, self._count):
+                item=items.item(index0+n)
+                if item:
+                    item.clearPull()
+        except:
+            pass
+
     @property
     def item(self):
         return self._item
@@ -471,10 +437,30 @@ class SAIARequestReadItems(SAIARequest):
             item=items.item(index0+n)
             if item:
                 item.setValue(values[n], force=True)
-                item.clearPull()
+                # a readAsync() issued while this request was in flight keeps its own pull
+                if not items._futuresRead or (index0+n) not in items._futuresRead:
+                    item.clearPull()
 
         return True
 
+    def start(self):
+        super(SAIARequestReadItems, self).start()
+        # pending readAsync() futures of the covered items are completed by this request
+        self._futures=self.items().popReadFutures(self.item.index, self._count)
+
+    def onSuccess(self):
+        if self._futures:
+            items=self.items()
+            for (index, future) in self._futures:
+                item=items.item(index)
+                resolveFuture(future, item.value if item else None)
+
+    def onFailure(self):
+        super(SAIARequestReadItems, self).onFailure()
+        if self._futures:
+            for (index, future) in self._futures:
+                failFuture(future, SAIARequestError('%s<--%s:ERROR' % (self.server.host, self.__class__.__name__)))
+
     def __repr__(self):
         return '%s(mseq=%d, index=%d, count=%d)' % (self.__class__.__name__,
             self.sequence, self.item.index, self._count)
@@ -502,7 +488,7 @@ class SAIARequestReadCounters(SAIARequestReadAnalogItems):
 
 class SAIARequestReadBooleanItems(SAIARequestReadItems):
     def extractValuesFromPayload(self, payload):
-        return bin2boollist(payload)
+        return unpackBooleans(payload)
 
 
 class SAIARequestReadFlags(SAIARequestReadBooleanItems):
@@ -524,16 +510,36 @@ class SAIARequestWriteItems(SAIARequest):
     def setup(self, item, maxcount=1):
         self._item=item
 
-        values=[item.pushValue]
-        while len(values)<maxcount:
-            item=item.next()
-            if not item or not item.isPendingPushRequest():
-                break
-            values.append(item.pushValue)
+        items=item.parent
+        with items._lock:
+            values=[item.pushValue]
+            # push generation of the carried values : a value pushed meanwhile must not be cleared
+            self._generations=[item._pushGeneration]
+            while len(values)<maxcount:
+                item=item.next()
+                if not item or not item.isPendingPushRequest():
+                    break
+                values.append(item.pushValue)
+                self._generations.append(item._pushGeneration)
+                if self.link.isPipelined():
+                    # don't let this item initiate an overlapping write
+                    item.clearPush()
+            # pending writeAsync() futures of the carried values
+            self._futures=items.popWriteFutures(self._item.index, len(values))
 
         self._values=self.safeMakeArray(values)
         self.ready()
 
+    def initiate(self):
+        if super(SAIARequestWriteItems, self).initiate():
+            return True
+        self.failFutures('not initiated')
+
+    def failFutures(self, reason='ERROR'):
+        if self._futures:
+            for future in self._futures:
+                failFuture(future, SAIARequestError('%s<--%s:%s' % (self.server.host, self.__class__.__name__, reason)))
+
     @property
     def item(self):
         return self._item
@@ -547,8 +553,12 @@ class SAIARequestWriteItems(SAIARequest):
             index0=self.item.index
             for n in range(len(self._values)):
                 item=items[index0+n]
-                item.clearPush()
                 if item:
+                    with items._lock:
+                        # a value pushed while this request was in flight keeps its own pending
+                        # write (and its writeAsync() futures, not taken over by this request)
+                        if item._pushGeneration==self._generations[n]:
+                            item.clearPush()
                     item.refresh(urgent=True)
         except:
             pass
@@ -556,15 +566,18 @@ class SAIARequestWriteItems(SAIARequest):
     def onSuccess(self):
         # after push (write oending value), we need a refresh to update the actual value
         self.refreshItems()
+        if self._futures:
+            for future in self._futures:
+                resolveFuture(future, True)
+
+    def onFailure(self):
+        super(SAIARequestWriteItems, self).onFailure()
+        self.failFutures()
 
 
 class SAIARequestWriteBooleanItems(SAIARequestWriteItems):
     def encode(self):
-        data=boollist2bin(self._values)
-
-        # TODO: not ideal, but fix the problem for python2->3 conversion
-        # as when need bytes instead of str
-        data=struct.pack('%dB' % len(data), *[ord(c) for c in data])
+        data=packBooleans(self._values)
 
         # bytecount = number item to write (as msg length + 2)
         bytecount=len(data)+2
@@ -2,9 +2,9 @@ from __future__ import print_function  # Python 2/3 compatibility
 
 import struct
 
-from .ModbusDataLib import boollist2bin
+from .bitpack import packBooleans
 
-from .request import SAIASBusCRC
+from .codec import encodeReply
 
 SAIA_CPU_TYPE = 'xxDIG'
 SAIA_FW_VERSION = '001'
@@ -60,15 +60,7 @@ class SAIAReply(object):
         # [data]
         # crc
 
-        sizePayload=len(payload)
-        fformat='>L BBHB %ds' % sizePayload
-        fsize=11+sizePayload
-        frame=struct.pack(fformat,
-            fsize,
-            0, 0, self._sequence, self._replyType,
-            payload)
-
-        return struct.pack('>%ds H' % len(frame), frame, SAIASBusCRC(frame))
+        return encodeReply(self._sequence, self._replyType, payload)
 
     def encode(self):
         """
@@ -170,13 +162,7 @@ class SAIAResponseReadBooleanItem(SAIAReply):
         for n in range(self._count):
             values.append(self._items[self._address+n].value)
 
-        data=boollist2bin(values)
-
-        # TODO: not ideal, but fix zthe problem for python2->3 conversion
-        # as when need bytes instead of str
-        data=struct.pack('%dB' % len(data), *[ord(c) for c in data])
-
-        return struct.pack('>%ds' % len(data), data)
+        return packBooleans(values)
 
 
 class SAIAResponseReadFlags(SAIAResponseReadBooleanItem):
@@ -0,0 +1,120 @@
+from __future__ import division
+
+import time
+
+
+class SAIARTTEstimator(object):
+    """
+    TCP like (RFC 6298) smoothed round trip time and retransmission timeout estimator
+
+    srtt and rttvar are updated from every response received for a request that was
+    transmitted only once (Karn's algorithm). The rto is bounded by [rtoMin, rtoMax]
+    and is doubled on each consecutive timeout (exponential backoff), until the next
+    valid sample is received. With a pipelined link, the timeouts of the requests in
+    flight expiring within the same rto interval (one loss burst) are a single backoff.
+
+    As in RFC 6298, the default minimum rto is 1s : a lower bound leads to spurious
+    retransmissions (i.e. duplicate writes) on a busy PCD. It can be lowered explicitly
+    (setBounds(), link.enableAdaptiveTimeout(rtoMin=...)) for fast and reliable LAN PCDs.
+    """
+
+    ALPHA = 1.0/8
+    BETA = 1.0/4
+    K = 4
+
+    RTO_INITIAL = 3.0
+    RTO_MIN = 1.0
+    RTO_MAX = 10.0
+
+    def __init__(self, rtoInitial=RTO_INITIAL, rtoMin=RTO_MIN, rtoMax=RTO_MAX):
+        self._rtoInitial=rtoInitial
+        self._rtoMin=rtoMin
+        self._rtoMax=rtoMax
+        self.reset()
+
+    def reset(self):
+        self._srtt=None
+        self._rttvar=None
+        self._rtt=None
+        self._backoff=0
+        self._timeoutBackoff=0
+        self._count=0
+        self._rto=self.bound(self._rtoInitial)
+
+    def setBounds(self, rtoMin=None, rtoMax=None):
+        if rtoMin is not None:
+            self._rtoMin=rtoMin
+        if rtoMax is not None:
+            self._rtoMax=rtoMax
+        self._rto=self.bound(self._rto)
+
+    def bound(self, rto):
+        return min(self._rtoMax, max(self._rtoMin, rto))
+
+    @property
+    def srtt(self):
+        return self._srtt
+
+    @property
+    def rttvar(self):
+        return self._rttvar
+
+    @property
+    def rtt(self):
+        """last measured round trip time"""
+        return self._rtt
+
+    @property
+    def rto(self):
+        return self._rto
+
+    @property
+    def backoff(self):
+        return self._backoff
+
+    def count(self):
+        return self._count
+
+    def sample(self, rtt):
+        """
+        Update the estimator with a measured round trip time (seconds)
+        """
+        if rtt is None or rtt<0:
+            return
+
+        self._rtt=rtt
+        self._count+=1
+        if self._srtt is None:
+            self._srtt=rtt
+            self._rttvar=rtt/2.0
+        else:
+            self._rttvar=(1-self.BETA)*self._rttvar+self.BETA*abs(self._srtt-rtt)
+            self._srtt=(1-self.ALPHA)*self._srtt+self.ALPHA*rtt
+
+        self._backoff=0
+        self._timeoutBackoff=0
+        self._rto=self.bound(self._srtt+self.K*self._rttvar)
+
+    def timeout(self):
+        """
+        Signal a retransmission timeout (exponential backoff, at most once per rto interval).
+        Return True if the rto was doubled
+        """
+        now=time.time()
+        if now<self._timeoutBackoff:
+            # same loss event (other request in flight)
+            return False
+        self._timeoutBackoff=now+self._rto
+        self._backoff+=1
+        self._rto=self.bound(self._rto*2)
+        return True
+
+    def __repr__(self):
+        if self._srtt is None:
+            return '<%s(rto=%.03fs, backoff=%d)>' % (self.__class__.__name__, self._rto, self._backoff)
+        return '<%s(srtt=%.03fs, rttvar=%.03fs, rto=%.03fs, backoff=%d)>' % (self.__class__.__name__,
+            self._srtt, self._rttvar, self._rto, self._backoff)
+
+
+if __name__ == "__main__":
+    pass
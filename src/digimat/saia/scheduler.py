@@ -0,0 +1,222 @@
+from __future__ import division
+
+import time
+import heapq
+
+from threading import Lock
+from collections import deque
+
+
+class SAIAItemScheduler(object):
+    """
+    Deadline (min-heap) scheduler shared by every items collection of a SAIAMemory
+
+    Each scheduled item has exactly one valid entry (deadline, seq, item) in the heap.
+    Re-arming an item simply pushes a new entry and records the new deadline on the
+    item (item._deadline). Older entries are detected as stale when popped and dropped
+    (lazy deletion), so each operation is O(log n) and a manager pass only costs the
+    number of due items, whatever the number of declared items.
+    """
+
+    def __init__(self, memory):
+        assert memory.__class__.__name__=='SAIAMemory'
+        self._memory=memory
+        self._lock=Lock()
+        self._heap=[]
+        self._seq=0
+        self._count=0
+
+    @property
+    def memory(self):
+        return self._memory
+
+    @property
+    def logger(self):
+        return self.memory.logger
+
+    def count(self):
+        """
+        Number of scheduled items
+        """
+        return self._count
+
+    def schedule(self, item, deadline):
+        """
+        (Re)arm the item to be managed at the given time (None to cancel)
+        """
+        with self._lock:
+            if deadline is None:
+                if item._deadline is not None:
+                    item._deadline=None
+                    self._count-=1
+                return
+
+            if item._deadline is None:
+                self._count+=1
+            item._deadline=deadline
+            self._seq+=1
+            entry=(deadline, self._seq, item)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                # new earliest deadline of the memory
+                self._memory.server.advanceDeadline(deadline)
+
+            # drop stale entries if the heap is growing too much
+            if len(self._heap)>2*self._count+256:
+                self._heap=[entry for entry in self._heap if entry[2]._deadline==entry[0]]
+                heapq.heapify(self._heap)
+
+    def cancel(self, item):
+        self.schedule(item, None)
+
+    def getNextDeadline(self):
+        with self._lock:
+            heap=self._heap
+            while heap:
+                (deadline, seq, item)=heap[0]
+                if item._deadline==deadline:
+                    return deadline
+                heapq.heappop(heap)
+
+    def popDueItems(self, maxcount=None, now=None):
+        """
+        Pop (unschedule) and return the items whose deadline is reached
+        """
+        if now is None:
+            now=time.time()
+
+        items=[]
+        with self._lock:
+            heap=self._heap
+            while heap and heap[0][0]<=now:
+                (deadline, seq, item)=heapq.heappop(heap)
+                if item._deadline!=deadline:
+                    # stale entry (item re-armed or canceled)
+                    continue
+                item._deadline=None
+                self._count-=1
+                items.append(item)
+                if maxcount is not None and len(items)>=maxcount:
+                    break
+        return items
+
+    def clear(self):
+        with self._lock:
+            for entry in self._heap:
+                entry[2]._deadline=None
+            self._heap=[]
+            self._count=0
+
+    def __repr__(self):
+        return '<%s(%d items, heap=%d)>' % (self.__class__.__name__, self._count, len(self._heap))
+
+
+class SAIAServerScheduler(object):
+    """
+    Ready-queue scheduler of the (remote) servers managers
+
+    A server is managed only when it is ready : signaled by one of its own events
+    (datagram received for its link, pending push/pull, submitted transfer, declaration)
+    or when its next deadline (link timeout, items refresh, status, ...) is reached.
+    Deadlines are kept in a min-heap with lazy deletion (see SAIAItemScheduler),
+    the ready servers in a FIFO (each server being queued once). A manager pass thus
+    only costs the number of servers having something to do.
+    """
+
+    def __init__(self, servers):
+        assert servers.__class__.__name__=='SAIAServers'
+        self._servers=servers
+        self._lock=Lock()
+        self._heap=[]
+        self._seq=0
+        self._ready=deque()
+
+    @property
+    def logger(self):
+        return self._servers.logger
+
+    def signal(self, server):
+        """
+        Mark the server as ready (thread safe)
+        """
+        with self._lock:
+            if not server._scheduleReady:
+                server._scheduleReady=True
+                self._ready.append(server)
+
+    def schedule(self, server, deadline):
+        """
+        (Re)arm the server to be managed at the given time (None to cancel)
+        """
+        with self._lock:
+            server._scheduleDeadline=deadline
+            if deadline is not None:
+                self._seq+=1
+                heapq.heappush(self._heap, (deadline, self._seq, server))
+                if len(self._heap)>2*len(self._servers.all())+256:
+                    self._heap=[entry for entry in self._heap if entry[2]._scheduleDeadline==entry[0]]
+                    heapq.heapify(self._heap)
+
+    def advance(self, server, deadline):
+        """
+        Bring the server deadline forward if the given deadline is earlier (thread safe)
+        """
+        current=server._scheduleDeadline
+        if current is None or deadline<current:
+            self.schedule(server, deadline)
+
+    def promoteDueServers(self, now=None):
+        """
+        Move the servers whose deadline is reached to the ready queue
+        """
+        if now is None:
+            now=time.time()
+        with self._lock:
+            heap=self._heap
+            while heap and heap[0][0]<=now:
+                (deadline, seq, server)=heapq.heappop(heap)
+                if server._scheduleDeadline!=deadline:
+                    continue
+                server._scheduleDeadline=None
+                if not server._scheduleReady:
+                    server._scheduleReady=True
+                    self._ready.append(server)
+
+    def popReadyServers(self, maxcount=None):
+        self.promoteDueServers()
+        servers=[]
+        with self._lock:
+            ready=self._ready
+            while ready:
+                server=ready.popleft()
+                server._scheduleReady=False
+                servers.append(server)
+                if maxcount is not None and len(servers)>=maxcount:
+                    break
+        return servers
+
+    def countReady(self):
+        self.promoteDueServers()
+        return len(self._ready)
+
+    def getNextDeadline(self):
+        with self._lock:
+            if self._ready:
+                return time.time()
+            heap=self._heap
+            while heap:
+                (deadline, seq, server)=heap[0]
+                if server._scheduleDeadline==deadline:
+                    return deadline
+                heapq.heappop(heap)
+
+    def signalAll(self):
+        for server in self._servers.all():
+            self.signal(server)
+
+    def __repr__(self):
+        return '<%s(%d ready, heap=%d)>' % (self.__class__.__name__, len(self._ready), len(self._heap))
+
+
+if __name__ == "__main__":
+    pass
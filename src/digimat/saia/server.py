@@ -2,7 +2,6 @@ from __future__ import print_function  # Python 2/3 compatibility
 
 import time
 import struct
-import ipaddress
 from datetime import datetime
 import re
 import unicodedata
@@ -21,8 +20,14 @@ from .transfer import SAIATransferReadDeviceInformation
 from .transfer import SAIATransferDiscoverNodes
 from .transfer import SAIATransferFromRequest
 
-from .request import SAIASBusCRC
+from .codec import decodeFrame
+
+from .rtt import SAIARTTEstimator
+from .metrics import SAIALinkMetrics
+from .tracing import SAIATRACER
 from .memory import SAIAMemory
+from .scheduler import SAIAServerScheduler
+from .breaker import SAIACircuitBreaker
 from .symbol import SAIASymbols
 
 from .items import SAIAItemGroup
@@ -36,7 +41,7 @@ class SAIALink(object):
     COMMSTATE_ERROR = 10
     COMMSTATE_SUCCESS = 11
 
-    def __init__(self, server, delayXmitInhibit=0):
+    def __init__(self, server, delayXmitInhibit=0, window=1):
         assert server.__class__.__name__=='SAIAServer'
         self._server=server
         self._request=None
@@ -44,11 +49,20 @@ class SAIALink(object):
         self._timeout=0
         self._timeoutXmitInhibit=0
         self._delayXmitInhibit=delayXmitInhibit
+        self._delayResponseTimeout=3.0
+        self._adaptiveTimeout=True
+        self._rtt=SAIARTTEstimator(rtoInitial=self._delayResponseTimeout)
         self._timeoutWatchdog=time.time()+60
         self._alive=False
-        self._retry=0
+        self._retry=3
         self._msgseq=0
         self._msgcount=0
+        # pipelined mode (window>1)
+        self._window=1
+        self._pending=[]
+        self._inflight={}
+        self._metrics=SAIALinkMetrics(self)
+        self.setWindow(window)
         self.reset()
 
     @property
@@ -75,6 +89,111 @@ class SAIALink(object):
     def setXmitInhibitDelay(self, delay):
         self._delayXmitInhibit=delay
 
+    def setResponseTimeout(self, delay):
+        """
+        Use a fixed response timeout (disable the adaptive rto)
+        """
+        self._delayResponseTimeout=delay
+        self._adaptiveTimeout=False
+
+    def enableAdaptiveTimeout(self, state=True, rtoMin=None, rtoMax=None):
+        """
+        Use the RTT based retransmission timeout (default), optionally bounded by rtoMin and rtoMax
+        """
+        self._adaptiveTimeout=bool(state)
+        self._rtt.setBounds(rtoMin, rtoMax)
+
+    def isAdaptiveTimeout(self):
+        if self._adaptiveTimeout:
+            return True
+        return False
+
+    def getResponseTimeout(self, request=None):
+        try:
+            if request._delayTimeout is not None:
+                return request._delayTimeout
+        except:
+            pass
+        if self._adaptiveTimeout:
+            return self._rtt.rto
+        return self._delayResponseTimeout
+
+    @property
+    def rtt(self):
+        return self._rtt
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def srtt(self):
+        """
+        smoothed round trip time (seconds, None until the first response)
+        """
+        return self._rtt.srtt
+
+    @property
+    def rto(self):
+        """
+        current retransmission (response) timeout
+        """
+        return self.getResponseTimeout()
+
+    def setRetry(self, retry):
+        """
+        Default number of transmissions for the requests initiated on this link
+        """
+        self._retry=max(1, int(retry))
+
+    def getRetry(self):
+        return self._retry
+
+    def onRequestTimeout(self, request):
+        self.logger.error('%s-->%s:timeout!' % (self.server.host, request.__class__.__name__))
+        self._rtt.timeout()
+        self._metrics.onRequestTimeout(request)
+        self.server.breaker.onTimeout()
+        if SAIATRACER.enabled:
+            SAIATRACER.instant('timeout', 'link', self.server.host, {'mseq': request._sequence})
+
+    def onRequestResponse(self, request):
+        # Karn's algorithm : retransmitted requests are ambiguous, don't sample them
+        if request._transmissions==1:
+            self._rtt.sample(time.time()-request._stamp)
+        self.server.breaker.onSuccess()
+
+    def onRequestFailure(self, request):
+        # retries exhausted
+        self._metrics.onRequestFailure(request)
+        self.server.breaker.onFailure()
+
+    def setWindow(self, size):
+        """
+        Set the max number of requests simultaneously in flight with the server.
+        size=1 is the historical one-request-at-a-time mode. With size>1 requests
+        are pipelined and responses are matched on the message sequence number
+        """
+        try:
+            size=max(1, int(size))
+            if size!=self._window:
+                if self._window==1 and not self.isIdle():
+                    # current request will be terminated by the legacy state machine
+                    self.logger.warning('%s:window changed while a request is pending' % self.server.host)
+                self._window=size
+                if self.isDebug():
+                    self.logger.debug('%s:link window set to %d' % (self.server.host, size))
+        except:
+            pass
+
+    def getWindow(self):
+        return self._window
+
+    def isPipelined(self):
+        if self._window>1:
+            return True
+        return False
+
     def checkAlive(self):
         if self.isAlive() and time.time()>=self._timeoutWatchdog:
             self._alive=False
@@ -98,7 +217,28 @@ class SAIALink(object):
         return False
 
     def isIdle(self):
-        if self._state==SAIALink.COMMSTATE_IDLE:
+        if self._state==SAIALink.COMMSTATE_IDLE and not self._pending and not self._inflight:
+            return True
+        return False
+
+    def countPendingRequests(self):
+        count=len(self._pending)+len(self._inflight)
+        if self._state!=SAIALink.COMMSTATE_IDLE:
+            count+=1
+        return count
+
+    def getAvailableSlots(self):
+        """
+        Return the number of requests that can be initiated right now
+        """
+        if self.isPipelined():
+            return max(0, self._window-self.countPendingRequests())
+        if self.isIdle():
+            return 1
+        return 0
+
+    def isAvailable(self):
+        if self.getAvailableSlots()>0:
             return True
         return False
 
@@ -118,10 +258,111 @@ class SAIALink(object):
     def isElapsed(self, age):
         return self.age()>=age
 
+    def getNextDeadline(self):
+        """
+        Return the time at which the link state machine has to be managed again
+        (None if the link is idle and nothing is expected)
+        """
+        if self._pending or self._inflight:
+            deadlines=[request._timeout for request in self._inflight.values()]
+            if self._pending:
+                deadlines.append(self._timeoutXmitInhibit)
+            return min(deadlines)
+
+        if self._state==SAIALink.COMMSTATE_IDLE:
+            if self.isAlive():
+                return self._timeoutWatchdog
+            return None
+        elif self._state==SAIALink.COMMSTATE_PENDINGREQUEST:
+            return self._timeoutXmitInhibit
+        elif self._state==SAIALink.COMMSTATE_WAITRESPONSE:
+            return self._timeout
+        elif self._state==SAIALink.COMMSTATE_ERROR:
+            return self._timeout+3.0
+        return time.time()
+
     def data2strhex(self, data):
         return ' '.join(x.encode('hex') for x in data)
 
+    def sendRequest(self, request):
+        data=request.data
+        host=self.server.host
+        port=self.server.port
+        if request._broadcast:
+            host=self.server.node.broadcastAddress
+
+        if self.isDebug():
+            self.logger.debug('%s<--%s' % (host, request))
+
+        if self.server.node.sendMessageToHost(data, host, port=port, request=request):
+            self._msgcount+=1
+            self._metrics.onRequestSent(request, len(data))
+            if SAIATRACER.enabled:
+                self.traceRequestSent(request)
+            self._timeoutXmitInhibit=time.time()+self._delayXmitInhibit
+            return True
+
+    def traceRequestSent(self, request):
+        if request._transmissions>1:
+            SAIATRACER.instant('retry', 'link', self.server.host, {'mseq': request._sequence})
+        else:
+            SAIATRACER.span('wait', 'link', self.server.host, request._traceStart)
+        request._traceSent=SAIATRACER.now()
+
+    def traceResponse(self, request):
+        SAIATRACER.span('rtt', 'link', self.server.host, request._traceSent, None, {'mseq': request._sequence})
+        return SAIATRACER.now()
+
+    def managerPipeline(self):
+        activity=False
+
+        if self._inflight:
+            now=time.time()
+            for request in list(self._inflight.values()):
+                if now>=request._timeout:
+                    del self._inflight[request.sequence]
+                    self.onRequestTimeout(request)
+                    # retransmit (if retry available)
+                    self._pending.append(request)
+
+        while self._pending:
+            if time.time()<self._timeoutXmitInhibit:
+                break
+
+            request=self._pending.pop(0)
+            if not request.consumeRetry():
+                self.onRequestFailure(request)
+                request.stop(False)
+                continue
+
+            if self.sendRequest(request):
+                activity=True
+                if request._broadcast:
+                    request.stop(True)
+                else:
+                    request._timeout=time.time()+self.getResponseTimeout(request)
+                    self._inflight[request.sequence]=request
+            else:
+                # socket error : the remaining requests are kept pending until the pause is over
+                self.onRequestFailure(request)
+                request.stop(False)
+                self.server.pause(15.0)
+                self._timeoutXmitInhibit=time.time()+15.0
+                break
+
+        if not self._pending and not self._inflight:
+            self.checkAlive()
+
+        return activity
+
     def manager(self):
+        if self._pending or self._inflight or (self.isPipelined() and self._state==SAIALink.COMMSTATE_IDLE):
+            try:
+                return self.managerPipeline()
+            except:
+                self.logger.exception('link.manager')
+                return
+
         try:
             if self._state==SAIALink.COMMSTATE_IDLE:
                 self.checkAlive()
@@ -132,33 +373,24 @@ class SAIALink(object):
                     return
 
                 if self._request.consumeRetry():
-                    data=self._request.data
-                    host=self.server.host
-                    port=self.server.port
-                    if self._request._broadcast:
-                        host=self.server.node.broadcastAddress
-
-                    if self.isDebug():
-                        self.logger.debug('%s<--%s' % (host, self._request))
-
-                    if self.server.node.sendMessageToHost(data, host, port=port):
-                        self._msgcount+=1
-                        self._timeoutXmitInhibit=time.time()+self._delayXmitInhibit
+                    if self.sendRequest(self._request):
                         if self._request._broadcast:
                             self.setState(SAIALink.COMMSTATE_SUCCESS)
                         else:
-                            self.setState(SAIALink.COMMSTATE_WAITRESPONSE, 3.0)
+                            self.setState(SAIALink.COMMSTATE_WAITRESPONSE, self.getResponseTimeout(self._request))
                         return True
                     else:
                         self.setState(SAIALink.COMMSTATE_ERROR)
                         self.server.pause(15.0)
+                else:
+                    self.onRequestFailure(self._request)
 
                 self.reset()
                 return
 
             elif self._state==SAIALink.COMMSTATE_WAITRESPONSE:
                 if self.isTimeout():
-                    self.logger.error('%s-->%s:timeout!' % (self.server.host, self._request.__class__.__name__))
+                    self.onRequestTimeout(self._request)
                     self.setState(SAIALink.COMMSTATE_PENDINGREQUEST)
                 return True
 
@@ -183,12 +415,15 @@ class SAIALink(object):
 
     def initiate(self, request):
         assert isinstance(request, SAIARequest)
-        if self.isIdle():
+        if self.isAvailable():
             try:
                 if request.isReady():
-                    self._request=request
-                    self._request.start()
-                    self.setState(SAIALink.COMMSTATE_PENDINGREQUEST)
+                    request.start()
+                    if self.isPipelined():
+                        self._pending.append(request)
+                    else:
+                        self._request=request
+                        self.setState(SAIALink.COMMSTATE_PENDINGREQUEST)
                     return True
             except:
                 self.logger.exception('%s: initiate request!' % (self.server.host))
@@ -201,15 +436,9 @@ class SAIALink(object):
 
     def decodeMessage(self, data):
         try:
-            size=len(data)
-            if size>=11 and size<=255:
-                sizePayload=size-11
-                if sizePayload>0:
-                    (msize, mversion, mtype, msequence, tattribute,
-                        payload, mcrc)=struct.unpack('>LBBHB %ds H' % sizePayload, data)
-                    if mcrc==SAIASBusCRC(data[0:-2]):
-                        return (tattribute, msequence, payload)
-
+            message=decodeFrame(data)
+            if message is not None:
+                return message
             self.logger.error('bad size/crc')
         except:
             self.logger.exception('decodeMessage')
@@ -218,6 +447,25 @@ class SAIALink(object):
         self._alive=True
         self._timeoutWatchdog=time.time()+20.0
 
+    def getWaitingRequest(self, mseq):
+        """
+        Return the request waiting for the response with the given sequence number
+        """
+        request=self._inflight.get(mseq)
+        if request is None and self.isWaitingResponse():
+            request=self._request
+        return request
+
+    def terminate(self, request, success):
+        if request is self._request:
+            self.reset(success)
+        else:
+            try:
+                del self._inflight[request.sequence]
+            except:
+                pass
+            request.stop(success)
+
     def onMessage(self, mtype, mseq, payload):
         try:
             if mtype==0:    # Request
@@ -225,25 +473,38 @@ class SAIALink(object):
                 pass
 
             elif mtype==1:  # Response
-                if self.isWaitingResponse():
-                    if self._request.validateMessage(mseq, payload):
+                request=self.getWaitingRequest(mseq)
+                if request:
+                    if request.validateMessage(mseq, payload):
                         try:
                             self.resetWatchdog()
+                            self.onRequestResponse(request)
+                            self._metrics.onRequestResponse(request, len(payload))
+                            stamp=0
+                            if SAIATRACER.enabled:
+                                stamp=self.traceResponse(request)
                             if self.isDebug():
-                                self.logger.debug('%s-->%s:processResponse(%d bytes)' % (self.server.host, self._request, len(payload)))
-                            result=self._request.processResponse(payload)
-                            self.reset(result)
+                                self.logger.debug('%s-->%s:processResponse(%d bytes)' % (self.server.host, request, len(payload)))
+                            result=request.processResponse(payload)
+                            if stamp:
+                                SAIATRACER.span('response', 'link', self.server.host, stamp, None, {'bytes': len(payload)})
+                            self.terminate(request, result)
                         except:
                             self.logger.exception('processResponse')
 
             elif mtype==2:  # Ack/Nak
-                if self.isWaitingResponse():
-                    if self._request.validateMessage(mseq):
+                request=self.getWaitingRequest(mseq)
+                if request:
+                    if request.validateMessage(mseq):
+                        self.onRequestResponse(request)
                         try:
                             # (code,)=struct.unpack('>B', payload[0])
                             data=struct.unpack('%dB' % len(payload), payload)
 
                             code=data[0]
+                            self._metrics.onRequestResponse(request, len(payload), code)
+                            if SAIATRACER.enabled:
+                                self.traceResponse(request)
                             # FIXME: meaning not clear yet (try to read an unexistant item,
                             # like register 40000 -> returns am ACK with code=0 and code2=1)
                             # code2=data[1]
@@ -252,20 +513,28 @@ class SAIALink(object):
                                 self.resetWatchdog()
                                 if self.isDebug():
                                     self.logger.debug('%s-->ACK(mseq=%d)' % (self.server.host, mseq))
-                                self.reset(True)
+                                self.terminate(request, True)
                             else:
                                 if self.isDebug():
                                     self.logger.error('%s-->NACK(mseq=%d, code=%d)' % (self.server.host, mseq, code))
-                                self.reset(False)
+                                self.terminate(request, False)
                         except:
                             self.logger.exception('processAck/Nak()')
-                            self.logger.warning(str(payload))
+                            self.logger.warning(str(bytes(payload)))
 
         except:
             self.logger.exception('onMessage')
 
     def __repr__(self):
-        return '<%s(state=%d, alive=%d, mseq=%d, mcount=%d)' % (self.__class__.__name__, self._state, bool(self.isAlive()), self._msgseq, self._msgcount)
+        srtt=self.srtt
+        if srtt is None:
+            srtt=0
+        if self.isPipelined():
+            return '<%s(state=%d, alive=%d, mseq=%d, mcount=%d, srtt=%.03fs, rto=%.03fs, window=%d, inflight=%d, pending=%d)' % (self.__class__.__name__,
+                self._state, bool(self.isAlive()), self._msgseq, self._msgcount, srtt, self.rto,
+                self._window, len(self._inflight), len(self._pending))
+        return '<%s(state=%d, alive=%d, mseq=%d, mcount=%d, srtt=%.03fs, rto=%.03fs)' % (self.__class__.__name__,
+            self._state, bool(self.isAlive()), self._msgseq, self._msgcount, srtt, self.rto)
 
 
 class SAIAServer(object):
@@ -274,6 +543,9 @@ class SAIAServer(object):
 
     def __init__(self, node, host, lid=None, localNodeMode=False, mapfile=None, port=UDP_DEFAULT_PORT):
         assert node.__class__.__name__=='SAIANode'
+        # servers scheduler state (see SAIAServerScheduler)
+        self._scheduleReady=False
+        self._scheduleDeadline=None
         self._lock=RLock()
         self._node=node
         self._status=0
@@ -284,6 +556,7 @@ class SAIAServer(object):
         self._lid=lid
         self._memory=SAIAMemory(self, localNodeMode)
         self._link=SAIALink(self)
+        self._breaker=SAIACircuitBreaker(self)
         self._deviceInfo={}
         self._transfers=SAIATransferQueue(self)
         self.setLid(lid)
@@ -394,6 +667,10 @@ class SAIAServer(object):
     def link(self):
         return self._link
 
+    @property
+    def breaker(self):
+        return self._breaker
+
     @property
     def inputs(self):
         return self.memory.inputs
@@ -455,6 +732,22 @@ class SAIAServer(object):
         if timeout>self._timeoutPause:
             self._timeoutPause=timeout
             self.logger.warning('server %s paused (%ds)' % (self, delay))
+            self.wakeup()
+
+    def wakeup(self):
+        """
+        Signal that the server has some work pending (the local server is managed at each node pass)
+        """
+        if not self.isLocalNodeMode():
+            self.node.servers.signal(self)
+        self.node.wakeup()
+
+    def advanceDeadline(self, deadline):
+        """
+        Notify an earlier deadline (i.e. an item rescheduled from another thread)
+        """
+        if not self.isLocalNodeMode():
+            self.node.servers.scheduler.advance(self, deadline)
 
     def enableNetworkScanner(self, state=True):
         if self.isLocalNodeMode():
@@ -510,6 +803,12 @@ class SAIAServer(object):
     def isAlive(self):
         return self.link.isAlive()
 
+    def setWindow(self, size):
+        """
+        Allow up to size requests to be simultaneously in flight with this server
+        """
+        self.link.setWindow(size)
+
     def isPendingPushRequest(self):
         return self.memory.isPendingPushRequest()
 
@@ -519,6 +818,33 @@ class SAIAServer(object):
     def refresh(self):
         self.memory.refresh()
 
+    def getNextDeadline(self):
+        """
+        Return the time at which the server manager has to be called again
+        """
+        deadlines=[self._link.getNextDeadline()]
+
+        if self.isLocalNodeMode():
+            deadlines.append(self._transfers.getNextDeadline())
+            deadlines.append(self._memory.getNextDeadline())
+            if self._networkScanner:
+                deadlines.append(self._timeoutNetworkScanner)
+        else:
+            if self._timeoutPause:
+                deadlines.append(self._timeoutPause)
+            elif self._breaker.isOpen():
+                deadlines.append(self._breaker.getNextDeadline())
+            elif self.isLidValid(self._lid):
+                deadlines.append(self._transfers.getNextDeadline())
+                deadlines.append(self._memory.getNextDeadline())
+                deadlines.append(self._timeoutStatus)
+            elif self.link.isIdle():
+                deadlines.append(time.time())
+
+        deadlines=[d for d in deadlines if d is not None]
+        if deadlines:
+            return min(deadlines)
+
     def manager(self):
         activity=False
         if self._link.manager():
@@ -543,6 +869,10 @@ class SAIAServer(object):
                 if time.time()>self._timeoutPause:
                     self._timeoutPause=0
                     self.logger.info('server %s resumed' % self)
+            elif self._breaker.isOpen():
+                # dead server : only (backoff) status probes
+                if self._breaker.manager():
+                    activity=True
             else:
                 if self.isLidValid(self._lid):
                     if self._transfers.manager():
@@ -597,6 +927,10 @@ class SAIAServer(object):
         transfer=SAIATransferFromRequest(SAIARequestReadPcdStatusOwn(self.link))
         return self.submitTransfer(transfer)
 
+    def refreshStationNumber(self):
+        transfer=SAIATransferFromRequest(SAIARequestReadStationNumber(self.link))
+        return self.submitTransfer(transfer)
+
     def ping(self):
         self.refreshStatus()
         return self.isAlive()
@@ -609,13 +943,21 @@ class SAIAServer(object):
 
 
 class SAIAServers(object):
+
+    # max servers managed per manager() call
+    MANAGER_MAXCOUNT = 64
+    # every server is managed at least once per period
+    SWEEP_PERIOD = 5.0
+
     def __init__(self, node):
         assert node.__class__.__name__=='SAIANode'
         self._node=node
         self._servers=[]
         self._indexByLid={}
         self._indexByHost={}
-        self._currentServer=0
+        self._scheduler=SAIAServerScheduler(self)
+        self._timeoutSweep=0
+        self._breakerListeners=[]
 
     @property
     def node(self):
@@ -625,6 +967,32 @@ class SAIAServers(object):
     def logger(self):
         return self.node.logger
 
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def signal(self, server):
+        self._scheduler.signal(server)
+
+    def addBreakerListener(self, callback):
+        """
+        callback(server, state, previous) called on every server circuit breaker state change
+        """
+        if callback not in self._breakerListeners:
+            self._breakerListeners.append(callback)
+
+    def removeBreakerListener(self, callback):
+        try:
+            self._breakerListeners.remove(callback)
+        except ValueError:
+            pass
+
+    def suspended(self):
+        """
+        Servers whose circuit breaker is open (or half open)
+        """
+        return [server for server in self.all() if server.breaker.isOpen()]
+
     def getFromHost(self, host):
         try:
             return self._indexByHost[host]
@@ -669,18 +1037,25 @@ class SAIAServers(object):
     def __iter__(self):
         return iter(self.all())
 
-    def declare(self, host, lid=None, port=SAIAServer.UDP_DEFAULT_PORT, mapfile=None):
+    def declare(self, host, lid=None, port=SAIAServer.UDP_DEFAULT_PORT, mapfile=None, window=None, compact=False):
         server=self.getFromHost(host)
         if server is None and not self.node.isIpAddressLocal(host):
             server=SAIAServer(self.node, host, lid, port=port, mapfile=mapfile)
+            if window is not None:
+                server.setWindow(window)
+            if compact:
+                # before any item declaration
+                server.memory.setCompactStorage()
             self._servers.append(server)
             self._indexByHost[host]=server
             self.logger.info('server(%s:%d:%s) declared' % (host, port, lid))
+            server.wakeup()
         return server
 
     def declareRange(self, ip, count, lid=None, port=SAIAServer.UDP_DEFAULT_PORT):
         servers=[]
         try:
+            import ipaddress
             ip=ipaddress.ip_address(ip)
             for n in range(count):
                 server=self.declare(str(ip), lid=lid, port=port)
@@ -692,25 +1067,46 @@ class SAIAServers(object):
             self.logger.exception('declareRange')
         return servers
 
-    def manager(self):
+    def getNextDeadline(self):
+        if self._servers:
+            deadline=self._scheduler.getNextDeadline()
+            if deadline is None:
+                return self._timeoutSweep
+            return min(deadline, self._timeoutSweep)
+
+    def countReady(self):
+        return self._scheduler.countReady()
+
+    def manager(self, count=None):
+        """
+        Manage (at most count) ready servers, i.e. signaled or whose deadline is reached
+        """
         activity=False
 
         if self._servers:
-            count=min(8, len(self._servers))
-            while count>0:
-                count-=1
+            now=time.time()
+            if now>=self._timeoutSweep:
+                # safety net, in case an event or a deadline is missed somewhere
+                self._timeoutSweep=now+self.SWEEP_PERIOD
+                self._scheduler.signalAll()
+
+            if count is None:
+                count=self.MANAGER_MAXCOUNT
+
+            for server in self._scheduler.popReadyServers(count):
+                try:
+                    if server.manager():
+                        activity=True
+                except:
+                    self.logger.exception('manager')
+
+                # re-armed at its next deadline (now if more work is already due)
                 try:
-                    server=self._servers[self._currentServer]
-                    self._currentServer+=1
-
-                    try:
-                        if server.manager():
-                            activity=True
-                    except:
-                        self.logger.exception('manager')
+                    deadline=server.getNextDeadline()
                 except:
-                    self._currentServer=0
-                    break
+                    self.logger.exception('getNextDeadline')
+                    deadline=time.time()+1.0
+                self._scheduler.schedule(server, deadline)
 
         if activity:
             return True
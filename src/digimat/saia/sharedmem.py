@@ -0,0 +1,416 @@
+"""
+Shared memory export of the servers process image
+
+Each exported server memory is a segment (multiprocessing.shared_memory, or a mmap'ed
+file if a path is given) readable by other processes without any IPC round trip.
+
+Segment layout (little endian)
+------------------------------
+header     magic 'SAIA' (4), version (2), collections count (2), sequence (8), stamp (8),
+           lid (2), reserved (6), host (64)
+directory  one entry per collection : name (12), capacity (4), values offset (4),
+           stamps offset (4), value typecode (4)
+data       per collection : values array (int64 'q' or uint8 'B') and stamps array (float64)
+
+The sequence is a seqlock : odd while the exporter is writing, incremented again when
+done. The stamp and the lid (255 until the station number is known) are updated by every
+synchronization. Readers retry until they get the same even sequence before and after copying.
+Item value and stamp are 0 for undeclared (or never read) items.
+"""
+from __future__ import division
+
+import os
+import time
+import mmap
+import struct
+import threading
+from array import array
+
+SHM_MAGIC = b'SAIA'
+SHM_VERSION = 1
+
+SHM_HEADER = struct.Struct('<4sHHQdH6x64s')
+SHM_DIRECTORY = struct.Struct('<12sIIII')
+SHM_SEQUENCE = struct.Struct('<Q')
+SHM_SEQUENCE_OFFSET = 8
+SHM_STAMP = struct.Struct('<d')
+SHM_STAMP_OFFSET = 16
+SHM_LID = struct.Struct('<H')
+SHM_LID_OFFSET = 24
+
+# collection name, default capacity (PCD address ranges), boolean
+SHM_COLLECTIONS = (('inputs', 8192, True),
+    ('outputs', 8192, True),
+    ('flags', 16384, True),
+    ('registers', 16384, False),
+    ('timers', 2048, False),
+    ('counters', 2048, False))
+
+
+def segmentName(host, prefix='saia'):
+    """
+    Shared memory segment name of the given server host
+    """
+    return '%s_%s' % (prefix, str(host).replace('.', '_').replace(':', '_'))
+
+
+class SAIASharedSegment(object):
+    """
+    Shared memory (or mmap'ed file) buffer
+    """
+
+    def __init__(self, name, size=0, create=False, path=None, untrack=True):
+        self._name=name
+        self._shm=None
+        self._mmap=None
+        self._file=None
+        self._owner=create
+        if path:
+            fpath=os.path.join(os.path.expanduser(path), name)
+            if create:
+                with open(fpath, 'wb') as f:
+                    f.truncate(size)
+            self._file=open(fpath, 'r+b')
+            self._mmap=mmap.mmap(self._file.fileno(), 0)
+            self._buf=memoryview(self._mmap)
+        else:
+            from multiprocessing import shared_memory
+            if create:
+                try:
+                    # stale segment from a previous run
+                    shm=shared_memory.SharedMemory(name=name)
+                    shm.close()
+                    shm.unlink()
+                except:
+                    pass
+                self._shm=shared_memory.SharedMemory(name=name, create=True, size=size)
+            else:
+                self._shm=shared_memory.SharedMemory(name=name)
+                if untrack:
+                    try:
+                        # readers must not unlink the segment at exit (resource tracker)
+                        from multiprocessing import resource_tracker
+                        resource_tracker.unregister(self._shm._name, 'shared_memory')
+                    except:
+                        pass
+            self._buf=self._shm.buf
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def buf(self):
+        return self._buf
+
+    def close(self, unlink=False):
+        self._buf=None
+        try:
+            if self._shm is not None:
+                self._shm.close()
+                if unlink:
+                    self._shm.unlink()
+            if self._mmap is not None:
+                self._mmap.close()
+                self._file.close()
+                if unlink:
+                    os.remove(self._file.name)
+        except:
+            pass
+        self._shm=None
+        self._mmap=None
+
+
+class SAIASharedMemoryExport(object):
+    """
+    Export (writer side) of one SAIAMemory in a shared segment
+    """
+
+    def __init__(self, memory, prefix='saia', path=None, capacity=None):
+        assert memory.__class__.__name__=='SAIAMemory'
+        self._memory=memory
+        self._layout=[]
+        capacity=capacity or {}
+
+        offset=SHM_HEADER.size+SHM_DIRECTORY.size*len(SHM_COLLECTIONS)
+        for (name, size, boolean) in SHM_COLLECTIONS:
+            size=int(capacity.get(name, size))
+            typecode='B' if boolean else 'q'
+            itemsize=array(typecode).itemsize
+            offsetValues=offset
+            offset+=size*itemsize
+            # align stamps (float64)
+            offset=(offset+7) & ~7
+            offsetStamps=offset
+            offset+=size*8
+            self._layout.append((name, size, typecode, offsetValues, offsetStamps))
+
+        server=memory.server
+        self._segment=SAIASharedSegment(segmentName(server.host, prefix), offset, True, path)
+        self._sequence=0
+        self._count=0
+        self.writeHeader()
+
+    @property
+    def memory(self):
+        return self._memory
+
+    @property
+    def name(self):
+        return self._segment.name
+
+    def writeHeader(self):
+        buf=self._segment.buf
+        server=self._memory.server
+        SHM_HEADER.pack_into(buf, 0, SHM_MAGIC, SHM_VERSION, len(self._layout),
+            self._sequence, 0.0, server.lid, str(server.host).encode('utf-8')[:64])
+        offset=SHM_HEADER.size
+        for (name, size, typecode, offsetValues, offsetStamps) in self._layout:
+            SHM_DIRECTORY.pack_into(buf, offset, name.encode(), size, offsetValues, offsetStamps, ord(typecode))
+            offset+=SHM_DIRECTORY.size
+
+    def setSequence(self, sequence):
+        self._sequence=sequence
+        SHM_SEQUENCE.pack_into(self._segment.buf, SHM_SEQUENCE_OFFSET, sequence)
+
+    def writeItems(self, items, size, typecode, offsetValues, offsetStamps):
+        buf=self._segment.buf
+        store=items._store
+        if store is not None:
+            # compact storage : columns are copied as a whole (same typecodes)
+            count=min(size, store.size())
+            itemsize=array(typecode).itemsize
+            buf[offsetValues:offsetValues+count*itemsize]=memoryview(store._values).cast('B')[:count*itemsize]
+            buf[offsetStamps:offsetStamps+count*8]=memoryview(store._stamps).cast('B')[:count*8]
+            return count
+
+        values=memoryview(buf)[offsetValues:offsetValues+size*array(typecode).itemsize].cast(typecode)
+        stamps=memoryview(buf)[offsetStamps:offsetStamps+size*8].cast('d')
+        count=0
+        try:
+            for item in items.all():
+                index=item.index
+                if index<size:
+                    values[index]=int(item._value or 0)
+                    stamps[index]=item._stamp
+                    count+=1
+        finally:
+            values.release()
+            stamps.release()
+        return count
+
+    def sync(self):
+        """
+        Copy the memory image to the segment (seqlock protected)
+        """
+        memory=self._memory
+        count=0
+        self.setSequence(self._sequence+1)
+        try:
+            for (name, size, typecode, offsetValues, offsetStamps) in self._layout:
+                items=getattr(memory, name)
+                if items.count()>0:
+                    with items._lock:
+                        count+=self.writeItems(items, size, typecode, offsetValues, offsetStamps)
+            SHM_LID.pack_into(self._segment.buf, SHM_LID_OFFSET, memory.server.lid)
+            SHM_STAMP.pack_into(self._segment.buf, SHM_STAMP_OFFSET, time.time())
+        finally:
+            self.setSequence(self._sequence+1)
+        self._count=count
+        return count
+
+    def close(self):
+        self._segment.close(unlink=True)
+
+    def __repr__(self):
+        return '<%s(%s, %d items, seq=%d)>' % (self.__class__.__name__, self.name, self._count, self._sequence)
+
+
+class SAIASharedMemoryExporter(object):
+    """
+    Node side manager : exports the local memory and every declared server, synchronized
+    every period seconds by a background thread
+    """
+
+    def __init__(self, node, prefix='saia', period=0.5, path=None, capacity=None):
+        assert node.__class__.__name__=='SAIANode'
+        self._node=node
+        self._prefix=prefix
+        self._period=period
+        self._path=path
+        self._capacity=capacity
+        self._exports={}
+        self._thread=None
+        self._eventStop=threading.Event()
+
+    @property
+    def logger(self):
+        return self._node.logger
+
+    def memories(self):
+        memories=[self._node.memory]
+        for server in self._node.servers.all():
+            memories.append(server.memory)
+        return memories
+
+    def export(self, memory):
+        export=self._exports.get(id(memory))
+        if export is None:
+            export=SAIASharedMemoryExport(memory, self._prefix, self._path, self._capacity)
+            self._exports[id(memory)]=export
+            self.logger.info('memory of server %s exported to shared segment [%s]' % (memory.server.host, export.name))
+        return export
+
+    def exports(self):
+        return list(self._exports.values())
+
+    def sync(self):
+        count=0
+        for memory in self.memories():
+            try:
+                count+=self.export(memory).sync()
+            except:
+                self.logger.exception('sharedmem:sync(%s)' % memory.server.host)
+        return count
+
+    def run(self):
+        while not self._eventStop.wait(self._period):
+            self.sync()
+
+    def start(self):
+        if self._thread is None:
+            self.sync()
+            self._eventStop.clear()
+            self._thread=threading.Thread(target=self.run, name='SAIASharedMemory')
+            self._thread.daemon=True
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._eventStop.set()
+            self._thread.join()
+            self._thread=None
+        for export in self.exports():
+            export.close()
+        self._exports={}
+
+    def __repr__(self):
+        return '<%s(%d segments, period=%.01fs)>' % (self.__class__.__name__, len(self._exports), self._period)
+
+
+class SAIASharedMemoryReader(object):
+    """
+    Reader side (any process) of an exported server memory
+
+    >>> reader=SAIASharedMemoryReader('192.168.0.48')
+    >>> reader.register(100)
+    (2150, 1712345678.12)
+    >>> reader.read('registers', 0, 16)
+    [...]
+    """
+
+    RETRY = 1000
+
+    def __init__(self, host, prefix='saia', path=None, untrack=True):
+        # untrack must be False if the exporter is a child process (multiprocessing) sharing
+        # the resource tracker of this process
+        self._segment=SAIASharedSegment(segmentName(host, prefix), path=path, untrack=untrack)
+        buf=self._segment.buf
+        (magic, version, count, sequence, stamp, lid, host)=SHM_HEADER.unpack_from(buf, 0)
+        if magic!=SHM_MAGIC or version!=SHM_VERSION:
+            self._segment.close()
+            raise ValueError('invalid SAIA shared segment %s' % self._segment.name)
+        self._host=host.rstrip(b'\x00').decode('utf-8')
+        self._layout={}
+        offset=SHM_HEADER.size
+        for n in range(count):
+            (name, size, offsetValues, offsetStamps, typecode)=SHM_DIRECTORY.unpack_from(buf, offset)
+            self._layout[name.rstrip(b'\x00').decode()]=(size, chr(typecode), offsetValues, offsetStamps)
+            offset+=SHM_DIRECTORY.size
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def lid(self):
+        return SHM_LID.unpack_from(self._segment.buf, SHM_LID_OFFSET)[0]
+
+    def sequence(self):
+        return SHM_SEQUENCE.unpack_from(self._segment.buf, SHM_SEQUENCE_OFFSET)[0]
+
+    @property
+    def stamp(self):
+        """
+        Time of the last exporter synchronization
+        """
+        return SHM_STAMP.unpack_from(self._segment.buf, SHM_STAMP_OFFSET)[0]
+
+    def views(self, name):
+        """
+        Return (values, stamps) memoryviews on the segment (zero copy, not consistent).
+        They must be released before closing the reader
+        """
+        (size, typecode, offsetValues, offsetStamps)=self._layout[name]
+        buf=self._segment.buf
+        itemsize=array(typecode).itemsize
+        return (buf[offsetValues:offsetValues+size*itemsize].cast(typecode),
+            buf[offsetStamps:offsetStamps+size*8].cast('d'))
+
+    def read(self, name, index=0, count=1):
+        """
+        Return a consistent copy (seqlock) of the (value, stamp) of count items from index
+        """
+        (size, typecode, offsetValues, offsetStamps)=self._layout[name]
+        count=max(0, min(count, size-index))
+        buf=self._segment.buf
+        itemsize=array(typecode).itemsize
+        for n in range(self.RETRY):
+            sequence=self.sequence()
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            values=array(typecode, bytes(buf[offsetValues+index*itemsize:offsetValues+(index+count)*itemsize]))
+            stamps=array('d', bytes(buf[offsetStamps+index*8:offsetStamps+(index+count)*8]))
+            if self.sequence()==sequence:
+                if typecode=='B':
+                    values=[bool(value) for value in values]
+                return list(zip(values, stamps))
+        raise RuntimeError('shared segment %s : unable to get a consistent read' % self._segment.name)
+
+    def value(self, name, index):
+        return self.read(name, index, 1)[0]
+
+    def input(self, index):
+        return self.value('inputs', index)
+
+    def output(self, index):
+        return self.value('outputs', index)
+
+    def flag(self, index):
+        return self.value('flags', index)
+
+    def register(self, index):
+        return self.value('registers', index)
+
+    def timer(self, index):
+        return self.value('timers', index)
+
+    def counter(self, index):
+        return self.value('counters', index)
+
+    def close(self):
+        self._segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<%s(host=%s, lid=%d, seq=%d)>' % (self.__class__.__name__, self._host, self.lid, self.sequence())
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,2 @@
+from .farm import SAIASimulatorFarm
+from .station import SAIASimulatedStation
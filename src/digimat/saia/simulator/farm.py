@@ -0,0 +1,244 @@
+from __future__ import division
+
+import socket
+import ipaddress
+import threading
+import asyncio
+
+from ..node import SAIALogger
+from ..server import SAIAServer
+
+from .station import SAIASimulatedStation
+
+
+class SAIASimulatorProtocol(asyncio.DatagramProtocol):
+    def __init__(self, farm, station):
+        self._farm=farm
+        self._station=station
+        self._transport=None
+
+    def connection_made(self, transport):
+        self._transport=transport
+
+    def datagram_received(self, data, address):
+        self._farm.onDatagram(self._station, self._transport, data, address)
+
+    def error_received(self, exc):
+        self._farm.logger.error('%s:%s' % (self._station, str(exc)))
+
+
+class SAIASimulatorFarm(object):
+    """
+    Farm of virtual EtherSBus stations running on loopback addresses in one process
+
+    Each station gets its own address (127.0.1.1, 127.0.1.2, ...) on the same udp port,
+    as SAIAServers identifies servers by host. On Linux, the whole 127.0.0.0/8 network
+    is routed on the loopback interface (other systems may need loopback aliases).
+    Every station socket is served by a single asyncio loop running in a dedicated
+    thread. Replies can be delayed (latency + random jitter) or lost (probability).
+
+    >>> farm=SAIASimulatorFarm(500, latency=0.005, jitter=0.002, loss=0.001)
+    >>> farm.start()
+    >>> farm[0].registers[10].value=1234
+    >>> servers=farm.declareServers(node)
+    """
+
+    DEFAULT_ADDRESS = '127.0.1.1'
+
+    def __init__(self, count=1, address=DEFAULT_ADDRESS, port=SAIAServer.UDP_DEFAULT_PORT, lid=None,
+            latency=0.0, jitter=0.0, loss=0.0, compact=True, setup=None, logger=None):
+        if logger is None:
+            # quiet by default (i.e. NAK replies are logged as errors by the stations)
+            logger=SAIALogger('SAIASIM').null()
+            logger.propagate=False
+        self._logger=logger
+        self._port=int(port)
+        self._latency=latency
+        self._jitter=jitter
+        self._loss=loss
+        self._stations=[]
+        self._indexHost={}
+        self._loop=None
+        self._thread=None
+        self._eventStart=threading.Event()
+        self._eventStop=None
+        self._transports=[]
+
+        address=ipaddress.IPv4Address(address)
+        while len(self._stations)<count:
+            # skip .0 and .255 host addresses
+            if int(address) & 0xFF not in (0, 255):
+                n=len(self._stations)
+                stationLid=lid
+                if stationLid is None:
+                    stationLid=(n % 253)+1
+                self.addStation(str(address), stationLid, compact)
+            address+=1
+
+        if setup is not None:
+            for station in self._stations:
+                setup(station)
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def port(self):
+        return self._port
+
+    def addStation(self, host, lid, compact=True):
+        station=SAIASimulatedStation(self, host, lid, self._port, compact)
+        self._stations.append(station)
+        self._indexHost[host]=station
+        return station
+
+    def stations(self):
+        return self._stations
+
+    def count(self):
+        return len(self._stations)
+
+    def hosts(self):
+        return [station.host for station in self._stations]
+
+    def station(self, key):
+        try:
+            return self._stations[key]
+        except:
+            pass
+        try:
+            return self._indexHost[key]
+        except:
+            pass
+
+    def __getitem__(self, key):
+        return self.station(key)
+
+    def __iter__(self):
+        return iter(self._stations)
+
+    def setFaults(self, latency=None, jitter=None, loss=None):
+        """
+        Default faults of every station. latency and jitter in seconds, loss as a probability (0..1)
+        """
+        if latency is not None:
+            self._latency=latency
+        if jitter is not None:
+            self._jitter=jitter
+        if loss is not None:
+            self._loss=loss
+
+    def declareServers(self, node, **kwargs):
+        """
+        Declare every station as a server of the given (client) node
+        """
+        servers=[]
+        for station in self._stations:
+            server=node.servers.declare(station.host, lid=station.lid, port=self._port, **kwargs)
+            servers.append(server)
+        return servers
+
+    def onDatagram(self, station, transport, data, address):
+        reply=station.processRequest(data)
+        if reply is not None:
+            delay=station.computeReplyDelay()
+            if delay is None:
+                station.onDrop()
+            elif delay>0:
+                self._loop.call_later(delay, self.sendReply, transport, reply, address)
+            else:
+                self.sendReply(transport, reply, address)
+
+    def sendReply(self, transport, data, address):
+        try:
+            transport.sendto(data, address)
+        except:
+            self.logger.exception('sendReply()')
+
+    async def openTransports(self):
+        for station in self._stations:
+            try:
+                s=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                s.setblocking(False)
+                s.bind((station.host, self._port))
+                (transport, protocol)=await self._loop.create_datagram_endpoint(
+                    lambda station=station: SAIASimulatorProtocol(self, station), sock=s)
+                self._transports.append(transport)
+            except:
+                self.logger.exception('%s:open()' % station)
+
+    def closeTransports(self):
+        for transport in self._transports:
+            try:
+                transport.close()
+            except:
+                pass
+        self._transports=[]
+
+    async def main(self):
+        self._eventStop=asyncio.Event()
+        await self.openTransports()
+        self._eventStart.set()
+        await self._eventStop.wait()
+        self.closeTransports()
+
+    def run(self):
+        self._loop=asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self.main())
+        except:
+            self.logger.exception('simulator:run()')
+        finally:
+            self._loop.close()
+            self._loop=None
+            self._eventStart.set()
+
+    def start(self):
+        if self._thread is None:
+            self._eventStart.clear()
+            self._thread=threading.Thread(target=self.run, name='SAIASimulatorFarm')
+            self._thread.daemon=True
+            self._thread.start()
+            self._eventStart.wait()
+
+    def stop(self):
+        if self._thread is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._eventStop.set)
+            except:
+                pass
+            self._thread.join()
+            self._thread=None
+
+    def isRunning(self):
+        if self._thread is not None and self._loop is not None:
+            return True
+        return False
+
+    def stats(self):
+        """
+        Cumulated counters of every station
+        """
+        result={'stations': self.count(), 'sockets': len(self._transports)}
+        for station in self._stations:
+            for key, value in station.stats().items():
+                result[key]=result.get(key, 0)+value
+        return result
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __repr__(self):
+        return '<%s(%d stations, port=%d, latency=%.03fs, jitter=%.03fs, loss=%.03f, running=%d)>' % (self.__class__.__name__,
+            self.count(), self._port, self._latency, self._jitter, self._loss, self.isRunning())
+
+
+if __name__ == "__main__":
+    pass
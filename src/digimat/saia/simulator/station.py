@@ -0,0 +1,167 @@
+from __future__ import division
+
+import random
+
+from ..node import SAIANode
+from ..codec import decodeFrame
+from ..codec import FRAME_TYPE_REQUEST
+from ..response import SAIAResponseNAK
+
+
+class SAIASimulatedStation(object):
+    """
+    One virtual EtherSBus station (PCD) of a SAIASimulatorFarm
+
+    The station is a SAIANode that is never started (no socket, no background task).
+    Its local memory holds the station data, and the received requests are processed
+    by the node own SAIANodeHandler and SAIAResponse* classes. Latency, jitter and
+    loss are applied by the farm when sending the reply.
+    """
+
+    def __init__(self, farm, host, lid, port, compact=True):
+        self._farm=farm
+        self._host=host
+        self._port=port
+        self._node=SAIANode(lid=lid, port=port, logger=farm.logger, autostart=False, scanner=False)
+        if compact:
+            self._node.memory.setCompactStorage()
+        self._latency=None
+        self._jitter=None
+        self._loss=None
+        self._countRequests=0
+        self._countReplies=0
+        self._countDropped=0
+        self._countErrors=0
+
+    @property
+    def farm(self):
+        return self._farm
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def memory(self):
+        return self._node.memory
+
+    @property
+    def logger(self):
+        return self._farm.logger
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def lid(self):
+        return self._node.lid
+
+    @property
+    def inputs(self):
+        return self.memory.inputs
+
+    @property
+    def outputs(self):
+        return self.memory.outputs
+
+    @property
+    def flags(self):
+        return self.memory.flags
+
+    @property
+    def registers(self):
+        return self.memory.registers
+
+    @property
+    def timers(self):
+        return self.memory.timers
+
+    @property
+    def counters(self):
+        return self.memory.counters
+
+    def setFaults(self, latency=None, jitter=None, loss=None):
+        """
+        Station specific faults (None to use the farm ones)
+        latency and jitter in seconds, loss as a probability (0..1)
+        """
+        self._latency=latency
+        self._jitter=jitter
+        self._loss=loss
+
+    def getLatency(self):
+        if self._latency is not None:
+            return self._latency
+        return self._farm._latency
+
+    def getJitter(self):
+        if self._jitter is not None:
+            return self._jitter
+        return self._farm._jitter
+
+    def getLoss(self):
+        if self._loss is not None:
+            return self._loss
+        return self._farm._loss
+
+    def computeReplyDelay(self):
+        """
+        Return the delay before sending the reply, or None if the request is lost
+        """
+        loss=self.getLoss()
+        if loss>0 and random.random()<loss:
+            return None
+        delay=self.getLatency()
+        jitter=self.getJitter()
+        if jitter>0:
+            delay+=random.uniform(0, jitter)
+        return delay
+
+    def processRequest(self, data):
+        """
+        Process a received datagram and return the reply frame (None if there is no reply)
+        """
+        self._countRequests+=1
+        message=decodeFrame(data)
+        if message is None:
+            self._countErrors+=1
+            return None
+
+        (mtype, mseq, payload)=message
+        if mtype!=FRAME_TYPE_REQUEST:
+            return None
+
+        try:
+            response=self._node.onRequest(mseq, payload)
+            if response:
+                data=response.data
+                if data is None:
+                    data=SAIAResponseNAK(self._node, mseq).data
+                self._countReplies+=1
+                return data
+        except:
+            self._countErrors+=1
+            self.logger.exception('%s:processRequest()' % self)
+
+    def onDrop(self):
+        self._countDropped+=1
+
+    def stats(self):
+        return {'requests': self._countRequests,
+            'replies': self._countReplies,
+            'dropped': self._countDropped,
+            'errors': self._countErrors}
+
+    def __repr__(self):
+        return '<%s(host=%s, port=%d, lid=%d, requests=%d, replies=%d, dropped=%d)>' % (self.__class__.__name__,
+            self._host, self._port, self.lid,
+            self._countRequests, self._countReplies, self._countDropped)
+
+
+if __name__ == "__main__":
+    pass
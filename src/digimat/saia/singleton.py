@@ -5,7 +5,8 @@ class Singleton(object):
         # return cls.instance
 
     def __new__(cls, *args, **kwds):
-        if not hasattr(cls, 'instance'):
+        # cls.__dict__ (not hasattr) : a subclass must not reuse the instance of its parent class
+        if 'instance' not in cls.__dict__:
             cls.instance=super(Singleton, cls).__new__(cls)
         return cls.instance
 
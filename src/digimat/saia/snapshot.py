@@ -0,0 +1,244 @@
+from __future__ import division
+
+import os
+import json
+import gzip
+import time
+import threading
+
+
+class SAIASnapshot(object):
+    """
+    On-disk snapshot of the node state, used for a warm start
+
+    Saved state : declared servers (host, port, lid, window), device information, loaded
+    symbols (.map) file name, compact storage mode and the declared items with their last
+    value and timestamp (local node memory included). After a restore, items are serving
+    their last known (stale) values immediately, keeping their original timestamp
+    (item.isStale(), item.age()), while being refreshed in the background. Lids and device
+    information are revalidated too. The file is JSON (gzip compressed if named *.gz),
+    written atomically, periodically (background thread) and when the node is stopped.
+    """
+
+    VERSION = 1
+    COLLECTIONS = ('inputs', 'outputs', 'flags', 'registers', 'timers', 'counters')
+
+    def __init__(self, node, fpath, period=60.0):
+        assert node.__class__.__name__=='SAIANode'
+        self._node=node
+        self._fpath=os.path.expanduser(fpath)
+        self._period=period
+        self._thread=None
+        self._running=False
+        self._eventStop=threading.Event()
+        self._stampSave=0
+        self._stampRestore=0
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def logger(self):
+        return self._node.logger
+
+    @property
+    def fpath(self):
+        return self._fpath
+
+    def collectMemory(self, memory):
+        data={}
+        for name in self.COLLECTIONS:
+            items=getattr(memory, name)
+            indexes=[]
+            values=[]
+            stamps=[]
+            with items._lock:
+                for item in items.all():
+                    indexes.append(item.index)
+                    values.append(item._value)
+                    stamps.append(item._stamp)
+            if indexes:
+                data[name]={'indexes': indexes, 'values': values, 'stamps': stamps}
+        return data
+
+    def collectServer(self, server):
+        mapfile=None
+        if server.symbols.count()>0 and server.symbols.filepath:
+            mapfile=os.path.basename(server.symbols.filepath)
+        with server._lock:
+            deviceInfo=dict(server._deviceInfo)
+        return {'host': server.host,
+            'port': server.port,
+            'lid': server._lid if server.isLidValid(server._lid) else None,
+            'window': server.link.getWindow(),
+            'compact': server.memory.registers.isCompactStorage(),
+            'deviceInfo': deviceInfo,
+            'mapfile': mapfile,
+            'memory': self.collectMemory(server.memory)}
+
+    def collect(self):
+        node=self._node
+        servers=[]
+        for server in node.servers.all():
+            try:
+                servers.append(self.collectServer(server))
+            except:
+                self.logger.exception('snapshot:collect(%s)' % server)
+        return {'version': self.VERSION,
+            'stamp': time.time(),
+            'lid': node.lid,
+            'local': self.collectMemory(node.memory),
+            'servers': servers}
+
+    def isCompressed(self):
+        return self._fpath.endswith('.gz')
+
+    def openFile(self, fpath, mode):
+        if self.isCompressed():
+            return gzip.open(fpath, mode+'t', encoding='utf-8')
+        return open(fpath, mode, encoding='utf-8')
+
+    def save(self, fpath=None):
+        """
+        Write the snapshot (atomic replace)
+        """
+        fpath=fpath or self._fpath
+        try:
+            t0=time.time()
+            data=self.collect()
+            tmp=fpath+'.tmp'
+            with self.openFile(tmp, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp, fpath)
+            self._stampSave=time.time()
+            self.logger.debug('snapshot saved to [%s] (%d servers, %.03fs)' % (fpath, len(data['servers']), time.time()-t0))
+            return True
+        except:
+            self.logger.exception('snapshot:save(%s)' % fpath)
+
+    def load(self, fpath=None):
+        fpath=fpath or self._fpath
+        try:
+            if os.path.exists(fpath):
+                with self.openFile(fpath, 'r') as f:
+                    data=json.load(f)
+                if data.get('version')==self.VERSION:
+                    return data
+                self.logger.warning('snapshot [%s] version mismatch' % fpath)
+        except:
+            self.logger.exception('snapshot:load(%s)' % fpath)
+
+    def restoreMemory(self, memory, data):
+        memory._stampWarmStart=self._stampRestore
+        count=0
+        for name in self.COLLECTIONS:
+            try:
+                column=data[name]
+            except KeyError:
+                continue
+            items=getattr(memory, name)
+            declared=[]
+            for (index, value, stamp) in zip(column['indexes'], column['values'], column['stamps']):
+                item=items._declare(index, value, pull=False)
+                if item:
+                    if stamp>0:
+                        with items._lock:
+                            # keep the original timestamp (stale value)
+                            item._stamp=stamp
+                        item.schedule()
+                        count+=1
+                    declared.append(item)
+            # revalidation (batch)
+            items.signalPullItems(declared)
+        return count
+
+    def checkMapFile(self, host, mapfile):
+        """
+        Only the .map file name is saved, the file is searched in the current node map file storage path
+        """
+        if mapfile:
+            path=self._node.getMapFileStoragePath()
+            fpath=mapfile
+            if path:
+                fpath=os.path.join(path, mapfile)
+            if not os.path.exists(os.path.expanduser(fpath)):
+                self.logger.warning('snapshot: map file [%s] of server %s not found (map file storage path [%s]), symbols not restored' % (mapfile,
+                    host, path))
+                return False
+        return True
+
+    def restoreServer(self, data):
+        node=self._node
+        server=node.servers.getFromHost(data['host'])
+        if server is None:
+            self.checkMapFile(data['host'], data.get('mapfile'))
+            server=node.servers.declare(data['host'], lid=data.get('lid'), port=data['port'],
+                mapfile=data.get('mapfile'), window=data.get('window'), compact=data.get('compact'))
+            if server is None:
+                return 0
+        for key, value in data.get('deviceInfo', {}).items():
+            server.setDeviceInfo(key, value)
+        if data.get('lid') is not None:
+            # the station number is revalidated (the device information is always re-read)
+            server.refreshStationNumber()
+        return self.restoreMemory(server.memory, data.get('memory', {}))
+
+    def restore(self, data=None):
+        """
+        Restore the servers and items from the snapshot file (or given data).
+        Return the number of restored item values (None if there is no snapshot)
+        """
+        if data is None:
+            data=self.load()
+        if not data:
+            return None
+
+        t0=time.time()
+        self._stampRestore=t0
+        count=0
+        try:
+            count+=self.restoreMemory(self._node.memory, data.get('local', {}))
+        except:
+            self.logger.exception('snapshot:restore(local)')
+        for server in data.get('servers', []):
+            try:
+                count+=self.restoreServer(server)
+            except:
+                self.logger.exception('snapshot:restore(%s)' % server.get('host'))
+
+        self.logger.info('warm start from snapshot [%s] (age %ds) : %d servers, %d items restored in %.03fs' % (self._fpath,
+            t0-data.get('stamp', t0), len(data.get('servers', [])), count, time.time()-t0))
+        return count
+
+    def run(self):
+        while not self._eventStop.wait(self._period):
+            self.save()
+
+    def start(self):
+        self._running=True
+        if self._thread is None and self._period:
+            self._eventStop.clear()
+            self._thread=threading.Thread(target=self.run, name='SAIASnapshot')
+            self._thread.daemon=True
+            self._thread.start()
+
+    def stop(self, save=True):
+        """
+        Stop the periodic save (restarted by start()), saving the snapshot if it was running
+        """
+        if self._thread is not None:
+            self._eventStop.set()
+            self._thread.join()
+            self._thread=None
+        if save and self._running:
+            self.save()
+        self._running=False
+
+    def __repr__(self):
+        return '<%s(%s, period=%ds, saved=%ds ago)>' % (self.__class__.__name__,
+            self._fpath, self._period or 0, time.time()-self._stampSave if self._stampSave else -1)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,297 @@
+from __future__ import division
+
+from array import array
+from threading import Condition
+
+
+class SAIAItemStore(object):
+    """
+    Column (array) storage of the items state of a SAIAItems collection (compact mode)
+
+    Values, push values, stamps, scheduler deadlines and state flags are kept in
+    arrays indexed by the item address, growing up to the highest declared index.
+    Rarely used per item attributes (refresh delay, formater, ...) are kept in a sparse
+    dict. Items are then only lightweight views (see SAIACompactItem) created on demand.
+    """
+
+    # flags column bits
+    FLAG_DECLARED = 0x01
+    FLAG_PUSH = 0x02
+    FLAG_PULL = 0x04
+    FLAG_VALUE = 0x08
+    FLAG_RAISED = 0x10
+    FLAG_CHANGED = 0x20
+    FLAG_UPDATED = 0x40
+
+    # values column range (int64)
+    VALUE_MIN = -(1 << 63)
+    VALUE_MAX = (1 << 63)-1
+
+    def __init__(self, boolean=False):
+        self._boolean=boolean
+        if boolean:
+            self._values=bytearray()
+            self._pushValues=bytearray()
+        else:
+            self._values=array('q')
+            self._pushValues=array('q')
+        self._stamps=array('d')
+        self._deadlines=array('d')
+        self._flags=bytearray()
+        self._queued=bytearray()
+        self._attributes={}
+        self._count=0
+        # shared by every waiting view (instead of one Event per item)
+        self._condition=Condition()
+
+    def size(self):
+        return len(self._flags)
+
+    def count(self):
+        return self._count
+
+    def grow(self, size):
+        n=size-len(self._flags)
+        if n>0:
+            self._values.extend(bytes(n) if self._boolean else array('q', [0])*n)
+            self._pushValues.extend(bytes(n) if self._boolean else array('q', [0])*n)
+            self._stamps.extend(array('d', [0.0])*n)
+            self._deadlines.extend(array('d', [0.0])*n)
+            self._flags.extend(bytes(n))
+            self._queued.extend(bytes(n))
+
+    def declare(self, index, value=0):
+        """
+        Mark the index as declared. Return False if it was already declared
+        """
+        self.grow(index+1)
+        if self._flags[index] & self.FLAG_DECLARED:
+            return False
+        self._flags[index]=self.FLAG_DECLARED
+        self.setValue(index, value)
+        self._count+=1
+        return True
+
+    def isDeclared(self, index):
+        try:
+            return bool(self._flags[index] & self.FLAG_DECLARED)
+        except IndexError:
+            return False
+
+    def indexes(self):
+        flags=self._flags
+        mask=self.FLAG_DECLARED
+        return [index for index in range(len(flags)) if flags[index] & mask]
+
+    def getValue(self, index):
+        if self._boolean:
+            return bool(self._values[index])
+        return self._values[index]
+
+    def coerceValue(self, value):
+        """
+        Return the value converted to the column type (bool, or int clamped to the column
+        range), None if the value isn't a number
+        """
+        try:
+            if self._boolean:
+                return bool(value)
+            return min(self.VALUE_MAX, max(self.VALUE_MIN, int(value)))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+    def setValue(self, index, value):
+        if value is None:
+            value=0
+        try:
+            self._values[index]=value
+        except (TypeError, ValueError, OverflowError):
+            self._values[index]=self.coerceValue(value) or 0
+
+    def getPushValue(self, index):
+        if self._boolean:
+            return bool(self._pushValues[index])
+        return self._pushValues[index]
+
+    def setPushValue(self, index, value):
+        if value is None:
+            value=0
+        try:
+            self._pushValues[index]=value
+        except (TypeError, ValueError, OverflowError):
+            self._pushValues[index]=self.coerceValue(value) or 0
+
+    def getStamp(self, index):
+        return self._stamps[index]
+
+    def setStamp(self, index, stamp):
+        self._stamps[index]=stamp
+
+    def getDeadline(self, index):
+        deadline=self._deadlines[index]
+        if deadline>0:
+            return deadline
+        return None
+
+    def setDeadline(self, index, deadline):
+        self._deadlines[index]=deadline or 0.0
+
+    def getQueued(self, index):
+        return self._queued[index]
+
+    def setQueued(self, index, queued):
+        self._queued[index]=queued
+
+    def getAttribute(self, index, name, default=None):
+        try:
+            return self._attributes[index][name]
+        except KeyError:
+            return default
+
+    def setAttribute(self, index, name, value):
+        self._attributes.setdefault(index, {})[name]=value
+
+    def isFlag(self, index, mask):
+        return bool(self._flags[index] & mask)
+
+    def setFlag(self, index, mask):
+        with self._condition:
+            self._flags[index] |= mask
+            self._condition.notify_all()
+
+    def clearFlag(self, index, mask):
+        with self._condition:
+            self._flags[index] &= ~mask
+
+    def waitFlag(self, index, mask, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: self._flags[index] & mask, timeout)
+
+    def memsize(self):
+        """
+        Approximate size (bytes) of the columns
+        """
+        size=0
+        for column in (self._values, self._pushValues, self._stamps, self._deadlines):
+            try:
+                size+=len(column)*column.itemsize
+            except AttributeError:
+                size+=len(column)
+        return size+len(self._flags)+len(self._queued)
+
+    def __repr__(self):
+        return '<%s(%d items, size=%d, %dKB)>' % (self.__class__.__name__,
+            self._count, self.size(), self.memsize()//1024)
+
+
+class SAIAItemStoreEvent(object):
+    """
+    threading.Event like access to one flag bit of a store item
+    """
+
+    __slots__ = ('_store', '_index', '_mask')
+
+    def __init__(self, store, index, mask):
+        self._store=store
+        self._index=index
+        self._mask=mask
+
+    def set(self):
+        self._store.setFlag(self._index, self._mask)
+
+    def clear(self):
+        self._store.clearFlag(self._index, self._mask)
+
+    def isSet(self):
+        return self._store.isFlag(self._index, self._mask)
+
+    is_set = isSet
+
+    def wait(self, timeout=None):
+        return bool(self._store.waitFlag(self._index, self._mask, timeout))
+
+
+def _column(getter, setter):
+    return property(lambda self: getter(self._parent._store, self._index),
+        lambda self, value: setter(self._parent._store, self._index, value))
+
+
+def _event(mask):
+    return property(lambda self: SAIAItemStoreEvent(self._parent._store, self._index, mask))
+
+
+def _attribute(name, default=None):
+    return property(lambda self: self._parent._store.getAttribute(self._index, name, default),
+        lambda self, value: self._parent._store.setAttribute(self._index, name, value))
+
+
+class SAIACompactItem(object):
+    """
+    Mixin turning a SAIAItem class into a view on a SAIAItemStore row
+
+    The item state attributes used by SAIAItem (_value, _stamp, _eventPull, ...) are
+    mapped to the store columns, so that the SAIAItem code is shared by both modes.
+    Views are not unique (two views of the same index are equal).
+    """
+
+    __slots__ = ()
+
+    _value = _column(SAIAItemStore.getValue, SAIAItemStore.setValue)
+    _pushValue = _column(SAIAItemStore.getPushValue, SAIAItemStore.setPushValue)
+    _stamp = _column(SAIAItemStore.getStamp, SAIAItemStore.setStamp)
+    _deadline = _column(SAIAItemStore.getDeadline, SAIAItemStore.setDeadline)
+    _queued = _column(SAIAItemStore.getQueued, SAIAItemStore.setQueued)
+
+    _eventPush = _event(SAIAItemStore.FLAG_PUSH)
+    _eventPull = _event(SAIAItemStore.FLAG_PULL)
+    _eventValue = _event(SAIAItemStore.FLAG_VALUE)
+    _eventRaised = _event(SAIAItemStore.FLAG_RAISED)
+    _eventChanged = _event(SAIAItemStore.FLAG_CHANGED)
+    _eventUpdated = _event(SAIAItemStore.FLAG_UPDATED)
+
+    # sparse attributes
+    _inhibitTimeout = _attribute('_inhibitTimeout', 0)
+    _delayRefresh = _attribute('_delayRefresh')
+    _readOnly = _attribute('_readOnly', False)
+    _formater = _attribute('_formater')
+    _stampTimer = _attribute('_stampTimer', 0)
+    _pushGeneration = _attribute('_pushGeneration', 0)
+
+    def validateValue(self, value):
+        # the columns only hold numbers : the validated value is converted (and clamped)
+        validated=self._parent._store.coerceValue(super(SAIACompactItem, self).validateValue(value))
+        if validated is None and value is not None:
+            self.logger.error('%s:invalid value %r (not a number)' % (self, value))
+        return validated
+
+    def __eq__(self, other):
+        try:
+            return self._index==other._index and self._parent is other._parent
+        except AttributeError:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self._parent), self._index))
+
+
+_compactItemTypes={}
+
+
+def compactItemType(itemType):
+    """
+    Return the (cached) compact view class of the given SAIAItem class
+    """
+    try:
+        return _compactItemTypes[itemType]
+    except KeyError:
+        cls=type('Compact%s' % itemType.__name__, (SAIACompactItem, itemType),
+            {'__slots__': ('_parent', '_index')})
+        _compactItemTypes[itemType]=cls
+        return cls
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,211 @@
+"""
+Change subscriptions
+
+Subscriptions are registered in the items collections (SAIAItems), by index (or for the
+whole collection), and are notified by item.setValue() when a value change is detected.
+There is thus no scan of the subscribed items, and no cost at all for the items without
+subscription. Analog changes can be filtered with an absolute and/or a percent deadband
+(relative to the last notified value). Callbacks are executed by an executor (default
+to the node SAIASubscriptionDispatcher thread, or any concurrent.futures executor),
+never by the node I/O thread. Events can also be pushed to a (queue.Queue like) queue.
+"""
+from __future__ import division
+
+import time
+import queue
+import threading
+
+
+class SAIAChangeEvent(object):
+    """
+    Item value change notification (previous is None for the initial value)
+    """
+
+    __slots__ = ('item', 'value', 'previous', 'stamp')
+
+    def __init__(self, item, value, previous, stamp=None):
+        self.item=item
+        self.value=value
+        self.previous=previous
+        self.stamp=stamp or time.time()
+
+    @property
+    def server(self):
+        return self.item.server
+
+    @property
+    def index(self):
+        return self.item.index
+
+    def __repr__(self):
+        return '<%s(%s, %s->%s)>' % (self.__class__.__name__, self.item, self.previous, self.value)
+
+
+class SAIASubscriptionDispatcher(object):
+    """
+    Single worker thread executing the subscription callbacks (in order) from a bounded
+    queue. Minimal executor interface (submit), calls are dropped (and counted) if full.
+    """
+
+    def __init__(self, logger, maxsize=65536):
+        self._logger=logger
+        self._queue=queue.Queue(maxsize)
+        self._lock=threading.Lock()
+        self._thread=None
+        self._calls=0
+        self._errors=0
+        self._dropped=0
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread=threading.Thread(target=self.run, name='SAIASubscriptions')
+                self._thread.daemon=True
+                self._thread.start()
+
+    def submit(self, function, *args):
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            self._dropped+=1
+
+    def run(self):
+        while True:
+            (function, args)=self._queue.get()
+            if function is None:
+                break
+            try:
+                self._calls+=1
+                function(*args)
+            except:
+                self._errors+=1
+                self.logger.exception('subscription callback %s' % function)
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            thread=self._thread
+            self._thread=None
+        if thread is not None:
+            # pending calls are executed before the sentinel
+            self._queue.put((None, None))
+            thread.join(timeout)
+
+    def stats(self):
+        return {'calls': self._calls, 'errors': self._errors, 'dropped': self._dropped, 'queued': self._queue.qsize()}
+
+    def __repr__(self):
+        return '<%s(calls=%d, queued=%d, errors=%d, dropped=%d)>' % (self.__class__.__name__,
+            self._calls, self._queue.qsize(), self._errors, self._dropped)
+
+
+class SAIASubscription(object):
+    """
+    Change subscription, notifying callback(event) through the executor and/or
+    pushing the SAIAChangeEvent to the given queue.
+
+    deadband         minimal absolute change (analog items)
+    deadbandPercent  minimal change in percent of the last notified value (analog items)
+    formater         SAIAValueFormater used to decode the values compared to the deadbands
+                     (default to the item formater if any, i.e. item.setFormater())
+    initial          also notify the first value received for each item
+    """
+
+    def __init__(self, callback=None, queue=None, deadband=0, deadbandPercent=0, formater=None,
+            initial=False, executor=None):
+        assert callback is not None or queue is not None
+        self._callback=callback
+        self._queue=queue
+        self._deadband=abs(deadband or 0)
+        self._deadbandPercent=abs(deadbandPercent or 0)
+        self._formater=formater
+        self._initial=initial
+        self._executor=executor
+        # last notified values (deadband references)
+        self._references={}
+        self._registrations=[]
+        self._count=0
+        self._filtered=0
+        self._dropped=0
+
+    def attach(self, items, index=None):
+        """
+        Register the subscription in the items collection for the given index
+        (or for every item of the collection if index is None)
+        """
+        if self._executor is None and self._callback is not None:
+            self._executor=items.server.node.dispatcher
+        if items.addSubscription(self, index):
+            self._registrations.append((items, index))
+
+    def unsubscribe(self):
+        for (items, index) in self._registrations:
+            items.removeSubscription(self, index)
+        self._registrations=[]
+        self._references={}
+
+    def isActive(self):
+        if self._registrations:
+            return True
+        return False
+
+    def decode(self, item, value):
+        formater=self._formater or getattr(item, '_formater', None)
+        if formater is not None:
+            try:
+                return formater.decode(value)
+            except:
+                pass
+        return value
+
+    def isOutsideDeadband(self, item, reference, value):
+        if type(value)==bool:
+            return True
+        try:
+            delta=abs(self.decode(item, value)-self.decode(item, reference))
+            if delta<=self._deadband:
+                return False
+            if self._deadbandPercent and delta<=abs(self.decode(item, reference))*self._deadbandPercent/100.0:
+                return False
+        except:
+            pass
+        return True
+
+    def notify(self, item, value, previous):
+        """
+        Called by the items collection (item.setValue() caller thread) on value change
+        """
+        if self._deadband or self._deadbandPercent:
+            key=(id(item._parent), item._index)
+            if previous is not None:
+                reference=self._references.setdefault(key, previous)
+                if not self.isOutsideDeadband(item, reference, value):
+                    self._filtered+=1
+                    return
+            self._references[key]=value
+
+        if previous is None and not self._initial:
+            return
+
+        self._count+=1
+        event=SAIAChangeEvent(item, value, previous)
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait(event)
+            except:
+                self._dropped+=1
+        if self._callback is not None:
+            self._executor.submit(self._callback, event)
+
+    def __repr__(self):
+        return '<%s(%d registrations, notified=%d, filtered=%d, deadband=%s, deadbandPercent=%s)>' % (self.__class__.__name__,
+            len(self._registrations), self._count, self._filtered, self._deadband, self._deadbandPercent)
+
+
+if __name__ == "__main__":
+    pass
@@ -3,11 +3,8 @@ import os
 from threading import RLock
 from datetime import datetime
 
-from prettytable import PrettyTable
-
 import re
 import unicodedata
-import unidecode
 
 
 class SAIASymbol(object):
@@ -236,6 +233,10 @@ class SAIASymbols(object):
         with self._lock:
             return len(self._symbols)
 
+    @property
+    def filepath(self):
+        return self._filepath
+
     def get(self, key):
         with self._lock:
             try:
@@ -354,6 +355,7 @@ class SAIASymbols(object):
     def load(self, filename, path=None):
         try:
             if not self._symbols:
+                import unidecode
                 fpath=unidecode.unidecode(filename)
                 if path:
                     fpath=os.path.join(path, filename)
@@ -428,6 +430,7 @@ class SAIASymbols(object):
             symbols=self.all()
 
         if symbols and len(symbols)>0:
+            from prettytable import PrettyTable
             t=PrettyTable()
             t.field_names = ['tag', 't', 'index']
             t.align['tag']='l'
@@ -0,0 +1,161 @@
+"""
+Request lifecycle tracing (Chrome trace-event JSON export)
+
+Traced stages
+-------------
+pull      item queued for refresh (signalPull) -> item value updated (setValue)
+wait      request initiated on the link (queued) -> first transmission (sendto)
+rtt       transmission -> response (or ack/nak) received
+response  response decoding, including the items update
+request   request initiated -> request terminated (success or failure)
+retry, timeout (instant events)
+
+Hooks only test SAIATRACER.enabled when the tracer is disabled. When enabled,
+spans are recorded in a bounded ring buffer (the oldest spans are dropped) and
+can be exported as Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev),
+one row per server host.
+"""
+from __future__ import division
+
+import os
+import json
+import time
+import threading
+from collections import deque
+
+
+class SAIATracer(object):
+
+    DEFAULT_SIZE = 65536
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.enabled=False
+        self._lock=threading.Lock()
+        self._size=size
+        self._events=deque(maxlen=size)
+        self._pending={}
+        self._origin=time.perf_counter()
+        self._dropped=0
+
+    def enable(self, size=None):
+        """
+        Start recording (the ring buffer is resized and cleared if size is given)
+        """
+        if size is not None and size!=self._size:
+            with self._lock:
+                self._size=int(size)
+                self._events=deque(maxlen=self._size)
+                self._pending={}
+        self.enabled=True
+
+    def disable(self):
+        self.enabled=False
+
+    def isEnabled(self):
+        return self.enabled
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._pending={}
+            self._dropped=0
+
+    def now(self):
+        """
+        Current trace timestamp (microseconds)
+        """
+        return (time.perf_counter()-self._origin)*1e6
+
+    def record(self, phase, name, category, host, ts, duration=0, args=None):
+        with self._lock:
+            if len(self._events)==self._size:
+                self._dropped+=1
+            self._events.append((phase, name, category, host, ts, duration, args))
+
+    def span(self, name, category, host, start, end=None, args=None):
+        """
+        Record a complete span from start (trace timestamp) to end (default now)
+        """
+        if start:
+            if end is None:
+                end=self.now()
+            self.record('X', name, category, host, start, max(0, end-start), args)
+
+    def instant(self, name, category, host, args=None):
+        self.record('i', name, category, host, self.now(), 0, args)
+
+    def begin(self, key):
+        """
+        Remember the start of a span to be closed later by end(key)
+        """
+        pending=self._pending
+        if len(pending)>=self._size:
+            # bounded (never closed spans are dropped)
+            try:
+                del pending[next(iter(pending))]
+            except:
+                pass
+        pending[key]=self.now()
+
+    def end(self, key, name, category, host, args=None):
+        start=self._pending.pop(key, None)
+        if start is not None:
+            self.span(name, category, host, start, None, args)
+
+    def count(self):
+        return len(self._events)
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def export(self):
+        """
+        Return the recorded spans as a Chrome trace-event dict
+        """
+        pid=os.getpid()
+        tids={}
+        result=[]
+        for (phase, name, category, host, ts, duration, args) in self.events():
+            tid=tids.get(host)
+            if tid is None:
+                tid=len(tids)+1
+                tids[host]=tid
+            event={'name': name, 'cat': category, 'ph': phase, 'ts': round(ts, 3), 'pid': pid, 'tid': tid}
+            if phase=='X':
+                event['dur']=round(duration, 3)
+            else:
+                event['s']='t'
+            if args:
+                event['args']=args
+            result.append(event)
+
+        metadata=[{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'digimat.saia'}}]
+        for host, tid in tids.items():
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': str(host)}})
+
+        return {'traceEvents': metadata+result,
+            'displayTimeUnit': 'ms',
+            'otherData': {'dropped': self._dropped}}
+
+    def toJSON(self):
+        return json.dumps(self.export())
+
+    def save(self, fpath):
+        """
+        Write the Chrome trace-event JSON file
+        """
+        with open(fpath, 'w') as f:
+            json.dump(self.export(), f)
+        return True
+
+    def __repr__(self):
+        return '<%s(enabled=%d, %d/%d events, dropped=%d, pending=%d)>' % (self.__class__.__name__,
+            self.enabled, self.count(), self._size, self._dropped, len(self._pending))
+
+
+SAIATRACER=SAIATracer()
+
+
+if __name__ == "__main__":
+    pass
@@ -135,7 +135,7 @@ class SAIATransfer(object):
                                 self.stop(False)
                         else:
                             if not self._request.isActive():
-                                if self.link.isIdle():
+                                if self.link.isAvailable():
                                     self._request.initiate()
                                     activity=True
                     else:
@@ -258,6 +258,7 @@ class SAIATransferQueue(object):
         if self.isDebug():
             self.logger.debug('queue:%s (size=%d)' % (transfer.__class__.__name__,
                                     self._queue.qsize()))
+        self.server.wakeup()
 
     def getNextTransfer(self):
         try:
@@ -265,6 +266,19 @@ class SAIATransferQueue(object):
         except:
             pass
 
+    def getNextDeadline(self):
+        transfer=self._transfer
+        if transfer:
+            request=transfer._request
+            if transfer.isDone() or request is None or request.isDone():
+                return time.time()
+            if not request.isActive() and self.server.link.isAvailable():
+                return time.time()
+            # response (or link timeout) will wakeup the manager
+            return transfer._timeoutWatchdog
+        if self.count()>0:
+            return time.time()
+
     def manager(self):
         activity=False
         if self._transfer:
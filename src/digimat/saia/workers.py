@@ -0,0 +1,407 @@
+"""
+Multi-process mode
+
+The servers are partitioned across worker processes, each one running its own SAIANode
+(own UDP socket bound to a distinct port, own I/O thread and thus own GIL), allowing a
+single gateway to use every core when polling a large number of PCDs. The parent node
+keeps the local node (listener on the node port) and its own servers, if any.
+
+Results are aggregated without any IPC round trip : every worker exports the memory of
+its servers to shared memory segments (SAIASharedMemoryExporter, prefix '<prefix>w<n>'),
+read by the parent with SAIASharedMemoryReader. Commands (servers and items declaration,
+writes, stats) are sent to the workers through a pipe.
+
+Note : distinct ports are used instead of SO_REUSEPORT, since the kernel balances the
+datagrams of a reuseport group by hashing the addresses and ports, and a response would
+not necessarily be delivered to the worker owning the server. With the default 'spawn'
+start method, the main module must be protected by an if __name__=='__main__' guard, and
+the setup function (called in every worker with its node) must be a top level function.
+"""
+from __future__ import division
+
+import os
+import time
+import threading
+
+
+def workerMain(config, conn):
+    """
+    Worker process entry point
+    """
+    from .node import SAIANode
+    node=SAIANode(lid=config['lid'], port=config['port'], engine=config['engine'], autostart=False)
+    node.start()
+    node.enableSharedMemoryExport(config['prefix'], config['period'], config['path'], config['capacity'])
+    if config['setup'] is not None:
+        try:
+            config['setup'](node)
+        except:
+            node.logger.exception('worker:setup()')
+    SAIAWorkerRunner(node, conn).run()
+
+
+class SAIAWorkerRunner(object):
+    """
+    Worker side : execute the commands received from the parent (SAIAWorker.call())
+    """
+
+    def __init__(self, node, conn):
+        self._node=node
+        self._conn=conn
+
+    @property
+    def logger(self):
+        return self._node.logger
+
+    def getServer(self, host):
+        server=self._node.servers.getFromHost(host)
+        if server is None:
+            raise KeyError('server %s not declared' % host)
+        return server
+
+    def doDeclare(self, host, lid=None, port=None, mapfile=None, window=None):
+        server=self._node.servers.declare(host, lid=lid, port=port, mapfile=mapfile, window=window)
+        if server is not None:
+            return True
+        return False
+
+    def doItems(self, host, name, index, count=1):
+        items=getattr(self.getServer(host), name)
+        return len([item for item in items.declareRange(index, count) if item])
+
+    def doWrite(self, host, name, index, value):
+        item=getattr(self.getServer(host), name)[index]
+        if item is None:
+            return False
+        item.value=value
+        return True
+
+    def doRefresh(self, host=None):
+        if host is None:
+            self._node.refresh()
+        else:
+            self.getServer(host).refresh()
+        return True
+
+    def doStats(self):
+        servers=self._node.servers
+        return {'pid': os.getpid(),
+            'port': self._node._port,
+            'servers': servers.count(),
+            'alive': len([server for server in servers.all() if server.isAlive()]),
+            'suspended': len(servers.suspended())}
+
+    def run(self):
+        while True:
+            try:
+                (command, args)=self._conn.recv()
+            except (EOFError, OSError):
+                # parent gone
+                break
+            if command=='stop':
+                break
+            try:
+                result=getattr(self, 'do%s' % command.capitalize())(*args)
+                reply=(True, result)
+            except Exception as e:
+                self.logger.exception('worker:%s%s' % (command, args))
+                reply=(False, repr(e))
+            try:
+                self._conn.send(reply)
+            except:
+                break
+
+        self._node.stop()
+        try:
+            self._conn.send((True, None))
+        except:
+            pass
+
+
+class SAIAWorker(object):
+    """
+    Parent side handle of a worker process
+    """
+
+    TIMEOUT = 10.0
+
+    def __init__(self, pool, index, port):
+        self._pool=pool
+        self._index=index
+        self._port=port
+        self._prefix='%sw%d' % (pool.prefix, index)
+        self._hosts=[]
+        self._lock=threading.Lock()
+        self._conn=None
+        self._process=None
+
+    @property
+    def logger(self):
+        return self._pool.logger
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @property
+    def hosts(self):
+        return self._hosts
+
+    @property
+    def pid(self):
+        try:
+            return self._process.pid
+        except:
+            pass
+
+    def start(self):
+        if self._process is None:
+            context=self._pool.context
+            (self._conn, conn)=context.Pipe()
+            config=self._pool.config()
+            config['port']=self._port
+            config['prefix']=self._prefix
+            self._process=context.Process(target=workerMain, args=(config, conn),
+                name='SAIAWorker%d' % self._index)
+            self._process.daemon=True
+            self._process.start()
+            conn.close()
+            self.logger.info('worker %d started (pid=%d, port=%d)' % (self._index, self._process.pid, self._port))
+
+    def isAlive(self):
+        try:
+            return self._process.is_alive()
+        except:
+            pass
+        return False
+
+    def call(self, command, *args):
+        """
+        Execute the given command in the worker process and return its result (None on error)
+        """
+        with self._lock:
+            try:
+                self._conn.send((command, args))
+                if self._conn.poll(self.TIMEOUT):
+                    (success, result)=self._conn.recv()
+                    if success:
+                        return result
+                    self.logger.error('worker %d:%s%s failed (%s)' % (self._index, command, args, result))
+                else:
+                    self.logger.error('worker %d:%s%s timeout!' % (self._index, command, args))
+            except:
+                self.logger.exception('worker %d:%s' % (self._index, command))
+
+    def stop(self, timeout=5.0):
+        if self._process is not None:
+            if self.isAlive():
+                self.call('stop')
+                self._process.join(timeout)
+                if self._process.is_alive():
+                    self.logger.warning('worker %d not terminated, killed' % self._index)
+                    self._process.terminate()
+                    self._process.join()
+            try:
+                self._conn.close()
+            except:
+                pass
+            self._process=None
+            self._conn=None
+
+    def __repr__(self):
+        return '<%s(index=%d, pid=%s, port=%d, %d servers, alive=%d)>' % (self.__class__.__name__,
+            self._index, self.pid, self._port, len(self._hosts), self.isAlive())
+
+
+class SAIAWorkerPool(object):
+    """
+    Servers partitioned across count worker processes (default to the number of cores).
+    Worker n binds its UDP socket to port+n (port defaults to the node port+1)
+
+    >>> pool=node.enableWorkers(4)
+    >>> pool.declare('192.168.0.48', lid=2)
+    >>> pool.declareItems('192.168.0.48', 'registers', 0, 100)
+    >>> pool.value('192.168.0.48', 'registers', 10)
+    (2150, 1712345678.12)
+    >>> pool.write('192.168.0.48', 'registers', 10, 2151)
+    """
+
+    def __init__(self, node, count=None, port=None, setup=None, engine=None,
+            prefix='saia', period=0.5, path=None, capacity=None, method='spawn'):
+        assert node.__class__.__name__=='SAIANode'
+        import multiprocessing
+        self._node=node
+        self._count=max(1, int(count or os.cpu_count() or 1))
+        self._port=int(port or node._port+1)
+        self._setup=setup
+        self._engine=engine or node._engineType
+        self._prefix=prefix
+        self._period=period
+        self._path=path
+        self._capacity=capacity
+        self._context=multiprocessing.get_context(method)
+        self._workers=[SAIAWorker(self, n, self._port+n) for n in range(self._count)]
+        self._workerByHost={}
+        self._readers={}
+        self._lock=threading.Lock()
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def logger(self):
+        return self._node.logger
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @property
+    def context(self):
+        return self._context
+
+    def config(self):
+        return {'lid': self._node.lid,
+            'engine': self._engine,
+            'period': self._period,
+            'path': self._path,
+            'capacity': self._capacity,
+            'setup': self._setup}
+
+    def workers(self):
+        return list(self._workers)
+
+    def count(self):
+        return self._count
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers={}
+        for worker in self._workers:
+            worker.stop()
+
+    def getWorker(self, host):
+        return self._workerByHost.get(host)
+
+    def declare(self, host, lid=None, port=None, mapfile=None, window=None):
+        """
+        Declare the server in the least loaded worker. Return the worker (None on error)
+        """
+        from .server import SAIAServer
+        with self._lock:
+            worker=self._workerByHost.get(host)
+            if worker is None:
+                worker=min(self._workers, key=lambda w: len(w.hosts))
+                if not worker.call('declare', host, lid, port or SAIAServer.UDP_DEFAULT_PORT, mapfile, window):
+                    return None
+                worker.hosts.append(host)
+                self._workerByHost[host]=worker
+            return worker
+
+    def declareRange(self, ip, count, lid=None, port=None):
+        import ipaddress
+        workers=[]
+        ip=ipaddress.ip_address(ip)
+        for n in range(count):
+            workers.append(self.declare(str(ip), lid=lid, port=port))
+            ip+=1
+            if lid:
+                lid+=1
+        return workers
+
+    def hosts(self):
+        return list(self._workerByHost.keys())
+
+    def call(self, host, command, *args):
+        worker=self.getWorker(host)
+        if worker is None:
+            self.logger.error('server %s not declared in the workers' % host)
+            return None
+        return worker.call(command, host, *args)
+
+    def declareItems(self, host, name, index, count=1):
+        """
+        Declare count items of the given collection ('registers', 'flags', ...) from index
+        """
+        return self.call(host, 'items', name, index, count)
+
+    def write(self, host, name, index, value):
+        return self.call(host, 'write', name, index, value)
+
+    def refresh(self, host=None):
+        if host is not None:
+            return self.call(host, 'refresh')
+        for worker in self._workers:
+            worker.call('refresh')
+
+    def reader(self, host):
+        """
+        Shared memory reader of the given server (None if not yet exported by its worker)
+        """
+        with self._lock:
+            reader=self._readers.get(host)
+            if reader is None:
+                worker=self._workerByHost.get(host)
+                if worker is not None:
+                    try:
+                        from .sharedmem import SAIASharedMemoryReader
+                        # the workers share the resource tracker of this process
+                        reader=SAIASharedMemoryReader(host, worker.prefix, self._path, untrack=False)
+                        self._readers[host]=reader
+                    except:
+                        pass
+            return reader
+
+    def read(self, host, name, index=0, count=1):
+        """
+        Return the list of the (value, stamp) of count items from index (None if not available)
+        """
+        reader=self.reader(host)
+        if reader is not None:
+            return reader.read(name, index, count)
+
+    def value(self, host, name, index):
+        values=self.read(host, name, index, 1)
+        if values:
+            return values[0]
+
+    def stats(self):
+        return [worker.call('stats') for worker in self._workers]
+
+    def waitReady(self, timeout=10.0):
+        """
+        Wait until every declared server is exported by its worker
+        """
+        timeout=time.time()+timeout
+        while time.time()<timeout:
+            if all(self.reader(host) is not None for host in self.hosts()):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def dump(self):
+        for worker in self._workers:
+            print(worker)
+
+    def __repr__(self):
+        return '<%s(%d workers, %d servers, ports %d-%d)>' % (self.__class__.__name__,
+            self._count, len(self._workerByHost), self._port, self._port+self._count-1)
+
+
+if __name__ == "__main__":
+    pass